@@ -1,17 +1,35 @@
-from flask import Flask, jsonify, send_file, request
+from flask import Flask, Response, jsonify, send_file, request
 import firebase_admin
 from firebase_admin import credentials, db, storage
-import pandas as pd
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import cv2
-import face_recognition
 import numpy as np
-import pickle
 from flask_cors import CORS
+from werkzeug.serving import WSGIRequestHandler
 import base64
+import time
 from threading import Lock
 from collections import defaultdict
+from gallery_index import create_matcher
+from gallery import DEFAULT_GALLERY_PATH
+from gallery_reload import GalleryReloader
+from roster import RosterCache
+from attendance_writer import commit_attendance, marked_on
+from attendance_log import AttendanceLog, AttendanceFlusher, DEFAULT_LOG_PATH
+from session_store import SessionStore, SharedSessionStore
+from metrics import (
+    timed, start_collecting, stop_collecting, exposition, Gauge,
+    FRAMES, FACES_PER_FRAME, REQUEST_SECONDS, STUDENTS_MARKED
+)
+from export import attendance_table, section_courses, workbook_bytes, csv_chunks, XLSX_MIMETYPE
+from tracker import FaceTracker, box_iou
+from motion import SceneGate, thumbnail, thumbnail_from_bytes
+from voting import EvidenceAccumulator
+from recognition import analyze_frame, detect_faces, encode_faces, match_faces, to_frame_box
+from detection import FaceDetector
+from inference import InferenceEngine, EngineBusy, FrameDropped, WorkerCrashed
+from startup import Startup
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -23,32 +41,258 @@ firebase_admin.initialize_app(cred, {
     'storageBucket': "attendance-system-realtime.appspot.com"
 })
 
-# Load face encodings
-with open("backend/Encode.p", "rb") as file:
-    encodeListKnownWithIDs = pickle.load(file)
-encodeListKnown, studentIDs = encodeListKnownWithIDs
+# Loading the gallery, recovering sessions and warming up the models run in the
+# background while the server already answers /healthz; /readyz reports when
+# they are done. BACKGROUND_STARTUP=0 does them while the app is imported.
+background_startup = os.environ.get("BACKGROUND_STARTUP", "1") == "1"
+
+# Load face encodings (memory-mapped, shared with the inference workers)
+gallery_path = os.environ.get("GALLERY_PATH", DEFAULT_GALLERY_PATH)
+
+# Gallery index: "exact" brute force, or "ivf" for campus-scale galleries
+gallery_index = os.environ.get("GALLERY_INDEX", "exact")
+
+# The gallery file is checked every GALLERY_RELOAD_INTERVAL seconds (0: only on
+# /admin/reload_gallery); a new version is indexed in the background and swapped in
+gallery_reloader = GalleryReloader(
+    gallery_path,
+    lambda gallery: create_matcher(gallery.encodings, gallery.student_ids, gallery_index),
+    interval=float(os.environ.get("GALLERY_RELOAD_INTERVAL", 10)),
+    on_swap=lambda previous, current: gallery_swapped(previous, current),
+    load=not background_startup,
+    prepare=lambda previous, new: prepare_gallery(previous, new)
+)
+
+# Face detector backend (hog, haar or dnn) and the smallest face it has to find,
+# in camera pixels (MIN_FACE_SIZE) or, with MIN_FACE_FRACTION, relative to the
+# frame height; the detection scale is derived from these per frame
+face_detector = FaceDetector(
+    backend=os.environ.get("FACE_DETECTOR", "hog"),
+    min_face_size=int(os.environ.get("MIN_FACE_SIZE", 160)),
+    min_face_fraction=float(os.environ["MIN_FACE_FRACTION"]) if os.environ.get("MIN_FACE_FRACTION") else None,
+    dnn_model=os.environ.get("FACE_DNN_MODEL"),
+    dnn_config=os.environ.get("FACE_DNN_CONFIG")
+)
+
+# Seconds between full-frame scans; in between, only the regions around known
+# faces are searched. 0 scans the full frame every time.
+full_scan_interval = float(os.environ.get("FULL_SCAN_INTERVAL", 0))
+
+# Frames that barely differ from the last analyzed one reuse its result; a full
+# pass still runs every MOTION_FORCE_INTERVAL seconds. MOTION_GATING=0 analyzes every frame.
+motion_gating = os.environ.get("MOTION_GATING", "1") == "1"
+motion_force_interval = float(os.environ.get("MOTION_FORCE_INTERVAL", 5))
+
+# A student is committed after this many consistent sightings across frames,
+# or earlier once the summed match confidence reaches the score
+vote_min_sightings = int(os.environ.get("VOTE_MIN_SIGHTINGS", 3))
+vote_min_score = float(os.environ.get("VOTE_MIN_SCORE", 1.2))
+
+# Face detection and encoding run in a pool of worker processes; set
+# INFERENCE_WORKERS=0 to run them inline in the request thread instead
+inference_workers = int(os.environ.get("INFERENCE_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+inference_engine = InferenceEngine(
+    gallery_path, workers=inference_workers, detector=face_detector, index_backend=gallery_index
+) if inference_workers else None
+
+# Section rosters are read from Firebase once and served from memory afterwards
+roster_cache = RosterCache(db.reference, ttl=300)
+
+# Detections are written to a local log before a frame returns and pushed to
+# Firebase in the background; sessions still open in the log are recovered on startup
+attendance_log = AttendanceLog(os.environ.get("ATTENDANCE_LOG_PATH", DEFAULT_LOG_PATH))
+attendance_flusher = AttendanceFlusher(
+    attendance_log, db.reference, interval=float(os.environ.get("ATTENDANCE_FLUSH_INTERVAL", 2.0))
+)
+attendance_flusher.start()
 
 class AttendanceSession:
-    def __init__(self):
+    def __init__(self, major, section, course, gallery=None, roster=None, start_time=None):
+        self.major = major
+        self.section = section
+        self.course = course
+        self.session_id = f"{major}_{section}_{course}"
+        self.lock = Lock()  # Serializes the frames and the stop of this session
         self.active = True
-        self.start_time = datetime.now()
+        self.start_time = start_time or datetime.now()
+        self.last_active = time.time()  # Last frame, for idle expiry
         self.detected_students = set()  # Store student IDs that have been detected
-        self.processed_faces = {}  # Dictionary to store face encodings and their last detection time
-        self.detection_cooldown = 300  # 5 minutes cooldown before processing the same face again
+        self.tracker = FaceTracker()  # Faces followed across frames, with their recognized identity
+        self.last_full_scan = None  # When the whole frame was last searched for faces
+        # Skips frames where nothing moved; the faces of the last analyzed frame are reused
+        self.scene = SceneGate(
+            force_interval=motion_force_interval,
+            min_region=2 * face_detector.min_face_size,
+            min_region_fraction=2 * face_detector.min_face_fraction if face_detector.min_face_fraction is not None else None
+        ) if motion_gating else None
+        self.last_faces = []
+        # Matches collected across frames; students are only marked once committed here
+        self.evidence = EvidenceAccumulator(
+            min_sightings=vote_min_sightings, min_score=vote_min_score
+        )
+        self.gallery = gallery  # Gallery restricted to the students enrolled in this course
+        self.gallery_source = None  # Matcher the course gallery was cut from
+        self.roster = roster  # Cached roster of the session's section
+
+def end_session(session_id, session, stopped_at=None):
+    """
+    Commit the attendance of a session that was taken out of the session store.
+    Returns the commit results, or None when the session was already stopped
+    (by another request or worker). Students that failed are committed again
+    in the background.
+    """
+    stopped_at = stopped_at or datetime.now()
+    # Only one request, in any worker, gets to commit a session
+    if not attendance_log.stop_session(session_id, stopped_at):
+        return None
+    with session.lock:
+        session.active = False
+        detected_students = set(session.detected_students)
+    if inference_engine is not None:
+        inference_engine.forget(session_id)
+    
+    # Log the lecture and update the cached counts in Firebase with one multi-path update
+    results = commit_attendance(
+        db.reference, session.major, session.section, session.course, detected_students, stopped_at,
+        started_at=session.start_time
+    )
+    
+    failed_students = [student_id for student_id, error in results.items() if error]
+    if failed_students:
+        # The session stays in the log with all its detections; the flusher commits it again
+        attendance_log.mark_commit_failed(session_id, time.time() + attendance_flusher.commit_retry_interval)
+        print(f"Commit of session {session_id} failed for {len(failed_students)} students, will be retried")
+    else:
+        # The counts are written; the flusher drops the session from the log and LiveSessions
+        attendance_log.mark_committed(session_id)
+        attendance_flusher.wake()
+    
+    # Counts and last_marked changed, the cached roster is stale
+    roster_cache.invalidate(session.major, session.section)
+    return results
+
+# Active sessions: "memory" keeps them in this process, "shared" lets several
+# worker processes serve the same sessions through the attendance log. Sessions
+# without frames for SESSION_IDLE_TIMEOUT seconds are ended like a stop.
+session_idle_timeout = float(os.environ.get("SESSION_IDLE_TIMEOUT", 1800))
+if os.environ.get("SESSION_STORE", "memory") == "shared":
+    session_store = SharedSessionStore(
+        attendance_log, lambda *args: open_session(*args), session_idle_timeout, end_session
+    )
+else:
+    session_store = SessionStore(session_idle_timeout, end_session)
+session_store.start_sweeper()
 
-processing_sessions = {}
-attendance_lock = Lock()
+def prepare_gallery(previous, new):
+    """Start the inference workers on a newly loaded gallery before it is swapped in"""
+    # The new workers start and warm up here, in the reloader's thread; frames keep
+    # going to the old ones meanwhile. If they fail to start, the gallery is not
+    # swapped in and the next check tries again. The first gallery's workers start
+    # with the warm-up.
+    if inference_engine is not None and previous is not None:
+        inference_engine.reload(warmup_frame())
+
+def gallery_swapped(previous, current):
+    """Move the active sessions to a newly loaded gallery"""
+    for session in session_store.sessions():
+        try:
+            enrolled_students = session.roster.enrolled(session.course)
+            course_gallery = current.matcher.subset(enrolled_students.keys())
+        except Exception as e:
+            # Its next frame cuts the course gallery instead (see session_gallery)
+            print(f"Error moving session {session.session_id} to the new gallery: {e}")
+            continue
+        with session.lock:
+            session.gallery, session.gallery_source = course_gallery, current.matcher
+
+def session_gallery(session, matcher, enrolled_students):
+    """The session's course gallery, cut again when it is not from the gallery in use"""
+    if session.gallery_source is not matcher:
+        session.gallery = matcher.subset(enrolled_students.keys())
+        session.gallery_source = matcher
+    return session.gallery
+
+gallery_reloader.start()
+
+# Metrics read when /metrics is scraped
+Gauge("attendance_inference_pending", "Frames queued or running in the inference pool",
+      function=lambda: inference_engine.pending if inference_engine is not None else 0)
+Gauge("attendance_active_sessions", "Attendance sessions held by this process",
+      function=lambda: len(session_store))
+Gauge("attendance_gallery_encodings", "Encodings in the loaded gallery",
+      function=lambda: len(gallery_reloader.current.gallery) if gallery_reloader.loaded else 0)
+
+# With PROFILE_REQUESTS=1, a request with ?profile=1 gets the time of each of its
+# stages in milliseconds added to its JSON response under "profile"
+profile_requests = os.environ.get("PROFILE_REQUESTS") == "1"
+
+@app.before_request
+def start_request_timer():
+    request.started_at = time.perf_counter()
+    request.timings = start_collecting() if profile_requests and request.args.get('profile') == '1' else None
+
+# Routes that need the gallery answer 503 right away until it is loaded
+GALLERY_ENDPOINTS = {"start_attendance", "process_frame", "detect_frame"}
+
+@app.before_request
+def require_gallery():
+    if request.endpoint in GALLERY_ENDPOINTS and not gallery_reloader.loaded:
+        return jsonify({"status": "error", "message": "The gallery is still loading"}), 503
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - request.started_at
+    REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint or "unknown")
+    if request.timings is not None:
+        stop_collecting(request.timings)
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body["profile"] = {
+                "total_ms": round(elapsed * 1000, 3),
+                **{stage: round(seconds * 1000, 3) for stage, seconds in request.timings.items()}
+            }
+            response.set_data(app.json.dumps(body))
+    return response
 
 # Routes
 @app.route('/')
 def index():
     return "Attendance System Backend"
 
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process answers, whether or not its startup finished
+    return jsonify({"status": "alive"})
+
+@app.route('/readyz')
+def readyz():
+    status = startup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/metrics')
+def metrics():
+    return Response(exposition(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/reload_gallery', methods=['POST'])
+def reload_gallery():
+    """Load the gallery file now if it changed (or always, with ?force=1)"""
+    try:
+        reloaded = gallery_reloader.reload(force=request.args.get('force') == '1')
+        current = gallery_reloader.current
+        return jsonify({
+            "status": "success",
+            "reloaded": reloaded,
+            "encodings": len(current.gallery),
+            "loaded_at": datetime.fromtimestamp(current.loaded_at).isoformat()
+        })
+    except Exception as e:
+        print(f"Error reloading gallery: {e}")
+        return jsonify({"status": "error", "message": f"Failed to reload gallery: {str(e)}"}), 500
+
 @app.route('/get_courses/<major>/<section>')
 def get_courses(major, section):
     try:
-        ref = db.reference(f"Majors/{major}/Sections/{section}/Students")
-        students = ref.get()
+        students = roster_cache.section(major, section).get()
         
         if not students:
             return jsonify([])
@@ -68,7 +312,9 @@ def get_courses(major, section):
 def start_attendance(major, section, course):
     try:
         session_id = f"{major}_{section}_{course}"
-        processing_sessions[session_id] = AttendanceSession()
+        session = open_session(major, section, course)
+        attendance_log.open_session(session_id, major, section, course, session.start_time)
+        session_store.add(session_id, session)
         return jsonify({
             "status": "success",
             "message": "Attendance session started",
@@ -85,39 +331,25 @@ def start_attendance(major, section, course):
 def stop_attendance(major, section, course):
     try:
         session_id = f"{major}_{section}_{course}"
-        if session_id not in processing_sessions:
+        
+        session = session_store.pop(session_id)
+        current_time = datetime.now()
+        results = end_session(session_id, session, current_time) if session is not None else None
+        if results is None:
             return jsonify({"error": "No active session found"}), 404
-
-        session = processing_sessions[session_id]
-        session.active = False
-
-        # Mark attendance in Firebase
-        with attendance_lock:
-            current_time = datetime.now()
-            for student_id in session.detected_students:
-                try:
-                    # Update attendance in Firebase
-                    student_ref = db.reference(f"Majors/{major}/Sections/{section}/Students/{student_id}/Courses/{course}")
-                    student_data = student_ref.get() or {}
-                    
-                    # Increment attendance count
-                    attendance_count = student_data.get('count', 0) + 1
-                    
-                    # Update Firebase
-                    student_ref.update({
-                        "count": attendance_count,
-                        "last_marked": current_time.isoformat()
-                    })
-                except Exception as e:
-                    print(f"Error marking attendance for student {student_id}: {e}")
-                    continue
+        failed_students = [student_id for student_id, error in results.items() if error]
 
         # Clean up session
         session_data = {
-            "total_students_marked": len(session.detected_students),
+            "total_students_marked": len(results) - len(failed_students),
+            "failed_students": failed_students,
+            # The evidence each marked student was committed on
+            "decisions": [
+                session.evidence.decisions[student_id]
+                for student_id in sorted(session.detected_students)
+            ],
             "session_duration": (current_time - session.start_time).total_seconds() / 60  # in minutes
         }
-        del processing_sessions[session_id]
 
         return jsonify({
             "status": "success",
@@ -136,25 +368,26 @@ def stop_attendance(major, section, course):
 def check_attendance_status(major, section, course):
     try:
         current_time = datetime.now()
-        ref = db.reference(f"Majors/{major}/Sections/{section}/Students")
-        students = ref.get()
+        students = roster_cache.section(major, section).get()
         
         if not students:
             return jsonify({"status": "error", "message": "No students found"})
-            
+        
+        # Only the students marked today and yesterday are read, from the day index;
+        # 8 hours back can reach into yesterday
+        window_start = current_time - timedelta(hours=8)
+        marked = marked_on(db.reference, major, section, course, window_start)
+        if window_start.date() != current_time.date():
+            marked.update(marked_on(db.reference, major, section, course, current_time))
+        
         recently_marked = []
-        for student_id, student_data in students.items():
-            if 'Courses' in student_data and course in student_data['Courses']:
-                last_marked_str = student_data['Courses'][course].get('last_marked')
-                if last_marked_str:
-                    last_marked = datetime.fromisoformat(last_marked_str)
-                    time_diff = current_time - last_marked
-                    if time_diff.total_seconds() < 8 * 3600:  # 8 hours in seconds
-                        recently_marked.append({
-                            'student_id': student_id,
-                            'name': student_data.get('Name', 'Unknown'),
-                            'last_marked': last_marked_str
-                        })
+        for student_id, last_marked_str in sorted(marked.items()):
+            if datetime.fromisoformat(last_marked_str) > window_start:
+                recently_marked.append({
+                    'student_id': student_id,
+                    'name': students.get(student_id, {}).get('Name', 'Unknown'),
+                    'last_marked': last_marked_str
+                })
         
         return jsonify({
             "status": "success",
@@ -169,38 +402,82 @@ def process_frame():
     try:
         # Extract data from request
         data = request.json
-        frame_data = base64.b64decode(data['frame'])
+        with timed("base64_decode"):
+            frame_data = base64.b64decode(data['frame'])
         major = data['major']
         section = data['section']
         course = data['course']
         
         # Create session ID and validate session
         session_id = f"{major}_{section}_{course}"
-        session = processing_sessions.get(session_id)
+        session = session_store.get(session_id)
         
         if not session or not session.active:
             return jsonify({"error": "No active session"}), 400
 
         # Convert frame data to numpy array
         nparr = np.frombuffer(frame_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with timed("decode"):
+            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
-        # Get enrolled students
-        enrolled_students = get_enrolled_students_data(major, section, course)
+        # Get enrolled students from the session's cached roster
+        with timed("roster"):
+            enrolled_students = get_enrolled_students_data(major, section, course, session.roster)
+        
+        # Nothing moved since the last analyzed frame: draw its faces again
+        analyze, regions, carried = plan_detection(session, frame=frame)
+        if not analyze:
+            FRAMES.inc(outcome="unchanged")
+            with timed("draw"):
+                processed_frame = draw_faces(frame, session.last_faces)
+            with timed("encode_jpeg"):
+                _, buffer = cv2.imencode('.jpg', processed_frame)
+            return jsonify({
+                "processedFrame": base64.b64encode(buffer).decode('utf-8'),
+                "detectedStudents": [],
+                "totalDetected": len(session.detected_students),
+                "unchanged": True
+            })
+        
+        # Detect, encode and match in a worker; only faces not yet identified are encoded
+        analysis = None
+        if inference_engine is not None:
+            try:
+                analysis = inference_engine.analyze(
+                    session_id,
+                    frame_data,
+                    enrolled_students.keys(),
+                    session.tracker.settled_boxes(),
+                    regions
+                )
+            except FrameDropped:
+                FRAMES.inc(outcome="dropped")
+                return jsonify({
+                    "dropped": True,
+                    "detectedStudents": [],
+                    "totalDetected": len(session.detected_students)
+                })
+            except EngineBusy as e:
+                FRAMES.inc(outcome="crashed" if isinstance(e, WorkerCrashed) else "busy")
+                return jsonify({"error": str(e)}), 503
         
         # Process frame with face recognition
         processed_frame, newly_detected = process_frame_with_recognition(
             frame, 
             enrolled_students, 
-            encodeListKnown, 
-            studentIDs, 
+            gallery_reloader.current.matcher, 
             course,
-            session
+            session,
+            analysis,
+            regions,
+            carried
         )
         
         # Convert processed frame back to base64
-        _, buffer = cv2.imencode('.jpg', processed_frame)
-        processed_frame_b64 = base64.b64encode(buffer).decode('utf-8')
+        with timed("encode_jpeg"):
+            _, buffer = cv2.imencode('.jpg', processed_frame)
+            processed_frame_b64 = base64.b64encode(buffer).decode('utf-8')
+        FRAMES.inc(outcome="processed")
         
         return jsonify({
             "processedFrame": processed_frame_b64,
@@ -209,194 +486,473 @@ def process_frame():
         })
 
     except Exception as e:
+        FRAMES.inc(outcome="error")
         print(f"Error processing frame: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/detect_frame/<major>/<section>/<course>', methods=['POST'])
+def detect_frame(major, section, course):
+    """
+    Binary counterpart of /process_frame: the body is the raw JPEG frame and
+    only the detection results are returned, the client draws the overlay
+    """
+    try:
+        frame_data = request.get_data()
+        if not frame_data:
+            return jsonify({"error": "Empty frame"}), 400
+        
+        session_id = f"{major}_{section}_{course}"
+        session = session_store.get(session_id)
+        if not session or not session.active:
+            return jsonify({"error": "No active session"}), 400
+        
+        with timed("roster"):
+            enrolled_students = get_enrolled_students_data(major, section, course, session.roster)
+        
+        # Nothing moved since the last analyzed frame: its faces still hold
+        analyze, regions, carried = plan_detection(session, frame_data=frame_data)
+        if not analyze:
+            FRAMES.inc(outcome="unchanged")
+            return jsonify({
+                "faces": session.last_faces,
+                "detectedStudents": [],
+                "totalDetected": len(session.detected_students),
+                "unchanged": True
+            })
+        
+        # The frame is only decoded here when there is no worker to do it
+        frame = None
+        analysis = None
+        if inference_engine is not None:
+            try:
+                analysis = inference_engine.analyze(
+                    session_id,
+                    frame_data,
+                    enrolled_students.keys(),
+                    session.tracker.settled_boxes(),
+                    regions
+                )
+            except FrameDropped:
+                FRAMES.inc(outcome="dropped")
+                return jsonify({
+                    "dropped": True,
+                    "faces": [],
+                    "detectedStudents": [],
+                    "totalDetected": len(session.detected_students)
+                })
+            except EngineBusy as e:
+                FRAMES.inc(outcome="crashed" if isinstance(e, WorkerCrashed) else "busy")
+                return jsonify({"error": str(e)}), 503
+        else:
+            with timed("decode"):
+                frame = cv2.imdecode(np.frombuffer(frame_data, np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                return jsonify({"error": "Frame could not be decoded"}), 400
+        
+        faces, newly_detected = recognize_frame(
+            frame, 
+            enrolled_students, 
+            gallery_reloader.current.matcher, 
+            course,
+            session,
+            analysis,
+            regions,
+            carried
+        )
+        
+        FRAMES.inc(outcome="processed")
+        return jsonify({
+            "faces": faces,
+            "detectedStudents": list(newly_detected),
+            "totalDetected": len(session.detected_students)
+        })
+
+    except Exception as e:
+        FRAMES.inc(outcome="error")
+        print(f"Error detecting frame: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/download_excel/<major>/<section>/<course>')
 def download_excel(major, section, course):
     try:
         # Get attendance data
-        ref = db.reference(f"Majors/{major}/Sections/{section}/Students")
-        students_data = ref.get()
+        students_data = roster_cache.section(major, section).get()
         
         if not students_data:
             return jsonify({"error": "No student data found"}), 404
         
-        excel_data = []
-        for student_id, student_data in students_data.items():
-            if isinstance(student_data, dict) and 'Courses' in student_data:
-                course_data = student_data['Courses'].get(course, {})
-                if course_data:  # Only include students enrolled in the course
-                    excel_data.append({
-                        'Student ID': student_id,
-                        'Name': student_data.get('Name', 'N/A'),
-                        'Attendance Count': course_data.get('count', 0),
-                        'Last Marked': course_data.get('last_marked', 'Never')
-                    })
-        
-        if not excel_data:
+        table = attendance_table(major, section, course, students_data)
+        if not table:
             return jsonify({"error": "No attendance data found for this course"}), 404
-            
-        # Create DataFrame and sort by Student ID
-        df = pd.DataFrame(excel_data)
-        df = df.sort_values('Student ID')
-        
-        # Ensure downloads directory exists
-        downloads_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
-        os.makedirs(downloads_dir, exist_ok=True)
         
-        # Generate Excel file with timestamp
+        # The workbook is built in memory and sent from there, nothing is written to disk
         filename = f'attendance_{major}_{section}_{course}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        excel_path = os.path.join(downloads_dir, filename)
-        
-        # Create Excel with formatting
-        with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Attendance', index=False)
-            
-            workbook = writer.book
-            worksheet = writer.sheets['Attendance']
-            
-            # Add header format
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'top',
-                'bg_color': '#D3D3D3',
-                'border': 1
-            })
-            
-            # Format columns
-            for col_num, value in enumerate(df.columns.values):
-                max_length = max(
-                    df[value].astype(str).apply(len).max(),
-                    len(str(value))
-                ) + 2
-                worksheet.set_column(col_num, col_num, max_length)
-                worksheet.write(0, col_num, value, header_format)
-        
-        # Send file and then remove it
-        response = send_file(
-            excel_path,
+        return send_file(
+            workbook_bytes([table], sheet_name='Attendance'),
             as_attachment=True,
             download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype=XLSX_MIMETYPE
         )
         
-        # Delete file after sending
-        @response.call_on_close
-        def cleanup():
-            try:
-                os.remove(excel_path)
-            except Exception as e:
-                print(f"Error cleaning up file {excel_path}: {e}")
-                
-        return response
-        
     except Exception as e:
         print(f"Error in download_excel: {e}")  # Log the actual error
         return jsonify({"error": "Failed to generate Excel file", "details": str(e)}), 500
 
+@app.route('/export/<major>')
+def export_attendance(major):
+    """
+    Attendance of many sections and courses in one file. Query parameters:
+    sections (comma-separated, required), courses (comma-separated, default:
+    every course of each section) and format (xlsx, one sheet per section and
+    course, or csv, streamed). Every section roster is read once.
+    """
+    try:
+        sections = [s for s in request.args.get('sections', '').split(',') if s]
+        courses = [c for c in request.args.get('courses', '').split(',') if c]
+        export_format = request.args.get('format', 'xlsx')
+        if not sections:
+            return jsonify({"error": "No sections given"}), 400
+        if export_format not in ('xlsx', 'csv'):
+            return jsonify({"error": f"Unknown format {export_format}"}), 400
+        
+        tables = []
+        for section in sections:
+            students_data = roster_cache.section(major, section).get()
+            for course in courses or section_courses(students_data):
+                table = attendance_table(major, section, course, students_data)
+                if table:
+                    tables.append(table)
+        if not tables:
+            return jsonify({"error": "No attendance data found"}), 404
+        
+        filename = f'attendance_{major}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+        if export_format == 'csv':
+            return Response(
+                csv_chunks(tables),
+                mimetype='text/csv',
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+            )
+        return send_file(
+            workbook_bytes(tables),
+            as_attachment=True,
+            download_name=filename,
+            mimetype=XLSX_MIMETYPE
+        )
+        
+    except Exception as e:
+        print(f"Error in export: {e}")
+        return jsonify({"error": "Failed to export attendance", "details": str(e)}), 500
+
 # Helper functions remain the same...
-def process_frame_with_recognition(frame, enrolled_students, encode_list_known, student_ids, current_course, session):
+def open_session(major, section, course, start_time=None):
+    """Attendance session for a course with a fresh roster and the course's gallery"""
+    session_id = f"{major}_{section}_{course}"
+    
+    # Load the section roster fresh; frames of this session are served from it
+    roster = roster_cache.load(major, section)
+    
+    # Build a course-scoped gallery so frames only scan enrolled students
+    enrolled_students = roster.enrolled(course)
+    gallery_matcher = gallery_reloader.current.matcher
+    course_gallery = gallery_matcher.subset(enrolled_students.keys())
+    print(f"Course gallery for {session_id}: {len(course_gallery)} of {len(gallery_matcher)} encodings")
+    session = AttendanceSession(major, section, course, course_gallery, roster, start_time)
+    session.gallery_source = gallery_matcher
+    return session
+
+def recover_sessions():
+    """Reopen the sessions the attendance log holds as active, with their detections"""
+    # Stops this process did not finish before it died; their counts were not written
+    for session_id in attendance_log.reopen_unfinished(datetime.now()):
+        print(f"Reopened session {session_id}, its stop never completed")
+    for logged in attendance_log.active_sessions():
+        session_id = logged["session_id"]
+        try:
+            session = open_session(logged["major"], logged["section"], logged["course"], logged["started_at"])
+        except Exception as e:
+            # Stays in the log and is retried on the next start
+            print(f"Error recovering session {session_id}: {e}")
+            continue
+        for student_id, detection in logged["detections"].items():
+            session.detected_students.add(student_id)
+            session.evidence.decisions[student_id] = detection["decision"] or {
+                "student_id": student_id, "committed_at": detection["detected_at"].timestamp()
+            }
+        session_store.add(session_id, session)
+        print(f"Recovered session {session_id} with {len(session.detected_students)} students")
+
+# Image run through recognition once at startup, so the first frames do not pay
+# for loading dlib's models and starting the inference workers; empty to skip
+warmup_image = os.environ.get("WARMUP_IMAGE", "backend/warmup.jpg")
+
+def warmup_frame():
+    """The warm-up image's bytes, or None when there is none"""
+    if not warmup_image:
+        return None
+    try:
+        with open(warmup_image, "rb") as file:
+            return file.read()
+    except OSError as e:
+        print(f"Error reading warm-up image {warmup_image}: {e}")
+        return None
+
+def warm_up():
+    """Run the warm-up image through detection, encoding and matching"""
+    frame_data = warmup_frame()
+    if inference_engine is not None:
+        # Started even without an image, so the workers have loaded the gallery
+        inference_engine.warm_up(frame_data)
+    elif frame_data is not None:
+        frame = cv2.imdecode(np.frombuffer(frame_data, np.uint8), cv2.IMREAD_COLOR)
+        analyze_frame(frame, gallery_reloader.current.matcher, detector=face_detector)
+    if frame_data is None and warmup_image:
+        raise FileNotFoundError(f"Warm-up image {warmup_image} could not be read")
+
+def detection_regions(session, now=None):
     """
-    Process frame for face recognition with tracking and cooldown
+    Regions around the session's known faces to search instead of the whole
+    frame, or None when a full scan is due
     """
-    newly_detected = set()
-    current_time = datetime.now()
+    if now is None:
+        now = time.monotonic()
+    tracks = session.tracker.tracks
+    if (full_scan_interval and tracks and session.last_full_scan is not None and
+            now - session.last_full_scan < full_scan_interval):
+        return [track.box for track in tracks]
+    session.last_full_scan = now
+    return None
+
+def plan_detection(session, frame=None, frame_data=None, now=None):
+    """
+    Decide how much of a frame (decoded, or its encoded bytes) to analyze.
+    
+    Returns (analyze, regions, carried): analyze is False when the scene did not
+    change since the last analyzed frame, so its result still holds; regions are
+    the boxes to detect in (None: the whole frame); carried are the boxes of known
+    faces outside the regions, which keep their tracks without being detected again.
+    """
+    if now is None:
+        now = time.monotonic()
+    if session.scene is None:
+        return True, detection_regions(session, now), []
     
-    # Resize frame for faster processing
-    imgS = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-    imgS = cv2.cvtColor(imgS, cv2.COLOR_BGR2RGB)
+    with timed("motion"):
+        if frame is not None:
+            thumb, shape = thumbnail(frame), frame.shape[:2]
+        else:
+            thumb, shape = thumbnail_from_bytes(frame_data)
+        if thumb is None:
+            return True, detection_regions(session, now), []
+        changed, regions = session.scene.check(thumb, shape, now)
     
-    # Detect faces
-    face_locations = face_recognition.face_locations(imgS)
+    # Faces still collecting votes are looked at on every frame
+    tracks = session.tracker.tracks
+    verifying = any(track.student_id is not None and not track.identified for track in tracks)
+    if not changed and not verifying:
+        return False, None, []
+    if regions is None:
+        return True, detection_regions(session, now), []
     
-    if face_locations:
-        face_encodings = face_recognition.face_encodings(imgS, face_locations)
+    # A known face touching a changed region is searched for as a whole
+    carried = []
+    for track in tracks:
+        touching = [i for i, region in enumerate(regions) if box_iou(track.box, region) > 0]
+        if not touching:
+            carried.append(track.box)
+        for i in touching:
+            top, right, bottom, left = regions[i]
+            t, r, b, l = track.box
+            regions[i] = (min(top, t), max(right, r), max(bottom, b), min(left, l))
+    return True, regions, carried
+
+def overlaps_carried(box, carried):
+    """
+    Whether a detection overlaps a carried face; the search area around a changed
+    region can clip a neighbouring face, whose known box is kept instead
+    """
+    return any(box_iou(box, carried_box) > 0 for carried_box in carried)
+
+def record_match(session, track, match, now, current_time):
+    """
+    Add a match to the session's evidence and identify its track; the track
+    is only confirmed (and skips recognition) once the student is committed
+    """
+    is_committed = False
+    if match.is_match:
+        session.evidence.observe(match.student_id, match.distance, track.track_id, current_time.timestamp())
+        is_committed = session.evidence.is_committed(match.student_id)
+    track.identify(match, now, confirmed=is_committed)
+
+def recognize_frame(frame, enrolled_students, matcher, current_course, session, analysis=None,
+                    regions=None, carried=()):
+    """
+    Recognize the faces of a frame with tracking and record newly detected students.
+    analysis holds the face locations and matches when a worker already computed them,
+    in which case frame is not needed. Detection is limited to regions when given;
+    carried are boxes of known faces outside them, kept as they were.
+    Returns one result per face (box in frame coordinates, student, status) and the
+    newly detected student IDs.
+    """
+    faces = []
+    newly_detected = set()
+    # Frames of a session are recognized one at a time; a stopped session takes no more
+    with session.lock:
+        if not session.active:
+            return faces, newly_detected
+        current_time = datetime.now()
+        now = time.monotonic()
+    
+        if analysis is None:
+            # Detect faces at the scale the detector picks for this frame
+            imgS, scale, small_locations = detect_faces(frame, face_detector, regions)
+            small_locations = [
+                location for location in small_locations
+                if not overlaps_carried(to_frame_box(location, scale), carried)
+            ]
+            face_locations = [to_frame_box(location, scale) for location in small_locations] + list(carried)
         
-        for encoding, location in zip(face_encodings, face_locations):
-            # Convert encoding to bytes for hashing
-            encoding_bytes = encoding.tobytes()
-            
-            # Check if we've recently processed this face
-            if encoding_bytes in session.processed_faces:
-                last_detection_time = session.processed_faces[encoding_bytes]
-                if (current_time - last_detection_time).total_seconds() < session.detection_cooldown:
-                    # Skip processing this face if within cooldown period
-                    continue
-            
-            matches = face_recognition.compare_faces(encode_list_known, encoding, tolerance=0.6)
-            
-            top, right, bottom, left = [coord * 4 for coord in location]
-            
-            if True in matches:
-                best_match_index = np.argmin(face_recognition.face_distance(encode_list_known, encoding))
-                student_id = student_ids[best_match_index]
-                
+            # Follow faces across frames; stale tracks are evicted here
+            tracks = session.tracker.update(face_locations, now)
+        
+            # Only new or uncertain tracks pay for encoding and matching; carried faces were not detected
+            pending = [
+                i for i, track in enumerate(tracks[:len(small_locations)])
+                if session.tracker.needs_recognition(track, now)
+            ]
+            if pending:
+                face_encodings = encode_faces(imgS, [small_locations[i] for i in pending])
+                matches = match_faces(face_encodings, matcher, session_gallery(session, matcher, enrolled_students))
+                for i, match in zip(pending, matches):
+                    record_match(session, tracks[i], match, now, current_time)
+        else:
+            face_locations, matches = analysis
+            kept = [i for i, box in enumerate(face_locations) if not overlaps_carried(box, carried)]
+            face_locations = [face_locations[i] for i in kept] + list(carried)
+            matches = [matches[i] for i in kept] + [None] * len(carried)
+            tracks = session.tracker.update(face_locations, now)
+        
+            # The worker skipped faces it saw as identified; use its matches for the rest
+            for track, match in zip(tracks, matches):
+                if match is not None and session.tracker.needs_recognition(track, now):
+                    record_match(session, track, match, now, current_time)
+    
+        FACES_PER_FRAME.observe(len(face_locations))
+        for location, track in zip(face_locations, tracks):
+            top, right, bottom, left = location
+            student_id = track.student_id
+            face = {
+                "box": [top, right, bottom, left],
+                "studentId": student_id,
+                "name": None,
+                "status": "unknown"
+            }
+        
+            if student_id is not None:
                 if student_id in enrolled_students:
                     student_data = enrolled_students[student_id]
                     last_marked_str = student_data.get('Courses', {}).get(current_course, {}).get('last_marked')
-                    
+                
                     # Check if student was marked in last 8 hours
                     is_recent = False
                     if last_marked_str:
                         last_marked = datetime.fromisoformat(last_marked_str)
                         time_diff = current_time - last_marked
                         is_recent = time_diff.total_seconds() < 8 * 3600  # 8 hours
-                    
-                    # Update tracking
-                    session.processed_faces[encoding_bytes] = current_time
-                    if not is_recent and student_id not in session.detected_students:
+                
+                    # Attendance is only marked once the evidence committed the student
+                    is_committed = session.evidence.is_committed(student_id)
+                    if not is_recent and is_committed and student_id not in session.detected_students:
                         session.detected_students.add(student_id)
                         newly_detected.add(student_id)
-                    
-                    # Set color based on whether attendance can be marked
-                    box_color = (0, 128, 255) if is_recent else (0, 255, 0)
-                    
-                    # Draw rectangle and name
-                    cv2.rectangle(frame, (left, top), (right, bottom), box_color, 2)
-                    cv2.rectangle(frame, (left, bottom - 35), (right, bottom), box_color, cv2.FILLED)
-                    
-                    name_text = student_data.get('Name', student_id)
-                    status_text = "Already Marked" if is_recent else "Attendance Marked"
-                    display_text = f"{name_text} - {status_text}"
-                    
-                    cv2.putText(frame, display_text, 
-                              (left + 6, bottom - 6), cv2.FONT_HERSHEY_COMPLEX, 
-                              0.6, (255, 255, 255), 2)
+                        STUDENTS_MARKED.inc()
+                        attendance_log.record(
+                            session.session_id, student_id, current_time, session.evidence.decisions[student_id]
+                        )
+                
+                    face["name"] = student_data.get('Name', student_id)
+                    if is_recent:
+                        face["status"] = "already_marked"
+                    else:
+                        face["status"] = "marked" if is_committed else "verifying"
                 else:
-                    # Draw red box for non-enrolled students
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
-                    cv2.putText(frame, "Not Enrolled", (left + 6, bottom - 6), 
-                              cv2.FONT_HERSHEY_COMPLEX, 0.6, (255, 255, 255), 2)
-            else:
-                # Draw red box for unknown faces
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
-                cv2.putText(frame, "Unknown", (left + 6, bottom - 6), 
-                          cv2.FONT_HERSHEY_COMPLEX, 0.6, (255, 255, 255), 2)
+                    face["status"] = "not_enrolled"
+        
+            faces.append(face)
+        
+        session.last_faces = faces
     
-    return frame, newly_detected
+    return faces, newly_detected
+
+def draw_faces(frame, faces):
+    """Draw the recognized faces onto the frame"""
+    for face in faces:
+        top, right, bottom, left = face["box"]
+        
+        if face["status"] in ("marked", "already_marked", "verifying"):
+            # Set color based on whether attendance can be marked
+            box_color = {
+                "marked": (0, 255, 0),
+                "already_marked": (0, 128, 255),
+                "verifying": (0, 255, 255)
+            }[face["status"]]
+            
+            # Draw rectangle and name
+            cv2.rectangle(frame, (left, top), (right, bottom), box_color, 2)
+            cv2.rectangle(frame, (left, bottom - 35), (right, bottom), box_color, cv2.FILLED)
+            
+            status_text = {
+                "marked": "Attendance Marked",
+                "already_marked": "Already Marked",
+                "verifying": "Verifying"
+            }[face["status"]]
+            display_text = f"{face['name']} - {status_text}"
+            
+            cv2.putText(frame, display_text, 
+                      (left + 6, bottom - 6), cv2.FONT_HERSHEY_COMPLEX, 
+                      0.6, (255, 255, 255), 2)
+        else:
+            # Draw red box for non-enrolled students and unknown faces
+            label = "Not Enrolled" if face["status"] == "not_enrolled" else "Unknown"
+            cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+            cv2.putText(frame, label, (left + 6, bottom - 6), 
+                      cv2.FONT_HERSHEY_COMPLEX, 0.6, (255, 255, 255), 2)
+    return frame
 
-def get_enrolled_students_data(major, section, course):
-    """Helper function to get enrolled students data from Firebase"""
+def process_frame_with_recognition(frame, enrolled_students, matcher, current_course, session, analysis=None,
+                                   regions=None, carried=()):
+    """
+    Process frame for face recognition with tracking and draw the results onto it
+    """
+    faces, newly_detected = recognize_frame(
+        frame, enrolled_students, matcher, current_course, session, analysis, regions, carried
+    )
+    with timed("draw"):
+        return draw_faces(frame, faces), newly_detected
+
+def get_enrolled_students_data(major, section, course, roster=None):
+    """Helper function to get enrolled students data from the cached roster"""
     try:
-        ref = db.reference(f"Majors/{major}/Sections/{section}/Students")
-        all_students = ref.get()
-        
-        if not all_students:
-            return {}
-        
-        return {
-            student_id: student_data
-            for student_id, student_data in all_students.items()
-            if isinstance(student_data, dict) and 
-            'Courses' in student_data and 
-            course in student_data['Courses']
-        }
+        if roster is None:
+            roster = roster_cache.section(major, section)
+        return roster.enrolled(course)
     except Exception as e:
         print(f"Error getting enrolled students data: {e}")
         return {}
 
+# Work done before the app reports ready; a reload by the polling thread may load the gallery first
+startup = Startup()
+startup.add("gallery", gallery_reloader.reload)
+# Shared sessions are opened on demand by whichever worker receives their frames
+if not isinstance(session_store, SharedSessionStore):
+    startup.add("recover_sessions", recover_sessions)
+startup.add("warm_up", warm_up, required=False)
+if background_startup:
+    startup.start()
+else:
+    startup.run()
+
 if __name__ == '__main__':
+    # HTTP/1.1 keeps the camera's connection open between frames
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
     # Run the app on all available IPs (0.0.0.0) and port 5000
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
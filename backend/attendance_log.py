@@ -0,0 +1,398 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from attendance_writer import commit_attendance, lecture_id
+from metrics import FIREBASE_SECONDS, timed
+
+DEFAULT_LOG_PATH = "backend/attendance_log.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    major TEXT NOT NULL,
+    section TEXT NOT NULL,
+    course TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    stopped_at TEXT,
+    last_active REAL,
+    committed INTEGER NOT NULL DEFAULT 0,
+    retry_after REAL
+);
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions(session_id),
+    student_id TEXT NOT NULL,
+    detected_at TEXT NOT NULL,
+    decision TEXT,
+    flushed INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (session_id, student_id)
+);
+"""
+
+# Seconds a stop that is still committing gets before the flusher commits its
+# session, once a new session with the same ID moved it aside (see open_session)
+STOP_GRACE = 300.0
+
+# Columns added after the first version of the log, added to older files on open
+_ADDED_COLUMNS = {
+    "sessions": {"last_active": "REAL", "committed": "INTEGER NOT NULL DEFAULT 0", "retry_after": "REAL"},
+}
+
+
+class AttendanceLog:
+    """
+    Local append-only log of attendance sessions and their detections.
+
+    Every detection is committed to SQLite (in WAL journal mode) before the
+    frame request returns, so a crash of the server loses nothing that was
+    shown as marked. A session's rows are kept until it is stopped, its counts
+    are committed and the stop has been flushed; whatever is still open on
+    startup is replayed. A stopped session whose commit failed stays in the
+    log, with all its detections, until the flusher committed it.
+
+    Several processes can share one log file; it is then also the state that
+    lets any worker serve any session (see session_store.SharedSessionStore).
+    """
+
+    def __init__(self, path=DEFAULT_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL only syncs at checkpoints in WAL mode; a power loss may drop the
+        # last transactions, a process crash drops none
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in columns.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._conn.execute(sql, parameters).fetchall()
+
+    def _update(self, sql, parameters=()):
+        """Run a statement and return the number of rows it changed"""
+        with self._lock:
+            return self._conn.execute(sql, parameters).rowcount
+
+    def open_session(self, session_id, major, section, course, started_at):
+        """
+        Start logging a session, replacing a stopped one with the same ID.
+
+        A stopped session whose counts are not committed yet (its commit failed
+        or is still running) is not replaced but moved to the key
+        <session ID>@<lecture ID>, and left to the flusher to commit, after
+        STOP_GRACE seconds when no commit failed yet.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            uncommitted = self._conn.execute(
+                "SELECT started_at FROM sessions WHERE session_id = ? AND stopped_at IS NOT NULL AND committed = 0",
+                (session_id,),
+            ).fetchone()
+            if uncommitted is not None:
+                moved_id = f"{session_id}@{lecture_id(datetime.fromisoformat(uncommitted[0]))}"
+                self._conn.execute(
+                    "UPDATE sessions SET session_id = ?, retry_after = COALESCE(retry_after, ?) "
+                    "WHERE session_id = ?",
+                    (moved_id, time.time() + STOP_GRACE, session_id),
+                )
+                self._conn.execute("UPDATE detections SET session_id = ? WHERE session_id = ?", (moved_id, session_id))
+            else:
+                self._conn.execute("DELETE FROM detections WHERE session_id = ?", (session_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions "
+                "(session_id, major, section, course, started_at, stopped_at, last_active, committed, retry_after) "
+                "VALUES (?, ?, ?, ?, ?, NULL, ?, 0, NULL)",
+                (session_id, major, section, course, started_at.isoformat(), time.time()),
+            )
+            self._conn.execute("COMMIT")
+
+    def touch(self, session_id, now=None):
+        """Record activity on a session, which keeps it from expiring"""
+        self._update(
+            "UPDATE sessions SET last_active = ? WHERE session_id = ?",
+            (time.time() if now is None else now, session_id),
+        )
+
+    def record(self, session_id, student_id, detected_at, decision=None):
+        """Append a detection; a student is only logged once per session"""
+        self._execute(
+            "INSERT OR IGNORE INTO detections (session_id, student_id, detected_at, decision) "
+            "VALUES (?, ?, ?, ?)",
+            (session_id, student_id, detected_at.isoformat(), json.dumps(decision) if decision else None),
+        )
+
+    def stop_session(self, session_id, stopped_at):
+        """
+        Mark a session stopped. Only one caller, in any process, can stop a
+        session: returns False when it was already stopped or never started.
+        """
+        return self._update(
+            "UPDATE sessions SET stopped_at = ? WHERE session_id = ? AND stopped_at IS NULL",
+            (stopped_at.isoformat(), session_id),
+        ) == 1
+
+    def mark_committed(self, session_id):
+        """
+        The stopped session's counts are written; the flusher may remove it now.
+        Once a new session took the ID, this no longer applies to the stopped one.
+        """
+        self._update(
+            "UPDATE sessions SET committed = 1 WHERE session_id = ? AND stopped_at IS NOT NULL", (session_id,)
+        )
+
+    def mark_commit_failed(self, session_id, retry_after):
+        """
+        Some counts of the stopped session could not be written; the flusher
+        commits it again from retry_after (a Unix time) on.
+        """
+        self._update(
+            "UPDATE sessions SET retry_after = ? WHERE session_id = ? AND stopped_at IS NOT NULL",
+            (retry_after, session_id),
+        )
+
+    def claim_failed_commits(self, now, claim_timeout):
+        """
+        Stopped sessions whose commit failed and is due for a retry, with their
+        detections. They are claimed for claim_timeout seconds, so another
+        process sharing the log does not commit them at the same time.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            session_ids = [row[0] for row in self._conn.execute(
+                "SELECT session_id FROM sessions WHERE committed = 0 AND retry_after <= ?", (now,)
+            )]
+            self._conn.executemany(
+                "UPDATE sessions SET retry_after = ? WHERE session_id = ?",
+                [(now + claim_timeout, session_id) for session_id in session_ids],
+            )
+            self._conn.execute("COMMIT")
+        return [
+            session for session_id in session_ids
+            for session in self._sessions("session_id = ?", (session_id,))
+        ]
+
+    def reopen_unfinished(self, stopped_before):
+        """
+        Make sessions active again that were stopped before the given time but
+        whose counts were never committed (the process stopping them died).
+        Sessions whose commit failed are left to the flusher. Returns their IDs.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            session_ids = [row[0] for row in self._conn.execute(
+                "SELECT session_id FROM sessions WHERE committed = 0 AND retry_after IS NULL AND stopped_at < ?",
+                (stopped_before.isoformat(),),
+            )]
+            self._conn.execute(
+                "UPDATE sessions SET stopped_at = NULL, last_active = ? "
+                "WHERE committed = 0 AND retry_after IS NULL AND stopped_at < ?",
+                (time.time(), stopped_before.isoformat()),
+            )
+            self._conn.execute("COMMIT")
+        return session_ids
+
+    def detections(self, session_id):
+        """Logged detections of a session: student ID -> detected_at and decision"""
+        return {
+            student_id: {
+                "detected_at": datetime.fromisoformat(detected_at),
+                "decision": json.loads(decision) if decision else None,
+            }
+            for student_id, detected_at, decision in self._execute(
+                "SELECT student_id, detected_at, decision FROM detections WHERE session_id = ?",
+                (session_id,),
+            )
+        }
+
+    def _sessions(self, where, parameters=(), with_detections=True):
+        sessions = []
+        for session_id, major, section, course, started_at, stopped_at, last_active in self._execute(
+            "SELECT session_id, major, section, course, started_at, stopped_at, last_active FROM sessions "
+            f"WHERE {where}", parameters
+        ):
+            session = {
+                "session_id": session_id,
+                "major": major,
+                "section": section,
+                "course": course,
+                "started_at": datetime.fromisoformat(started_at),
+                "stopped_at": datetime.fromisoformat(stopped_at) if stopped_at else None,
+                "last_active": last_active or 0.0,
+            }
+            if with_detections:
+                session["detections"] = self.detections(session_id)
+            sessions.append(session)
+        return sessions
+
+    def session(self, session_id, with_detections=False):
+        """An active session, or None when it was stopped or never started"""
+        sessions = self._sessions(
+            "session_id = ? AND stopped_at IS NULL", (session_id,), with_detections
+        )
+        return sessions[0] if sessions else None
+
+    def active_sessions(self):
+        """Sessions that were not stopped, with their logged detections, for replay"""
+        return self._sessions("stopped_at IS NULL")
+
+    def idle_sessions(self, last_active_before):
+        """IDs of active sessions without activity since the given Unix time"""
+        return [row[0] for row in self._execute(
+            "SELECT session_id FROM sessions WHERE stopped_at IS NULL AND COALESCE(last_active, 0) < ?",
+            (last_active_before,),
+        )]
+
+    def pending(self, limit=500):
+        """
+        Work for the flusher: unflushed detections of active sessions (with
+        their session) and the IDs of stopped sessions
+        """
+        detections = self._execute(
+            "SELECT d.id, d.session_id, s.major, s.section, s.course, s.started_at, "
+            "d.student_id, d.detected_at FROM detections d JOIN sessions s USING (session_id) "
+            "WHERE d.flushed = 0 AND s.stopped_at IS NULL ORDER BY d.id LIMIT ?",
+            (limit,),
+        )
+        stopped = [row[0] for row in self._execute(
+            "SELECT session_id FROM sessions WHERE stopped_at IS NOT NULL AND committed = 1"
+        )]
+        return detections, stopped
+
+    def mark_flushed(self, detection_ids, stopped_sessions=()):
+        """Record a successful flush; stopped sessions are dropped from the log"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE detections SET flushed = 1 WHERE id = ?", [(i,) for i in detection_ids]
+            )
+            for session_id in stopped_sessions:
+                self._conn.execute(
+                    "DELETE FROM detections WHERE session_id IN "
+                    "(SELECT session_id FROM sessions WHERE session_id = ? AND committed = 1)",
+                    (session_id,),
+                )
+                self._conn.execute(
+                    "DELETE FROM sessions WHERE session_id = ? AND committed = 1", (session_id,)
+                )
+            self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AttendanceFlusher:
+    """
+    Background thread pushing the log to the Realtime Database in batches.
+
+    Detections of active sessions are mirrored under LiveSessions/<session ID>
+    with one multi-path update per round; stopped sessions are removed from
+    there in the same update. All writes are plain sets, so a round that is
+    repeated after a failure or a crash writes the same values again. Counts
+    are not touched here, they are incremented once when the session stops;
+    only a stop whose commit failed is committed again from here.
+    """
+
+    def __init__(self, log, reference, interval=2.0, batch_size=500,
+                 commit_retry_interval=30.0, claim_timeout=300.0):
+        """
+        :param log: The AttendanceLog to flush.
+        :param reference: Callable returning a database reference for a path (db.reference).
+        :param interval: Seconds between flush rounds.
+        :param batch_size: Detections pushed per update.
+        :param commit_retry_interval: Seconds between commits of a session whose commit failed.
+        :param claim_timeout: Seconds after which a retry that never finished
+                              (its process died) can be taken over.
+        """
+        self.log = log
+        self.reference = reference
+        self.interval = interval
+        self.batch_size = batch_size
+        self.commit_retry_interval = commit_retry_interval
+        self.claim_timeout = claim_timeout
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="attendance-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.retry_commits()
+                while self.flush() == self.batch_size:
+                    pass
+            except Exception as e:
+                # Left in the log; the next round retries
+                print(f"Error flushing attendance log: {e}")
+
+    def flush(self):
+        """Push one batch; returns the number of detections pushed"""
+        detections, stopped = self.log.pending(self.batch_size)
+        if not detections and not stopped:
+            return 0
+
+        updates = {}
+        for _, session_id, major, section, course, started_at, student_id, detected_at in detections:
+            updates[f"LiveSessions/{session_id}/major"] = major
+            updates[f"LiveSessions/{session_id}/section"] = section
+            updates[f"LiveSessions/{session_id}/course"] = course
+            updates[f"LiveSessions/{session_id}/started_at"] = started_at
+            updates[f"LiveSessions/{session_id}/detected/{student_id}"] = detected_at
+        for session_id in stopped:
+            updates[f"LiveSessions/{session_id}"] = None
+
+        with timed("live_sessions_update", FIREBASE_SECONDS):
+            self.reference("/").update(updates)
+        self.log.mark_flushed([row[0] for row in detections], stopped)
+        return len(detections)
+
+    def retry_commits(self, now=None):
+        """Commit the stopped sessions whose commit failed and is due again; returns the IDs committed"""
+        committed = []
+        for logged in self.log.claim_failed_commits(time.time() if now is None else now, self.claim_timeout):
+            session_id = logged["session_id"]
+            # The lecture and marked_at are the ones of the first attempt; students
+            # already written are skipped by commit_attendance
+            results = commit_attendance(
+                self.reference, logged["major"], logged["section"], logged["course"],
+                logged["detections"], logged["stopped_at"], started_at=logged["started_at"]
+            )
+            failed = [student_id for student_id, error in results.items() if error]
+            if failed:
+                self.log.mark_commit_failed(session_id, time.time() + self.commit_retry_interval)
+                print(f"Commit of session {session_id} failed again for {len(failed)} students")
+            else:
+                self.log.mark_committed(session_id)
+                committed.append(session_id)
+                print(f"Committed session {session_id} after a failed commit")
+        return committed
+
+    def wake(self):
+        """Flush now instead of at the next interval"""
+        self._wake.set()
+
+    def stop(self):
+        """Flush what is left and stop the thread"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error flushing attendance log: {e}")
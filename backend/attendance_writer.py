@@ -0,0 +1,206 @@
+"""
+Attendance records in the Realtime Database.
+
+The source of truth is a log with one node per lecture, plus an index by day:
+
+    Attendance/<major>/<section>/<course>/<lecture>/<student ID> = marked_at
+    AttendanceByDay/<YYYY-MM-DD>/<major>/<section>/<course>/<student ID> = marked_at
+
+where <lecture> is the start time of the session (YYYYMMDDTHHMMSS). The
+count and last_marked of each student's course node are a cache derived from
+the log; they are updated in the same multi-path update and can be recomputed
+from the log with:
+
+    python backend/attendance_writer.py recount <major> <section> <course> [--apply]
+"""
+import sys
+import time
+
+from metrics import FIREBASE_SECONDS, timed
+
+# Realtime Database server value that increments a counter atomically on the server
+INCREMENT = {".sv": {"increment": 1}}
+
+
+def lecture_id(started_at):
+    """Key of a lecture in the attendance log: the start time of its session"""
+    return started_at.strftime("%Y%m%dT%H%M%S")
+
+
+def day_key(moment):
+    return moment.strftime("%Y-%m-%d")
+
+
+def attendance_updates(major, section, course, student_ids, marked_at, started_at=None):
+    """
+    Multi-path update, relative to the database root, marking every student
+    present in one lecture: its log entry, the day index and the cached count.
+
+    Counts are incremented on the server, so no read is needed and concurrent
+    sessions cannot lose increments.
+    """
+    lecture = lecture_id(started_at or marked_at)
+    day = day_key(marked_at)
+    updates = {}
+    for student_id in student_ids:
+        updates[f"Attendance/{major}/{section}/{course}/{lecture}/{student_id}"] = marked_at.isoformat()
+        updates[f"AttendanceByDay/{day}/{major}/{section}/{course}/{student_id}"] = marked_at.isoformat()
+        student = f"Majors/{major}/Sections/{section}/Students/{student_id}/Courses/{course}"
+        updates[f"{student}/count"] = INCREMENT
+        updates[f"{student}/last_marked"] = marked_at.isoformat()
+    return updates
+
+
+def _logged_students(lecture_ref):
+    """Students the lecture's log entry exists for, i.e. whose update was applied"""
+    with timed("lecture_get", FIREBASE_SECONDS):
+        return set(lecture_ref.get() or {})
+
+
+def _update_with_retry(ref, lecture_ref, updates_for, student_ids, retries, backoff):
+    """
+    Write the updates of some students, retrying with exponential backoff;
+    returns the last error or None.
+
+    A write that failed on the client may still have been applied on the
+    server, and applying it again would increment the counts twice. Each
+    update is atomic and holds the lecture's log entries, so before every
+    retry the students whose entry exists are left out.
+    """
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * (2 ** (attempt - 1)))
+            try:
+                logged = _logged_students(lecture_ref)
+            except Exception as e:
+                error = e
+                continue
+            student_ids = [student_id for student_id in student_ids if student_id not in logged]
+            if not student_ids:
+                return None
+        try:
+            with timed("attendance_update", FIREBASE_SECONDS):
+                ref.update(updates_for(student_ids))
+            return None
+        except Exception as e:
+            error = e
+    return error
+
+
+def commit_attendance(reference, major, section, course, student_ids, marked_at,
+                      started_at=None, batch_size=500, retries=3, backoff=0.5):
+    """
+    Write the attendance of a session in as few round trips as possible.
+
+    Students are written in multi-path updates of batch_size students, each of
+    which is applied atomically. A batch that still fails after its retries is
+    split into per-student writes, with the same retries, so the failure can be
+    attributed.
+
+    Committing a lecture again (after a failure or a crash) is safe: students
+    already in the lecture's log are not written, so no count is incremented twice.
+
+    :param reference: Callable returning a database reference for a path (db.reference).
+    :param student_ids: Students detected during the session.
+    :param marked_at: Time the attendance is marked at.
+    :param started_at: Start of the session, which identifies the lecture (default: marked_at).
+    :return: Dictionary of student ID -> None on success or the error message.
+    """
+    ref = reference("/")
+    lecture_ref = reference(f"Attendance/{major}/{section}/{course}/{lecture_id(started_at or marked_at)}")
+
+    def updates_for(batch):
+        return attendance_updates(major, section, course, batch, marked_at, started_at)
+
+    student_ids = sorted(student_ids)
+    try:
+        logged = _logged_students(lecture_ref)
+    except Exception as e:
+        # Without knowing what is written, writing could count students twice
+        print(f"Error reading the lecture log, no attendance written: {e}")
+        return {student_id: str(e) for student_id in student_ids}
+    results = {student_id: None for student_id in student_ids if student_id in logged}
+    student_ids = [student_id for student_id in student_ids if student_id not in logged]
+
+    for start in range(0, len(student_ids), batch_size):
+        batch = student_ids[start:start + batch_size]
+        error = _update_with_retry(ref, lecture_ref, updates_for, batch, retries, backoff)
+        if error is None:
+            results.update((student_id, None) for student_id in batch)
+            continue
+
+        print(f"Batch update failed for {len(batch)} students, retrying individually: {error}")
+        try:
+            logged = _logged_students(lecture_ref)
+        except Exception as e:
+            results.update((student_id, str(e)) for student_id in batch)
+            continue
+        for student_id in batch:
+            error = None if student_id in logged else _update_with_retry(
+                ref, lecture_ref, updates_for, [student_id], retries, backoff
+            )
+            results[student_id] = None if error is None else str(error)
+            if error is not None:
+                print(f"Error marking attendance for student {student_id}: {error}")
+
+    return results
+
+
+def marked_on(reference, major, section, course, day):
+    """Students marked in a course on a day, from the day index: student ID -> marked_at"""
+    with timed("day_index_get", FIREBASE_SECONDS):
+        return reference(f"AttendanceByDay/{day_key(day)}/{major}/{section}/{course}").get() or {}
+
+
+def recount_attendance(reference, major, section, course, apply=False):
+    """
+    Recompute the cached count and last_marked of every student of a course
+    from the lecture log.
+
+    :param apply: Write the recomputed values; otherwise only report them.
+    :return: Dictionary of student ID -> (cached count, count in the log) for
+             every student whose cache differs from the log.
+    """
+    lectures = reference(f"Attendance/{major}/{section}/{course}").get() or {}
+    counts, last_marked = {}, {}
+    for marked in lectures.values():
+        for student_id, marked_at in marked.items():
+            counts[student_id] = counts.get(student_id, 0) + 1
+            last_marked[student_id] = max(last_marked.get(student_id, marked_at), marked_at)
+
+    students = reference(f"Majors/{major}/Sections/{section}/Students").get() or {}
+    differences, updates = {}, {}
+    for student_id, student_data in students.items():
+        course_data = (student_data or {}).get("Courses", {}).get(course)
+        if course_data is None:
+            continue
+        count = counts.get(student_id, 0)
+        if course_data.get("count", 0) != count:
+            differences[student_id] = (course_data.get("count", 0), count)
+        updates[f"{student_id}/Courses/{course}/count"] = count
+        if student_id in last_marked:
+            updates[f"{student_id}/Courses/{course}/last_marked"] = last_marked[student_id]
+
+    if apply and updates:
+        reference(f"Majors/{major}/Sections/{section}/Students").update(updates)
+    return differences
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5 or sys.argv[1] != "recount":
+        print("Usage: python backend/attendance_writer.py recount <major> <section> <course> [--apply]")
+        sys.exit(1)
+
+    import firebase_admin
+    from firebase_admin import credentials, db
+
+    cred = credentials.Certificate("backend/serviceAccountKey.json")
+    firebase_admin.initialize_app(cred, {
+        'databaseURL': "https://attendance-system-realtime-default-rtdb.firebaseio.com/"
+    })
+    apply = "--apply" in sys.argv
+    differences = recount_attendance(db.reference, *sys.argv[2:5], apply=apply)
+    for student_id, (cached, logged) in sorted(differences.items()):
+        print(f"{student_id}: cached count {cached}, {logged} lectures in the log")
+    print(f"{len(differences)} counts differ from the log" + (", rewritten" if apply else ""))
@@ -0,0 +1,369 @@
+"""
+Benchmark of the recognition pipeline, end to end, without Firebase.
+
+Faces are cut from the sample photos in backend/images and pasted into
+synthetic classroom frames. The app runs against an in-memory fake of the
+Realtime Database and a temporary gallery made of the samples' encodings,
+padded with synthetic rows up to each gallery size. Every scenario of the
+sweep reports frames/sec, p50/p99 latency, the peak RSS during the scenario
+(of the app and of its inference workers) and the mean time of each stage,
+and the whole run is written as JSON for comparing runs:
+
+    python backend/benchmark.py --gallery-sizes 100,10000 --faces 1,8 --sessions 1,4 --output bench.json
+
+The app's own configuration applies (FACE_DETECTOR, GALLERY_INDEX,
+MOTION_GATING, ...); --workers sets INFERENCE_WORKERS.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from fake_database import FakeDatabase
+
+MAJOR = "BENCH"
+SAMPLE_FOLDER = "backend/images"
+
+
+def load_app(database, workers=0):
+    """
+    Import the backend with Firebase replaced by the fake database. Must run
+    before anything else imports app; the environment it reads is set here.
+    """
+    import firebase_admin
+    from firebase_admin import credentials, db
+
+    credentials.Certificate = lambda path: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    db.reference = database.reference
+
+    scratch = tempfile.mkdtemp(prefix="attendance-bench-")
+    os.environ["GALLERY_PATH"] = os.path.join(scratch, "bench.gallery")
+    os.environ["ATTENDANCE_LOG_PATH"] = os.path.join(scratch, "attendance_log.db")
+    os.environ["INFERENCE_WORKERS"] = str(workers)
+    os.environ.setdefault("GALLERY_RELOAD_INTERVAL", "0")
+    # Warm up during the import, not while scenarios are measured
+    os.environ.setdefault("BACKGROUND_STARTUP", "0")
+
+    from gallery import save_gallery
+    save_gallery(os.environ["GALLERY_PATH"], [], [])
+    import app
+    return app
+
+
+def sample_faces(folder=SAMPLE_FOLDER, face_height=120, limit=None):
+    """
+    Face crops of the sample photos and their encodings, for the gallery.
+
+    :return: List of (student ID, BGR crop, encoding); photos without exactly
+             one face are left out.
+    """
+    import face_recognition
+    from gallery_builder import student_id_for
+
+    faces = []
+    for filename in sorted(os.listdir(folder))[:limit]:
+        image = cv2.imread(os.path.join(folder, filename))
+        if image is None:
+            continue
+        scale = min(1.0, 800 / max(image.shape[:2]))
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        locations = face_recognition.face_locations(rgb)
+        if len(locations) != 1:
+            continue
+        top, right, bottom, left = locations[0]
+        encoding = face_recognition.face_encodings(rgb, locations)[0]
+
+        # Some context around the face, like a person in a classroom shot
+        margin = int(0.4 * (bottom - top))
+        crop = image[max(0, top - margin):bottom + margin, max(0, left - margin):right + margin]
+        crop_scale = face_height * (1 + 0.8) / crop.shape[0]
+        faces.append((student_id_for(filename), cv2.resize(crop, None, fx=crop_scale, fy=crop_scale), encoding))
+    return faces
+
+
+def classroom_frame(crops, size=(720, 1280), jitter=0, rng=None):
+    """Frame with the given face crops laid out in rows on a noisy background"""
+    rng = rng or np.random.default_rng(0)
+    height, width = size
+    frame = np.full((height, width, 3), 90, dtype=np.uint8)
+    frame += rng.integers(0, 12, size=frame.shape, dtype=np.uint8)
+    columns = max(1, int(np.ceil(np.sqrt(len(crops) * width / height))))
+    rows = max(1, int(np.ceil(len(crops) / columns)))
+    cell_h, cell_w = height // rows, width // columns
+    for index, crop in enumerate(crops):
+        row, column = divmod(index, columns)
+        h, w = min(crop.shape[0], cell_h), min(crop.shape[1], cell_w)
+        dy, dx = rng.integers(-jitter, jitter + 1, size=2) if jitter else (0, 0)
+        top = int(np.clip(row * cell_h + (cell_h - h) // 2 + dy, 0, height - h))
+        left = int(np.clip(column * cell_w + (cell_w - w) // 2 + dx, 0, width - w))
+        frame[top:top + h, left:left + w] = crop[:h, :w]
+    return frame
+
+
+def build_gallery(app, faces, size, seed=0):
+    """Swap in a gallery of the samples' encodings padded with synthetic students to size rows"""
+    from gallery import save_gallery
+    from gallery_index import synthetic_gallery
+
+    encodings = [encoding for _, _, encoding in faces]
+    student_ids = [student_id for student_id, _, _ in faces]
+    padding = max(0, size - len(encodings))
+    if padding:
+        _, synthetic, _ = synthetic_gallery(padding, photos_per_student=1, seed=seed)
+        encodings = np.concatenate([np.asarray(encodings, dtype=np.float32).reshape(-1, 128), synthetic])
+        student_ids = student_ids + [f"synthetic{i}" for i in range(padding)]
+    save_gallery(app.gallery_path, encodings, student_ids)
+    app.gallery_reloader.reload(force=True)
+
+
+def seed_rosters(database, faces, sessions):
+    """One section per session, every sample student enrolled in its course"""
+    sections = {}
+    for index in range(sessions):
+        sections[f"S{index}"] = {"Students": {
+            student_id: {"Name": f"Student {student_id}", "Courses": {f"C{index}": {"count": 0}}}
+            for student_id, _, _ in faces
+        }}
+    database.root = {"Majors": {MAJOR: {"Sections": sections}}}
+
+
+def _rss_mb(pid="self"):
+    """Current resident set size of a process in MB, from /proc (Linux); None when unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _child_pids():
+    """Processes started by this one, i.e. the inference workers"""
+    pid, children = os.getpid(), []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as file:
+                stat = file.read()
+        except OSError:
+            continue
+        # The command name in parentheses may hold spaces; the state and parent PID follow it
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+class MemorySampler:
+    """
+    Peak RSS, within a block, of this process and of the sum of its child
+    processes, sampled every interval seconds. ru_maxrss cannot be used per
+    scenario: it is the peak over the whole life of the process and leaves out
+    the workers that are still running.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.available = os.path.exists("/proc/self/status")
+        self.peak_mb = None
+        self.workers_peak_mb = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        if not self.available:
+            return
+        own = _rss_mb() or 0.0
+        workers = sum(_rss_mb(pid) or 0.0 for pid in _child_pids())
+        self.peak_mb = max(self.peak_mb or 0.0, own)
+        self.workers_peak_mb = max(self.workers_peak_mb or 0.0, workers)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopping.set()
+        self._thread.join()
+        self.sample()
+        if not self.available:
+            # Without /proc, only the process-wide peak is known
+            self.peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1000.0 if values else None
+
+
+def run_scenario(app, database, faces, faces_per_frame, sessions, frames, mode, jitter, seed=0):
+    """
+    Drive sessions concurrent sessions, one thread each, through frames frames.
+
+    :param mode: "route" posts to /process_frame through the test client,
+                 "direct" calls process_frame_with_recognition.
+    """
+    from metrics import collect
+
+    seed_rosters(database, faces, sessions)
+    rng = np.random.default_rng(seed)
+    crops = [faces[i % len(faces)][1] for i in range(faces_per_frame)]
+    frame_sets = [
+        [classroom_frame(crops, jitter=jitter, rng=np.random.default_rng(rng.integers(1 << 31)))
+         for _ in range(min(frames, 10))]
+        for _ in range(sessions)
+    ]
+
+    client = app.app.test_client()
+    for index in range(sessions):
+        client.get(f"/start_attendance/{MAJOR}/S{index}/C{index}")
+
+    latencies, stage_totals, errors = [], {}, []
+    lock = threading.Lock()
+
+    def drive(index):
+        session_client = app.app.test_client()
+        section, course = f"S{index}", f"C{index}"
+        payloads = []
+        for frame in frame_sets[index]:
+            _, buffer = cv2.imencode(".jpg", frame)
+            payloads.append(base64.b64encode(buffer).decode("utf-8"))
+        for number in range(frames):
+            started = time.perf_counter()
+            with collect() as timings:
+                if mode == "route":
+                    response = session_client.post("/process_frame", json={
+                        "frame": payloads[number % len(payloads)],
+                        "major": MAJOR, "section": section, "course": course
+                    })
+                    ok = response.status_code == 200
+                else:
+                    session = app.session_store.get(f"{MAJOR}_{section}_{course}")
+                    frame = frame_sets[index][number % len(frame_sets[index])].copy()
+                    app.process_frame_with_recognition(
+                        frame,
+                        app.get_enrolled_students_data(MAJOR, section, course, session.roster),
+                        app.gallery_reloader.current.matcher,
+                        course,
+                        session,
+                        regions=app.detection_regions(session)
+                    )
+                    ok = True
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                    for stage, seconds in timings.items():
+                        stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+                else:
+                    errors.append(response.status_code)
+
+    with MemorySampler() as memory:
+        started = time.perf_counter()
+        threads = [threading.Thread(target=drive, args=(index,)) for index in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+    marked = 0
+    for index in range(sessions):
+        result = client.get(f"/stop_attendance/{MAJOR}/S{index}/C{index}").get_json()
+        marked += result.get("data", {}).get("total_students_marked", 0)
+
+    return {
+        "mode": mode,
+        "gallery_size": len(app.gallery_reloader.current.gallery),
+        "faces_per_frame": faces_per_frame,
+        "sessions": sessions,
+        "frames": len(latencies),
+        "errors": len(errors),
+        "fps": len(latencies) / wall if wall else None,
+        "p50_ms": _percentile(latencies, 50),
+        "p99_ms": _percentile(latencies, 99),
+        "peak_rss_mb": memory.peak_mb,
+        "workers_peak_rss_mb": memory.workers_peak_mb,
+        "students_marked": marked,
+        "stages_ms": {
+            stage: seconds * 1000.0 / max(1, len(latencies)) for stage, seconds in sorted(stage_totals.items())
+        },
+    }
+
+
+def _ints(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the recognition pipeline")
+    parser.add_argument("--gallery-sizes", default="100,1000,10000", help="Gallery rows to sweep")
+    parser.add_argument("--faces", default="1,4,8", help="Faces per frame to sweep")
+    parser.add_argument("--sessions", default="1,4", help="Concurrent sessions to sweep")
+    parser.add_argument("--frames", type=int, default=20, help="Frames per session")
+    parser.add_argument("--modes", default="route,direct", help="route (/process_frame) and/or direct")
+    parser.add_argument("--workers", type=int, default=0, help="INFERENCE_WORKERS of the app")
+    parser.add_argument("--jitter", type=int, default=2, help="Pixels faces move between frames")
+    parser.add_argument("--samples", default=SAMPLE_FOLDER, help="Folder of sample photos")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    database = FakeDatabase()
+    app = load_app(database, args.workers)
+    faces = sample_faces(args.samples)
+    if not faces:
+        print(f"No usable faces in {args.samples}")
+        sys.exit(1)
+    print(f"{len(faces)} sample faces")
+
+    results = []
+    for gallery_size in _ints(args.gallery_sizes):
+        build_gallery(app, faces, gallery_size)
+        for faces_per_frame in _ints(args.faces):
+            for sessions in _ints(args.sessions):
+                for mode in args.modes.split(","):
+                    result = run_scenario(app, database, faces, faces_per_frame, sessions,
+                                          args.frames, mode, args.jitter)
+                    results.append(result)
+                    print(
+                        f"{mode:>6} gallery={result['gallery_size']:>6} faces={faces_per_frame:>2} "
+                        f"sessions={sessions:>2} fps={result['fps']:.1f} p50={result['p50_ms']:.1f}ms "
+                        f"p99={result['p99_ms']:.1f}ms rss={result['peak_rss_mb'] or 0:.0f}MB "
+                        f"workers={result['workers_peak_rss_mb'] or 0:.0f}MB"
+                    )
+
+    if app.inference_engine is not None:
+        app.inference_engine.shutdown()
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "environment": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "workers": args.workers,
+                    "detector": app.face_detector.backend,
+                    "gallery_index": app.gallery_index,
+                    "motion_gating": app.motion_gating,
+                    "frames_per_session": args.frames,
+                },
+                "results": results,
+            }, file, indent=2)
@@ -1,33 +1,123 @@
 import os
-from PIL import Image
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-def convert_images_to_jpeg(input_folder, output_folder, quality=95):
+from PIL import Image, ImageOps
+
+SUPPORTED_FORMATS = {"png", "jpg", "jpeg", "webp", "bmp", "tiff"}
+
+
+def _output_name(filename):
+    return os.path.splitext(filename)[0] + ".jpg"
+
+
+def is_up_to_date(source_path, output_path):
+    """An output is current when it carries its source's mtime, which normalize_image copies onto it"""
+    try:
+        return os.stat(output_path).st_mtime_ns == os.stat(source_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def normalize_image(source_path, output_path, face_height=300, detect_side=1024, margin=0.5, quality=90):
+    """
+    Turn one enrollment photo into the image the gallery builder encodes, in one pass:
+    apply the EXIF orientation, crop to the face and scale it down so the face is
+    face_height pixels tall (images are never scaled up).
+
+    Photos without exactly one face are only oriented and scaled down, so the
+    gallery builder still sees and rejects them.
+
+    :param detect_side: Longest side of the copy the face is searched in.
+    :param margin: Context kept around the face, relative to its height.
+    :return: "converted", "no_face" or "multiple_faces".
     """
-    Converts all images in the input folder to JPEG format while preserving quality.
+    import face_recognition
+    import numpy as np
+
+    with Image.open(source_path) as img:
+        # JPEGs are decoded at a reduced size straight away when they are much larger than needed
+        img.draft("RGB", (2 * detect_side, 2 * detect_side))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+
+    detect_scale = min(1.0, detect_side / max(img.size))
+    detect_img = img if detect_scale == 1.0 else img.resize(
+        (max(1, round(img.width * detect_scale)), max(1, round(img.height * detect_scale))), Image.BILINEAR
+    )
+    locations = face_recognition.face_locations(np.asarray(detect_img))
+
+    if len(locations) == 1:
+        status = "converted"
+        top, right, bottom, left = (coord / detect_scale for coord in locations[0])
+        extra = margin * (bottom - top)
+        img = img.crop((
+            max(0, int(left - extra)), max(0, int(top - extra)),
+            min(img.width, int(right + extra)), min(img.height, int(bottom + extra)),
+        ))
+        scale = min(1.0, face_height / (bottom - top))
+    else:
+        status = "no_face" if not locations else "multiple_faces"
+        scale = detect_scale
+
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    img.save(output_path, "JPEG", quality=quality)
+
+    # Mark the output as derived from this version of the source
+    source = os.stat(source_path)
+    os.utime(output_path, ns=(source.st_atime_ns, source.st_mtime_ns))
+    return status
+
+
+def _normalize(paths):
+    source_path, output_path = paths
+    try:
+        return normalize_image(source_path, output_path), None
+    except Exception as e:
+        return "failed", str(e)
+
+
+def convert_images_to_jpeg(input_folder, output_folder, workers=None, force=False):
+    """
+    Normalize all images in the input folder into JPEGs for the gallery builder,
+    in a pool of worker processes. Images whose output is up to date are skipped.
 
     :param input_folder: Path to the folder containing images.
     :param output_folder: Path to the folder where JPEG images will be saved.
-    :param quality: Quality of the output JPEG images (default: 95).
+    :param workers: Number of worker processes (default: the CPU count).
+    :param force: Convert every image, even when its output is up to date.
+    :return: Dictionary of status ("converted", "no_face", "multiple_faces",
+             "skipped" or "failed") -> file names.
     """
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    supported_formats = {"png", "jpg", "jpeg", "webp", "bmp", "tiff"}
-
-    for filename in os.listdir(input_folder):
+    summary = {}
+    pending = []
+    for filename in sorted(os.listdir(input_folder)):
         file_path = os.path.join(input_folder, filename)
-        if os.path.isfile(file_path):
-            try:
-                with Image.open(file_path) as img:
-                    img = img.convert("RGB")  # Convert to RGB to ensure JPEG compatibility
-                    new_filename = os.path.splitext(filename)[0] + ".jpg"
-                    output_path = os.path.join(output_folder, new_filename)
-                    img.save(output_path, "JPEG", quality=quality)
-                    print(f"Converted: {filename} -> {new_filename}")
-            except Exception as e:
-                print(f"Skipping {filename}: {e}")
+        if not os.path.isfile(file_path) or os.path.splitext(filename)[1][1:].lower() not in SUPPORTED_FORMATS:
+            continue
+        output_path = os.path.join(output_folder, _output_name(filename))
+        if not force and is_up_to_date(file_path, output_path):
+            summary.setdefault("skipped", []).append(filename)
+        else:
+            pending.append((filename, (file_path, output_path)))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            statuses = executor.map(_normalize, [paths for _, paths in pending], chunksize=4)
+            for (filename, _), (status, error) in zip(pending, statuses):
+                summary.setdefault(status, []).append(filename)
+                if error:
+                    print(f"Error converting {filename}: {error}")
+                else:
+                    print(f"{status}: {filename} -> {_output_name(filename)}")
+    return summary
+
 
 if __name__ == "__main__":
     input_folder = "backend/images"  # Change this to your folder path
     output_folder = "backend/output_images"  # Change this to your desired output folder
-    convert_images_to_jpeg(input_folder, output_folder)
+    summary = convert_images_to_jpeg(input_folder, output_folder, force="--force" in sys.argv)
+    print(", ".join(f"{len(files)} {status}" for status, files in sorted(summary.items())))
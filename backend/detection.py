@@ -0,0 +1,172 @@
+import math
+import os
+
+import cv2
+
+from tracker import box_iou
+
+# Smallest face (in pixels of the image it runs on) each detector finds reliably
+DETECTOR_MIN_FACE = {
+    "hog": 80,   # dlib's HOG window, without upsampling
+    "haar": 30,
+    "dnn": 40,
+}
+
+
+class FaceDetector:
+    """
+    Face detection stage with a selectable backend and an input scale chosen
+    per frame from the frame size and the smallest face that must be found.
+
+    Backends:
+        hog  -- face_recognition's HOG detector (default)
+        haar -- OpenCV Haar cascade, fastest on CPU
+        dnn  -- OpenCV DNN face detector (res10 SSD); needs dnn_model and dnn_config
+    """
+
+    def __init__(self, backend="hog", min_face_size=160, min_face_fraction=None, max_pixels=1920 * 1080,
+                 dnn_model=None, dnn_config=None, confidence=0.6, roi_margin=0.75):
+        """
+        :param backend: One of "hog", "haar" or "dnn".
+        :param min_face_size: Smallest face height, in pixels of the input frame, to detect.
+                              The default, 160, is the smallest face the fixed 0.25
+                              scale with one upsample found, at any frame size.
+        :param min_face_fraction: Smallest face height relative to the frame height instead
+                                  of min_face_size (None: use min_face_size).
+        :param max_pixels: Upper bound on the pixels the detector runs on; caps the
+                           scale for large frames.
+        :param dnn_model: Path of the DNN weights (e.g. res10_300x300_ssd_iter_140000.caffemodel).
+        :param dnn_config: Path of the DNN definition (e.g. deploy.prototxt).
+        :param confidence: Minimum DNN detection confidence.
+        :param roi_margin: How far, relative to the face size, a region of interest
+                           extends around a known face.
+        """
+        if backend not in DETECTOR_MIN_FACE:
+            raise ValueError(f"Unknown detector backend {backend!r}, expected one of {sorted(DETECTOR_MIN_FACE)}")
+        if backend == "dnn" and not (dnn_model and dnn_config and
+                                     os.path.exists(dnn_model) and os.path.exists(dnn_config)):
+            raise ValueError("The dnn detector needs existing dnn_model and dnn_config files")
+        if backend == "haar" and not hasattr(cv2, "CascadeClassifier"):
+            raise ValueError("The haar detector needs an OpenCV build with Haar cascades (4.x)")
+        self.backend = backend
+        self.min_face_size = min_face_size
+        self.min_face_fraction = min_face_fraction
+        self.max_pixels = max_pixels
+        self.dnn_model = dnn_model
+        self.dnn_config = dnn_config
+        self.confidence = confidence
+        self.roi_margin = roi_margin
+        self._model = None  # Loaded lazily, and again in every worker process
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_model"] = None
+        return state
+
+    def _load_model(self):
+        if self._model is None:
+            if self.backend == "haar":
+                self._model = cv2.CascadeClassifier(
+                    os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+                )
+            elif self.backend == "dnn":
+                self._model = cv2.dnn.readNetFromCaffe(self.dnn_config, self.dnn_model)
+        return self._model
+
+    def min_face_for(self, height):
+        """Smallest face height to detect, in pixels of a frame of the given height"""
+        if self.min_face_fraction is not None:
+            return self.min_face_fraction * height
+        return self.min_face_size
+
+    def scale_for(self, height, width):
+        """
+        Scale to run detection at for a frame of the given size: the one that
+        brings the smallest face to detect up to the detector's smallest face,
+        unless that would exceed max_pixels. With a minimum relative to the
+        frame height, larger frames are scaled down further, so the detector
+        runs on about the same number of pixels for every camera.
+        """
+        scale = DETECTOR_MIN_FACE[self.backend] / float(self.min_face_for(height))
+        return min(scale, math.sqrt(self.max_pixels / float(height * width)))
+
+    def detect(self, frame, regions=None):
+        """
+        Find the faces of a BGR frame.
+
+        :param regions: Optional boxes (top, right, bottom, left, in frame coordinates)
+                        around known faces; only the area around them is searched.
+        :return: The RGB image detection ran on, its scale relative to the frame, and
+                 the face locations (top, right, bottom, left) in that image.
+        """
+        height, width = frame.shape[:2]
+        scale = self.scale_for(height, width)
+        if scale != 1.0:
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            imgS = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=interpolation)
+        else:
+            imgS = frame
+        imgS = cv2.cvtColor(imgS, cv2.COLOR_BGR2RGB)
+
+        if regions is None:
+            return imgS, scale, self._detect(imgS)
+
+        face_locations = []
+        for top, right, bottom, left in self._regions_of_interest(regions, scale, imgS.shape):
+            for t, r, b, l in self._detect(imgS[top:bottom, left:right]):
+                location = (t + top, r + left, b + top, l + left)
+                # Regions of neighbouring faces overlap; keep one box per face
+                if not any(box_iou(location, found) > 0.5 for found in face_locations):
+                    face_locations.append(location)
+        return imgS, scale, face_locations
+
+    def _regions_of_interest(self, regions, scale, shape):
+        height, width = shape[:2]
+        for top, right, bottom, left in regions:
+            margin = self.roi_margin * max(bottom - top, right - left)
+            yield (
+                max(0, int((top - margin) * scale)),
+                min(width, int((right + margin) * scale)),
+                min(height, int((bottom + margin) * scale)),
+                max(0, int((left - margin) * scale)),
+            )
+
+    def _detect(self, image):
+        if image.size == 0:
+            return []
+        if self.backend == "hog":
+            # Imported on first use, as importing face_recognition loads dlib's models
+            import face_recognition
+            return face_recognition.face_locations(image, number_of_times_to_upsample=0)
+        if self.backend == "haar":
+            return self._detect_haar(image)
+        return self._detect_dnn(image)
+
+    def _detect_haar(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        faces = self._load_model().detectMultiScale(
+            gray, scaleFactor=1.1, minNeighbors=5,
+            minSize=(DETECTOR_MIN_FACE["haar"], DETECTOR_MIN_FACE["haar"])
+        )
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in faces]
+
+    def _detect_dnn(self, image):
+        height, width = image.shape[:2]
+        # The SSD accepts any input size; keeping the image size keeps small faces
+        blob = cv2.dnn.blobFromImage(
+            cv2.cvtColor(image, cv2.COLOR_RGB2BGR), 1.0, (width, height), (104.0, 177.0, 123.0)
+        )
+        net = self._load_model()
+        net.setInput(blob)
+        detections = net.forward()
+
+        face_locations = []
+        for i in range(detections.shape[2]):
+            if detections[0, 0, i, 2] < self.confidence:
+                continue
+            left, top, right, bottom = detections[0, 0, i, 3:7] * [width, height, width, height]
+            top, left = max(0, int(top)), max(0, int(left))
+            bottom, right = min(height, int(bottom)), min(width, int(right))
+            if bottom > top and right > left:
+                face_locations.append((top, right, bottom, left))
+        return face_locations
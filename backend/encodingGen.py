@@ -1,9 +1,8 @@
-import cv2
-import face_recognition
-import os
-import pickle
+import sys
 import firebase_admin
-from firebase_admin import credentials, db, storage
+from firebase_admin import credentials, storage
+from gallery import DEFAULT_GALLERY_PATH
+from gallery_builder import build_gallery
 
 cred = credentials.Certificate("backend/serviceAccountKey.json")
 firebase_admin.initialize_app(cred, {
@@ -12,50 +11,28 @@ firebase_admin.initialize_app(cred, {
 })
 
 folderPath = "backend/output_images"
-pathList = os.listdir(folderPath)
-imgList = []
-stdList = []
+# Images without exactly one face are moved here when run with --quarantine
+quarantinePath = "backend/quarantine_images"
 
-for path in pathList:
-    imgstd = cv2.imread(os.path.join(folderPath, path))
-    if imgstd is None:
-        print(f"Warning: Unable to load image {path}")
-        continue
-    imgstd = cv2.resize(imgstd, (1400, 1650))  # Resize imgMode to match desired shape
-    imgList.append(imgstd)
-    stdList.append(os.path.splitext(path)[0])
-    
-    filename = f"{folderPath}/{path}"
-    bucket = storage.bucket()
-    blob = bucket.blob(filename)
-    blob.upload_from_filename(filename)
- 
-    # print(path)
-    # print(os.path.splitext(path)[0])
-print(imgList)
+if __name__ == "__main__":
+    # Only new or changed images are encoded and uploaded
+    print("Encoding Started......")
+    summary = build_gallery(
+        folderPath,
+        DEFAULT_GALLERY_PATH,
+        bucket=storage.bucket(),
+        quarantine_folder=quarantinePath if "--quarantine" in sys.argv else None
+    )
+    print(f"Encoded {len(summary['encoded'])}, reused {len(summary['reused'])}, "
+          f"uploaded {len(summary['uploaded'])} images")
+    print(f"Gallery holds {summary['count']} encodings of {summary['students']} students")
+    for image_name in summary["rejected"]:
+        print(f"Rejected (no face or several faces): {image_name}")
+    for image_name in summary["quarantined"]:
+        print(f"Quarantined: {image_name}")
 
-def findEncodings(imagesList):
-    encodeList = []
-    for img in imagesList:
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        face_encodings = face_recognition.face_encodings(img)
-        if len(face_encodings) > 0:
-            encode = face_encodings[0]
-            encodeList.append(encode)
-        else:
-            print("Warning: No face detected in an image.")
-
-    return encodeList
-
-print("Encoding Started......")
-encodeListKnown = findEncodings(imgList)
-if len(encodeListKnown) > 0:
-    encodeListKnownWithIDs = [encodeListKnown, stdList]
-    print("Encoding Complete")
-
-    file = open("Encode.p", "wb")
-    pickle.dump(encodeListKnownWithIDs, file)
-    file.close()
-    print("File Saved")
-else:
-    print("No encodings generated. Check if faces are present in the images.")
\ No newline at end of file
+    if summary["count"] > 0:
+        print("Encoding Complete")
+        print(f"File Saved: {DEFAULT_GALLERY_PATH}")
+    else:
+        print("No encodings generated. Check if faces are present in the images.")
@@ -0,0 +1,125 @@
+import csv
+import io
+import re
+
+import xlsxwriter
+
+COLUMNS = ["Student ID", "Name", "Attendance Count", "Last Marked"]
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Characters Excel does not allow in sheet names
+_INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+
+class AttendanceTable:
+    """Attendance of one course in one section, ready to export"""
+
+    def __init__(self, major, section, course, rows):
+        self.major = major
+        self.section = section
+        self.course = course
+        self.rows = rows  # Lists of values in COLUMNS order, sorted by student ID
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def attendance_table(major, section, course, students):
+    """
+    Attendance of a course from a section roster (student ID -> student node),
+    one row per student enrolled in the course
+    """
+    rows = []
+    for student_id, student_data in (students or {}).items():
+        if isinstance(student_data, dict) and 'Courses' in student_data:
+            course_data = student_data['Courses'].get(course, {})
+            if course_data:  # Only include students enrolled in the course
+                rows.append([
+                    student_id,
+                    student_data.get('Name', 'N/A'),
+                    course_data.get('count', 0),
+                    course_data.get('last_marked', 'Never'),
+                ])
+    rows.sort(key=lambda row: row[0])
+    return AttendanceTable(major, section, course, rows)
+
+
+def section_courses(students):
+    """All courses any student of a section roster is enrolled in, sorted"""
+    courses = set()
+    for student_data in (students or {}).values():
+        if isinstance(student_data, dict) and 'Courses' in student_data:
+            courses.update(student_data['Courses'].keys())
+    return sorted(courses)
+
+
+def _sheet_name(table, used):
+    """Unique Excel sheet name (at most 31 characters) for a table"""
+    base = _INVALID_SHEET_CHARS.sub("_", f"{table.section} {table.course}")[:31] or "Attendance"
+    name, suffix = base, 1
+    while name.lower() in used:
+        suffix += 1
+        name = f"{base[:31 - len(str(suffix)) - 1]}~{suffix}"
+    used.add(name.lower())
+    return name
+
+
+def workbook_bytes(tables, sheet_name=None):
+    """
+    Excel workbook with one formatted sheet per table, built in memory.
+
+    :param sheet_name: Name of the sheet when there is a single table
+                       (default: section and course).
+    :return: BytesIO positioned at the start of the workbook.
+    """
+    output = io.BytesIO()
+    # in_memory keeps xlsxwriter from using temporary files
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    header_format = workbook.add_format({
+        'bold': True,
+        'text_wrap': True,
+        'valign': 'top',
+        'bg_color': '#D3D3D3',
+        'border': 1
+    })
+
+    used = set()
+    for table in tables:
+        name = sheet_name if sheet_name and len(tables) == 1 else _sheet_name(table, used)
+        worksheet = workbook.add_worksheet(name)
+        widths = [len(column) for column in COLUMNS]
+        worksheet.write_row(0, 0, COLUMNS, header_format)
+        for row_number, row in enumerate(table.rows, start=1):
+            worksheet.write_row(row_number, 0, row)
+            # Widths are tracked while writing instead of in a second pass
+            for col_num, value in enumerate(row):
+                widths[col_num] = max(widths[col_num], len(str(value)))
+        for col_num, width in enumerate(widths):
+            worksheet.set_column(col_num, col_num, width + 2)
+
+    workbook.close()
+    output.seek(0)
+    return output
+
+
+def csv_chunks(tables, chunk_rows=1000):
+    """
+    The tables as one CSV document, yielded in chunks of chunk_rows rows. With
+    several tables, every row starts with its major, section and course.
+    """
+    multiple = len(tables) > 1
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow((["Major", "Section", "Course"] if multiple else []) + COLUMNS)
+
+    written = 0
+    for table in tables:
+        prefix = [table.major, table.section, table.course] if multiple else []
+        for row in table.rows:
+            writer.writerow(prefix + row)
+            written += 1
+            if written % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
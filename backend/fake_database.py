@@ -0,0 +1,163 @@
+"""
+In-memory stand-in for the Realtime Database, for the tests and the benchmark.
+
+FakeDatabase(...).reference replaces firebase_admin.db.reference wherever the
+backend takes a reference callable. Failures of the real database can be
+injected with update_error and read_error.
+"""
+import copy
+import queue
+import threading
+from collections import namedtuple
+
+# The attributes of firebase_admin.db.Event the backend reads
+FakeEvent = namedtuple("FakeEvent", ["event_type", "path", "data"])
+
+
+def _split(path):
+    return [key for key in path.split("/") if key]
+
+
+def _node(root, keys):
+    node = root
+    for key in keys:
+        node = node.get(key) if isinstance(node, dict) else None
+        if node is None:
+            return None
+    return node
+
+
+class FakeListener:
+    """
+    Registration returned by FakeReference.listen. Like Firebase, it delivers
+    its events in a thread of its own; close() stops them.
+    """
+
+    def __init__(self, database, keys, callback):
+        self.database = database
+        self.keys = keys
+        self.callback = callback
+        self.events = queue.Queue()
+        threading.Thread(target=self._run, name="fake-listener", daemon=True).start()
+
+    def _run(self):
+        while True:
+            event = self.events.get()
+            try:
+                if event is None:
+                    return
+                self.callback(event)
+            finally:
+                self.events.task_done()
+
+    def close(self):
+        with self.database.lock:
+            if self in self.database.listeners:
+                self.database.listeners.remove(self)
+        self.events.put(None)
+
+
+class FakeReference:
+    """The parts of firebase_admin.db.Reference the backend uses, on a FakeDatabase"""
+
+    def __init__(self, database, path):
+        self.database = database
+        self.keys = _split(path)
+
+    def get(self):
+        with self.database.lock:
+            self.database.reads += 1
+            if self.database.read_error is not None:
+                raise self.database.read_error
+            return copy.deepcopy(_node(self.database.root, self.keys))
+
+    def _set(self, keys, value):
+        if not keys:
+            self.database.root = copy.deepcopy(value) or {}
+            return
+        node = self.database.root
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        if value is None:
+            node.pop(keys[-1], None)
+        elif isinstance(value, dict) and ".sv" in value:
+            node[keys[-1]] = node.get(keys[-1], 0) + value[".sv"]["increment"]
+        else:
+            node[keys[-1]] = copy.deepcopy(value)
+
+    def update(self, updates):
+        written = [self.keys + _split(path) for path in updates]
+        with self.database.lock:
+            self.database.writes += 1
+            error = self.database.update_error(updates) if self.database.update_error else None
+            if error is not None and not self.database.apply_failed_updates:
+                raise error
+            for keys, value in zip(written, updates.values()):
+                self._set(keys, value)
+            events = self.database._events(written)
+        self.database._dispatch(events)
+        if error is not None:
+            raise error
+
+    def set(self, value):
+        with self.database.lock:
+            self.database.writes += 1
+            self._set(self.keys, value)
+            events = self.database._events([self.keys])
+        self.database._dispatch(events)
+
+    def delete(self):
+        self.set(None)
+
+    def listen(self, callback):
+        """
+        Call callback with a put of the whole node, then with a put for every
+        later write to or above it. A write returns once its events are handled.
+        """
+        listener = FakeListener(self.database, self.keys, callback)
+        with self.database.lock:
+            self.database.listeners.append(listener)
+            listener.events.put(FakeEvent("put", "/", copy.deepcopy(_node(self.database.root, self.keys))))
+        return listener
+
+
+class FakeDatabase:
+    """In-memory stand-in for the Realtime Database; reference() replaces db.reference"""
+
+    def __init__(self, root=None):
+        self.root = root or {}
+        self.reads = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.listeners = []
+        # Called with every multi-path update; the exception it returns is raised by the update
+        self.update_error = None
+        # Failing updates are applied before they raise, like a write whose response was lost
+        self.apply_failed_updates = False
+        # Raised by every get()
+        self.read_error = None
+
+    def reference(self, path="/"):
+        return FakeReference(self, path)
+
+    def _events(self, written):
+        """Events of the listeners affected by writes to the given paths; called with the lock held"""
+        events = []
+        for listener in self.listeners:
+            depth = len(listener.keys)
+            for keys in written:
+                if keys[:depth] == listener.keys:
+                    path, data = "/" + "/".join(keys[depth:]), _node(self.root, keys)
+                elif listener.keys[:len(keys)] == keys:
+                    path, data = "/", _node(self.root, listener.keys)
+                else:
+                    continue
+                events.append((listener, FakeEvent("put", path, copy.deepcopy(data))))
+        return events
+
+    @staticmethod
+    def _dispatch(events):
+        for listener, event in events:
+            listener.events.put(event)
+        for listener in {listener for listener, _ in events}:
+            listener.events.join()
@@ -0,0 +1,153 @@
+"""
+On-disk face gallery: one contiguous float32 matrix plus an ID table and metadata.
+
+Layout of a gallery file (all integers little-endian):
+
+    magic      4 bytes   b"FGAL"
+    version    uint32    format version (GALLERY_FORMAT_VERSION)
+    header     uint32    length of the JSON header in bytes
+    JSON header          {"count", "dim", "student_ids", "metadata"}
+    padding              zero bytes up to a multiple of 64
+    matrix               count x dim float32 values, row-major
+
+The matrix is memory-mapped when loaded, so every process that opens the same
+file shares one copy of its pages and nothing has to be deserialized.
+
+Convert an existing pickle once with:
+
+    python backend/gallery.py backend/Encode.p backend/Encode.gallery
+"""
+import json
+import os
+import struct
+import sys
+from datetime import datetime
+
+import numpy as np
+
+GALLERY_MAGIC = b"FGAL"
+GALLERY_FORMAT_VERSION = 1
+DEFAULT_GALLERY_PATH = "backend/Encode.gallery"
+ENCODING_MODEL = "dlib_face_recognition_resnet_model_v1"
+
+_PREAMBLE = struct.Struct("<4sII")
+_ALIGNMENT = 64
+
+
+class GalleryFormatError(Exception):
+    """The file is not a gallery this version can read"""
+
+
+def validate_gallery(encodings, student_ids):
+    """Raise GalleryFormatError unless every row has an ID and a finite encoding"""
+    if len(student_ids) != len(encodings):
+        raise GalleryFormatError(f"Gallery has {len(encodings)} encodings but {len(student_ids)} IDs")
+    if any(not student_id for student_id in student_ids):
+        raise GalleryFormatError("Gallery has rows without a student ID")
+    if len(encodings) and not np.isfinite(encodings).all():
+        raise GalleryFormatError("Gallery has non-finite encodings")
+
+
+class Gallery:
+    """A loaded gallery; encodings is a read-only memory map of the file's matrix"""
+
+    def __init__(self, encodings, student_ids, metadata, path=None):
+        self.encodings = encodings
+        self.student_ids = student_ids
+        self.metadata = metadata
+        self.path = path
+
+    def __len__(self):
+        return len(self.student_ids)
+
+
+def save_gallery(path, encodings, student_ids, metadata=None):
+    """
+    Write a gallery file, replacing any existing one atomically.
+
+    :param encodings: Sequence of face encodings (or a (count, dim) array).
+    :param student_ids: Student ID of each encoding.
+    :param metadata: Extra JSON-serializable metadata (e.g. per-row source image
+                     hashes); the model name and creation time are added.
+    """
+    matrix = np.asarray(encodings, dtype="<f4")
+    if matrix.size == 0:
+        matrix = np.empty((0, 128), dtype="<f4")
+    matrix = np.ascontiguousarray(matrix.reshape(len(matrix), matrix.shape[-1]))
+    student_ids = [str(student_id) for student_id in student_ids]
+    validate_gallery(matrix, student_ids)
+
+    header = json.dumps({
+        "count": len(matrix),
+        "dim": matrix.shape[1],
+        "student_ids": student_ids,
+        "metadata": {
+            "model": ENCODING_MODEL,
+            "created": datetime.now().isoformat(),
+            **(metadata or {}),
+        },
+    }).encode("utf-8")
+    data_offset = _PREAMBLE.size + len(header)
+    padding = -data_offset % _ALIGNMENT
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp{os.getpid()}"
+    with open(temp_path, "wb") as file:
+        file.write(_PREAMBLE.pack(GALLERY_MAGIC, GALLERY_FORMAT_VERSION, len(header)))
+        file.write(header)
+        file.write(b"\0" * padding)
+        file.write(matrix.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    # Readers either see the old file or the complete new one
+    os.replace(temp_path, path)
+
+
+def read_gallery_header(path):
+    """Header of a gallery file and the offset of its matrix, without mapping the matrix"""
+    with open(path, "rb") as file:
+        preamble = file.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            raise GalleryFormatError(f"{path} is too short to be a gallery")
+        magic, version, header_length = _PREAMBLE.unpack(preamble)
+        if magic != GALLERY_MAGIC:
+            raise GalleryFormatError(f"{path} is not a gallery file")
+        if version != GALLERY_FORMAT_VERSION:
+            raise GalleryFormatError(f"{path} has gallery format {version}, expected {GALLERY_FORMAT_VERSION}")
+        header = json.loads(file.read(header_length).decode("utf-8"))
+    data_offset = _PREAMBLE.size + header_length
+    return header, data_offset + (-data_offset % _ALIGNMENT)
+
+
+def load_gallery(path=DEFAULT_GALLERY_PATH):
+    """Open a gallery file, memory-mapping its matrix"""
+    header, data_offset = read_gallery_header(path)
+    count, dim = header["count"], header["dim"]
+    if count == 0:
+        encodings = np.empty((0, dim), dtype=np.float32)
+    else:
+        encodings = np.memmap(path, dtype="<f4", mode="r", offset=data_offset, shape=(count, dim))
+    validate_gallery(encodings, header["student_ids"])
+    return Gallery(encodings, header["student_ids"], header["metadata"], path)
+
+
+def convert_pickle(pickle_path, gallery_path):
+    """
+    One-time migration of a legacy [encodings, student_ids] pickle (Encode.p).
+    Only run this on pickles you produced yourself: unpickling executes code.
+    """
+    import pickle
+
+    with open(pickle_path, "rb") as file:
+        encodings, student_ids = pickle.load(file)
+    save_gallery(gallery_path, encodings, student_ids, {"converted_from": os.path.basename(pickle_path)})
+    return len(student_ids)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python backend/gallery.py <Encode.p> <Encode.gallery>")
+        sys.exit(1)
+    count = convert_pickle(sys.argv[1], sys.argv[2])
+    print(f"Converted {count} encodings to {sys.argv[2]}")
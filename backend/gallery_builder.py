@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from gallery import load_gallery, save_gallery, GalleryFormatError
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+# Longest side images are encoded at; converter.py already crops them to the face
+MAX_ENCODE_SIDE = 1024
+
+
+def hash_file(path, algorithm="sha256", chunk_size=1 << 20):
+    """Hex digest of a file, read in chunks"""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def student_id_for(filename):
+    """
+    Student ID an image file belongs to. A student can have several photos:
+    21102010.jpg, 21102010_2.jpg and 21102010_side.png all belong to 21102010.
+    """
+    return os.path.splitext(filename)[0].split("_", 1)[0]
+
+
+def _encode_image(path):
+    """
+    Encode one image in a worker; only this image is held in memory.
+    Images must show exactly one face, anything else is rejected with a reason.
+    """
+    # Imported on first use, as importing face_recognition loads dlib's models
+    import face_recognition
+
+    img = cv2.imread(path)
+    if img is None:
+        return None, "unreadable"
+    scale = MAX_ENCODE_SIDE / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    face_locations = face_recognition.face_locations(img)
+    if not face_locations:
+        return None, "no_face"
+    if len(face_locations) > 1:
+        return None, "multiple_faces"
+    return face_recognition.face_encodings(img, face_locations)[0], None
+
+
+def _previous_state(gallery_path):
+    """Rows and rejected files of the existing gallery, keyed by file name"""
+    try:
+        gallery = load_gallery(gallery_path)
+    except (FileNotFoundError, GalleryFormatError):
+        return {}, {}
+    rows = {}
+    for index, source in enumerate(gallery.metadata.get("sources", [])):
+        rows[source["file"]] = (source, np.array(gallery.encodings[index]))
+    return rows, gallery.metadata.get("rejected", {})
+
+
+def scan_images(folder, previous_sources=None):
+    """
+    Source entries (file, sha256, size, mtime) of the images in a folder.
+    Files whose size and mtime did not change keep their previous hash
+    instead of being read again.
+    """
+    previous_sources = previous_sources or {}
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if not os.path.isfile(path) or os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        stat = os.stat(path)
+        previous = previous_sources.get(filename)
+        if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+            sha256 = previous["sha256"]
+        else:
+            sha256 = hash_file(path)
+        yield {"file": filename, "sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _upload_if_changed(bucket, path):
+    """Upload a file unless the bucket already holds the same content; returns True if uploaded"""
+    blob_name = path.replace(os.sep, "/")
+    existing = bucket.get_blob(blob_name)
+    if existing is not None and existing.md5_hash:
+        local_md5 = base64.b64encode(bytes.fromhex(hash_file(path, "md5"))).decode("ascii")
+        if existing.md5_hash == local_md5:
+            return False
+    bucket.blob(blob_name).upload_from_filename(path)
+    return True
+
+
+def _quarantine(folder, quarantine_folder, filename):
+    os.makedirs(quarantine_folder, exist_ok=True)
+    shutil.move(os.path.join(folder, filename), os.path.join(quarantine_folder, filename))
+
+
+def build_gallery(folder, gallery_path, workers=None, bucket=None, quarantine_folder=None):
+    """
+    Bring a gallery file up to date with an image folder.
+
+    Only images that are new or whose content changed since the last build are
+    encoded, in a pool of worker processes; unchanged images keep their stored
+    encoding and images that were removed drop out of the gallery. Every row
+    of the gallery comes from one image with exactly one face, so a row's ID
+    is always the student in it; a student may have several rows. Images with
+    no face or several faces are rejected, and moved to quarantine_folder when
+    one is given. When a storage bucket is given, newly encoded images are
+    uploaded unless the bucket already holds identical content.
+
+    :return: Summary with the encoded, reused, rejected, quarantined and uploaded
+             file names, the gallery row count and the number of students.
+    """
+    previous_rows, previous_rejected = _previous_state(gallery_path)
+    sources = list(scan_images(folder, {file: row[0] for file, row in previous_rows.items()}))
+
+    reused, pending = [], []
+    rejected = {}
+    for source in sources:
+        previous = previous_rows.get(source["file"])
+        if previous and previous[0]["sha256"] == source["sha256"]:
+            reused.append((source, previous[1]))
+        elif previous_rejected.get(source["file"], {}).get("sha256") == source["sha256"]:
+            # Rejected before and unchanged since; encoding it again gives the same result
+            rejected[source["file"]] = previous_rejected[source["file"]]
+        else:
+            pending.append(source)
+
+    print(f"{len(sources)} images: {len(reused)} unchanged, {len(pending)} to encode")
+    encoded = []
+    if pending:
+        paths = [os.path.join(folder, source["file"]) for source in pending]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_encode_image, paths, chunksize=4)
+            for source, (encoding, reason) in zip(pending, results):
+                if encoding is None:
+                    print(f"Warning: {reason} in image {source['file']}")
+                    rejected[source["file"]] = {"sha256": source["sha256"], "reason": reason}
+                else:
+                    encoded.append((source, encoding))
+
+    quarantined = []
+    if quarantine_folder is not None:
+        for filename in sorted(rejected):
+            _quarantine(folder, quarantine_folder, filename)
+            quarantined.append(filename)
+        rejected = {}
+
+    rows = sorted(reused + encoded, key=lambda row: row[0]["file"])
+    save_gallery(
+        gallery_path,
+        [encoding for _, encoding in rows],
+        [student_id_for(source["file"]) for source, _ in rows],
+        {"sources": [source for source, _ in rows], "rejected": rejected},
+    )
+
+    uploaded = []
+    if bucket is not None and encoded:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            paths = [os.path.join(folder, source["file"]) for source, _ in encoded]
+            for path, was_uploaded in zip(paths, executor.map(lambda p: _upload_if_changed(bucket, p), paths)):
+                if was_uploaded:
+                    uploaded.append(os.path.basename(path))
+
+    return {
+        "encoded": [source["file"] for source, _ in encoded],
+        "reused": [source["file"] for source, _ in reused],
+        "rejected": sorted(rejected),
+        "quarantined": quarantined,
+        "uploaded": uploaded,
+        "count": len(rows),
+        "students": len({student_id_for(source["file"]) for source, _ in rows}),
+    }
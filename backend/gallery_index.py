@@ -0,0 +1,211 @@
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+
+from matcher import GalleryMatcher
+
+INDEX_BACKENDS = ("exact", "ivf")
+
+
+class IVFMatcher(GalleryMatcher):
+    """
+    Approximate gallery index (inverted file): the gallery is clustered with
+    k-means and a face is only compared with the rows of the nprobe clusters
+    whose centroids are closest to it. Match latency then grows with
+    nprobe * N / nlist instead of N.
+
+    Galleries smaller than exact_below rows are matched exactly, where the
+    clustering would not pay for itself. Course subsets are always exact.
+    """
+
+    def __init__(self, encodings, student_ids, tolerance=0.6, nlist=None, nprobe=8,
+                 exact_below=2000, iterations=10, seed=0):
+        """
+        :param nlist: Number of clusters (default: 4 * sqrt(N)).
+        :param nprobe: Clusters searched per face; higher is slower and more accurate.
+        :param exact_below: Gallery size under which matching stays exact.
+        :param iterations: k-means iterations when training.
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.exact_below = exact_below
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int64)
+        super().__init__(encodings, student_ids, tolerance)
+        self.train()
+
+    def _nearest_centroids(self, vectors, block=4096):
+        """Index of the closest centroid of every vector, computed in blocks to bound memory"""
+        centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        nearest = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block):
+            chunk = vectors[start:start + block]
+            # |c|^2 - 2 v.c orders centroids like the full squared distance
+            scores = centroid_norms[None, :] - 2.0 * (chunk @ self.centroids.T)
+            nearest[start:start + block] = np.argmin(scores, axis=1)
+        return nearest
+
+    def train(self):
+        """(Re)cluster the gallery; call again after it has grown a lot since the last training"""
+        count = len(self)
+        if count == 0:
+            self.centroids = np.empty((0, self.encodings.shape[1]), dtype=np.float32)
+            self.assignments = np.empty(0, dtype=np.int64)
+            self._build_lists()
+            return
+
+        nlist = min(self.nlist or max(1, int(round(4 * math.sqrt(count)))), count)
+        rng = np.random.default_rng(self.seed)
+        # Train on a sample; k-means needs a few dozen points per cluster, not all of them
+        sample_size = min(count, 64 * nlist)
+        sample = self.encodings[np.sort(rng.choice(count, sample_size, replace=False))]
+        self.centroids = np.ascontiguousarray(sample[rng.choice(sample_size, nlist, replace=False)])
+
+        for _ in range(self.iterations):
+            nearest = self._nearest_centroids(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, nearest, sample)
+            sizes = np.bincount(nearest, minlength=nlist)
+            filled = sizes > 0
+            # Empty clusters keep their previous centroid
+            self.centroids[filled] = sums[filled] / sizes[filled, None]
+
+        self.assignments = self._nearest_centroids(self.encodings)
+        self._build_lists()
+
+    def _build_lists(self):
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[k]:bounds[k + 1]] for k in range(len(self.centroids))]
+
+    def match(self, face_encodings):
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [self._no_match() for _ in face_encodings]
+        if len(self) < self.exact_below:
+            return super().match(face_encodings)
+
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.encodings.shape[1])
+        centroid_distances = (
+            np.einsum("ij,ij->i", self.centroids, self.centroids)[None, :] - 2.0 * (queries @ self.centroids.T)
+        )
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+
+        matches = []
+        for query, probe in zip(queries, probes):
+            rows = np.concatenate([self.lists[k] for k in probe])
+            if rows.size == 0:
+                matches.append(self._no_match())
+                continue
+            matches.extend(self._best_matches(self.distances(query[None, :], rows), rows))
+        return matches
+
+    def add(self, encodings, student_ids):
+        """Insert new rows into the clusters of their closest centroids, without retraining"""
+        start = len(self)
+        super().add(encodings, student_ids)
+        if self.centroids is None or len(self.centroids) == 0:
+            self.train()
+            return
+        self.assignments = np.concatenate([self.assignments, self._nearest_centroids(self.encodings[start:])])
+        self._build_lists()
+
+    def remove(self, student_ids):
+        keep = super().remove(student_ids)
+        self.assignments = self.assignments[keep]
+        self._build_lists()
+        return keep
+
+
+def create_matcher(encodings, student_ids, backend="exact", tolerance=0.6, **options):
+    """
+    Gallery index of the requested backend.
+
+    :param backend: "exact" (brute force, GalleryMatcher) or "ivf" (IVFMatcher).
+    :param options: Backend options, e.g. nlist/nprobe for "ivf".
+    """
+    if backend == "exact":
+        return GalleryMatcher(encodings, student_ids, tolerance)
+    if backend == "ivf":
+        return IVFMatcher(encodings, student_ids, tolerance, **options)
+    raise ValueError(f"Unknown gallery index {backend!r}, expected one of {INDEX_BACKENDS}")
+
+
+def benchmark_index(index, queries, reference=None, repeat=3):
+    """
+    Recall and latency of an index on a set of query encodings.
+
+    :param reference: Exact matcher over the same gallery; recall is the share of
+                      queries for which the index finds the same student.
+    :return: Dictionary with recall, mean and p99 latency per face in milliseconds.
+    """
+    latencies = []
+    for query in queries:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            index.match(query[None, :])
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        latencies.append(best * 1000.0)
+
+    result = {
+        "size": len(index),
+        "mean_ms": float(np.mean(latencies)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+    if reference is not None:
+        found = [match.student_id for match in index.match(queries)]
+        expected = [match.student_id for match in reference.match(queries)]
+        result["recall"] = float(np.mean([a == b for a, b in zip(found, expected)]))
+    return result
+
+
+def synthetic_gallery(students, photos_per_student=2, dim=128, spread=0.25, seed=0):
+    """Random gallery shaped like face encodings: one cluster of photos per student"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0.0, 0.09, size=(students, dim)).astype(np.float32)
+    encodings = np.repeat(centres, photos_per_student, axis=0)
+    encodings += rng.normal(0.0, spread / math.sqrt(dim), size=encodings.shape).astype(np.float32)
+    student_ids = [str(i) for i in range(students) for _ in range(photos_per_student)]
+    return centres, encodings, student_ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs. latency of the gallery index backends")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Students in the synthetic gallery")
+    parser.add_argument("--photos", type=int, default=2, help="Photos per student")
+    parser.add_argument("--nprobe", default="1,4,8,16", help="nprobe values to try for ivf")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for students in [int(size) for size in args.sizes.split(",")]:
+        centres, encodings, student_ids = synthetic_gallery(students, args.photos)
+        rng = np.random.default_rng(1)
+        picked = rng.choice(students, min(args.queries, students), replace=False)
+        queries = centres[picked] + rng.normal(0.0, 0.02, size=(len(picked), centres.shape[1])).astype(np.float32)
+
+        exact = create_matcher(encodings, student_ids, "exact")
+        results.append({"backend": "exact", **benchmark_index(exact, queries)})
+        ivf = create_matcher(encodings, student_ids, "ivf", exact_below=0)
+        for nprobe in [int(value) for value in args.nprobe.split(",")]:
+            ivf.nprobe = nprobe
+            results.append({"backend": "ivf", "nprobe": nprobe, **benchmark_index(ivf, queries, exact)})
+
+    for result in results:
+        print(
+            f"{result['backend']:>5} size={result['size']:>7} nprobe={result.get('nprobe', '-'):>3} "
+            f"recall={result.get('recall', 1.0):.3f} mean={result['mean_ms']:.3f}ms p99={result['p99_ms']:.3f}ms"
+        )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
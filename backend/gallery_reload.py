@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+from gallery import load_gallery
+
+# One loaded version of the gallery file and the index built over it
+GalleryVersion = namedtuple("GalleryVersion", ["gallery", "matcher", "signature", "loaded_at"])
+
+
+class GalleryNotLoaded(RuntimeError):
+    """The first version of the gallery is not loaded yet"""
+
+
+def file_signature(path):
+    """
+    Identity of a gallery file's current content. save_gallery replaces the
+    file, so a new version always has a new inode or mtime.
+    """
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class GalleryReloader:
+    """
+    Keeps the gallery and its index in step with the gallery file.
+
+    A changed file is loaded and indexed off the request path (by the polling
+    thread or an explicit reload()), then swapped in with one assignment of
+    current: a request that read current before the swap finishes against the
+    old version, the next one gets the new version. A file that fails to load,
+    or a version that fails to prepare, leaves the current version in place
+    and is tried again at the next check.
+    """
+
+    def __init__(self, path, build_index, interval=10.0, on_swap=None, load=True, prepare=None):
+        """
+        :param path: Gallery file to follow.
+        :param build_index: Callable building the matcher of a loaded Gallery.
+        :param interval: Seconds between checks of the file (0: only reload() checks).
+        :param on_swap: Called with (previous, current) GalleryVersion after a swap;
+                        previous is None for the first version.
+        :param prepare: Called with (previous, new) GalleryVersion before the swap, e.g. to
+                        start workers on the new version; when it raises, the new version
+                        is not swapped in.
+        :param load: Load the gallery now; otherwise the first reload() loads it,
+                     and current raises GalleryNotLoaded until then.
+        """
+        self.path = path
+        self.build_index = build_index
+        self.interval = interval
+        self.on_swap = on_swap
+        self.prepare = prepare
+        self.last_error = None
+        self._reload_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._current = None
+        if load:
+            self._current = self._load(file_signature(path))
+            self._loaded.set()
+
+    @property
+    def loaded(self):
+        return self._loaded.is_set()
+
+    @property
+    def current(self):
+        """The GalleryVersion in use"""
+        if not self._loaded.is_set():
+            raise GalleryNotLoaded(f"Gallery {self.path} is not loaded yet" + (
+                f": {self.last_error}" if self.last_error else ""
+            ))
+        return self._current
+
+    def _load(self, signature):
+        gallery = load_gallery(self.path)
+        return GalleryVersion(gallery, self.build_index(gallery), signature, time.time())
+
+    def reload(self, force=False):
+        """
+        Load the gallery file if it changed since the current version (or
+        always, with force) and swap it in.
+
+        :return: True when a new version was swapped in.
+        """
+        with self._reload_lock:
+            try:
+                signature = file_signature(self.path)
+                if not force and self._current is not None and signature == self._current.signature:
+                    return False
+                loaded = self._load(signature)
+                if self.prepare is not None:
+                    self.prepare(self._current, loaded)
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            self.last_error = None
+            previous, self._current = self._current, loaded
+            self._loaded.set()
+
+        if previous is None:
+            print(f"Gallery loaded: {len(loaded.gallery)} encodings")
+        else:
+            print(f"Gallery reloaded: {len(loaded.gallery)} encodings (was {len(previous.gallery)})")
+        if self.on_swap is not None:
+            self.on_swap(previous, loaded)
+        return True
+
+    def start(self):
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="gallery-reloader", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.reload()
+            except FileNotFoundError:
+                # Between two checks of a file being replaced by hand; retried next time
+                pass
+            except Exception as e:
+                print(f"Error reloading gallery {self.path}: {e}")
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,259 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock, Thread
+
+import cv2
+import numpy as np
+
+from gallery import load_gallery
+from gallery_index import create_matcher
+from metrics import collect, record_timings, timed
+from recognition import analyze_frame
+
+
+class EngineBusy(Exception):
+    """Every slot of the request queue stayed taken for the whole wait"""
+
+
+class WorkerCrashed(EngineBusy):
+    """A worker process died while the frame was queued or running; the next frame gets a new pool"""
+
+
+class FrameDropped(Exception):
+    """A newer frame of the same camera arrived while this one was waiting"""
+
+
+# Per-process state of a worker, loaded once by _init_worker
+_worker_matcher = None
+_worker_detector = None
+_worker_course_galleries = OrderedDict()
+_MAX_COURSE_GALLERIES = 64
+
+
+def _init_worker(gallery_path, tolerance, detector, index_backend):
+    global _worker_matcher, _worker_detector
+    # The gallery is memory-mapped, so all workers share one copy of its pages
+    gallery = load_gallery(gallery_path)
+    _worker_matcher = create_matcher(gallery.encodings, gallery.student_ids, index_backend, tolerance)
+    _worker_detector = detector
+    _worker_course_galleries.clear()
+
+
+def _course_gallery(enrolled_ids):
+    """Course subset of the worker's gallery, kept for the most recently used courses"""
+    if enrolled_ids is None:
+        return None
+    gallery = _worker_course_galleries.get(enrolled_ids)
+    if gallery is None:
+        gallery = _worker_matcher.subset(enrolled_ids)
+        _worker_course_galleries[enrolled_ids] = gallery
+        if len(_worker_course_galleries) > _MAX_COURSE_GALLERIES:
+            _worker_course_galleries.popitem(last=False)
+    else:
+        _worker_course_galleries.move_to_end(enrolled_ids)
+    return gallery
+
+
+def _analyze(frame_data, enrolled_ids, skip_boxes, regions):
+    """Analysis of one frame and the time its stages took, which the caller records"""
+    with collect() as timings:
+        with timed("decode"):
+            frame = cv2.imdecode(np.frombuffer(frame_data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Frame could not be decoded")
+        frame_boxes, matches = analyze_frame(
+            frame, _worker_matcher, _course_gallery(enrolled_ids), skip_boxes,
+            detector=_worker_detector, regions=regions
+        )
+    return frame_boxes, matches, timings
+
+
+class InferenceEngine:
+    """
+    Runs face detection, encoding and matching in a pool of worker processes.
+
+    Each worker loads the gallery once when it starts; reload() starts a
+    fresh pool on the current gallery file and moves new frames to it once
+    its workers are up. When a worker dies, a new pool is started and warmed
+    up the same way in the background; frames fail fast until it is up. At
+    most max_pending
+    frames are queued or running at a time; callers wait for a free slot and
+    a camera's frame is dropped when a newer frame of the same camera arrives
+    before it got one.
+    """
+
+    def __init__(self, gallery_path, workers=None, max_pending=None,
+                 tolerance=0.6, queue_timeout=2.0, detector=None, index_backend="exact"):
+        """
+        :param gallery_path: Gallery file every worker maps at startup.
+        :param workers: Number of worker processes (default: one less than the CPU count).
+        :param max_pending: Frames queued or running at once (default: twice the workers).
+        :param queue_timeout: Seconds to wait for a free slot before giving up.
+        :param detector: FaceDetector the workers use (default: HOG).
+        :param index_backend: Gallery index the workers build ("exact" or "ivf").
+        """
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 2) - 1)
+        self.workers = workers
+        self.max_pending = max_pending or 2 * workers
+        self.queue_timeout = queue_timeout
+        self._initargs = (gallery_path, tolerance, detector, index_backend)
+        self._pool = None
+        self._restarting = False
+        self._warmup_frame = None  # Frame new pools are warmed up with
+        self._slots = BoundedSemaphore(self.max_pending)
+        self._latest = {}  # camera -> sequence number of its newest frame
+        self.pending = 0  # Frames holding a slot
+        self._lock = Lock()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=self._initargs,
+        )
+
+    def _executor(self):
+        # Created on first use so importing the app does not start processes
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._new_pool()
+            return self._pool
+
+    def _start_pool(self, frame_data=None):
+        """
+        A new pool with all its workers started, so it has loaded the gallery,
+        and, given a frame, the models too by analyzing it in every worker
+        """
+        pool = self._new_pool()
+        try:
+            # Submitted together, one task per worker makes the pool start all its workers
+            if frame_data is None:
+                futures = [pool.submit(os.getpid) for _ in range(self.workers)]
+            else:
+                futures = [pool.submit(_analyze, frame_data, None, [], None) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+        except Exception:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        return pool
+
+    def _swap(self, pool, broken=None):
+        """
+        Move new frames to pool. Given the broken pool it replaces, only if
+        that is still in use; otherwise pool is not needed and shut down.
+        """
+        with self._lock:
+            if broken is not None and self._pool is not broken:
+                previous = pool
+            else:
+                previous, self._pool = self._pool, pool
+        if previous is not None:
+            # Frames already submitted finish on the previous pool, which shuts down after them
+            previous.shutdown(wait=False)
+
+    def analyze(self, camera, frame_data, enrolled_ids=None, skip_boxes=(), regions=None):
+        """
+        Analyze one encoded frame in a worker.
+
+        :param camera: Key of the frame's source; only its newest frame is kept waiting.
+        :param frame_data: JPEG/PNG bytes of the frame.
+        :param enrolled_ids: IDs of the course's enrolled students, matched first.
+        :param skip_boxes: Locations of faces the caller already identified.
+        :param regions: Boxes to restrict detection to (None: the whole frame).
+        :return: Face locations in frame coordinates and a Match (or None when
+                 skipped) per location.
+        :raises EngineBusy: When no slot frees up within queue_timeout.
+        :raises FrameDropped: When a newer frame of the same camera arrived meanwhile.
+        :raises WorkerCrashed: When a worker died (an EngineBusy, the frame can be sent again).
+        """
+        with self._lock:
+            sequence = self._latest.get(camera, 0) + 1
+            self._latest[camera] = sequence
+
+        with timed("queue_wait"):
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        if not acquired:
+            raise EngineBusy(f"No inference slot free within {self.queue_timeout}s")
+        with self._lock:
+            self.pending += 1
+        try:
+            if self._latest.get(camera) != sequence:
+                raise FrameDropped(f"Frame {sequence} of {camera} is stale")
+            enrolled_key = tuple(sorted(enrolled_ids)) if enrolled_ids is not None else None
+            with timed("inference"):
+                pool = self._executor()
+                try:
+                    future = pool.submit(_analyze, frame_data, enrolled_key, list(skip_boxes), regions)
+                    frame_boxes, matches, timings = future.result()
+                except BrokenProcessPool as e:
+                    # A broken pool stays broken; frames fail fast on it until its replacement is up
+                    self._restart(pool)
+                    raise WorkerCrashed(f"An inference worker died: {e}") from e
+            # Stages measured in the worker
+            record_timings(timings)
+            return frame_boxes, matches
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+    def warm_up(self, frame_data=None):
+        """
+        Start the workers and run a frame through them, so the first real frames
+        do not pay for process start, gallery loading and model loading.
+        The frame is kept to warm up the pools started later.
+        """
+        self._warmup_frame = frame_data
+        self._swap(self._start_pool(frame_data))
+
+    def reload(self, frame_data=None):
+        """
+        Move new frames to a pool on the current gallery file. The new pool is
+        started and warmed up with frame_data first, in the caller's thread;
+        until then frames keep going to the current pool. If the new pool
+        fails to start, the current one stays in use and the error is raised.
+        """
+        if frame_data is not None:
+            self._warmup_frame = frame_data
+        self._swap(self._start_pool(frame_data))
+
+    def _restart(self, broken):
+        """Replace a pool whose worker died with a new, warmed-up one, in a background thread"""
+        with self._lock:
+            if self._pool is not broken or self._restarting:
+                return
+            self._restarting = True
+        Thread(target=self._replace, args=(broken,), name="inference-restart", daemon=True).start()
+
+    def _replace(self, broken):
+        try:
+            self._swap(self._start_pool(self._warmup_frame), broken)
+            print("Inference workers restarted after a worker died")
+        except Exception as e:
+            # The next frame starts a pool itself
+            print(f"Error restarting the inference workers: {e}")
+            self._discard(broken)
+        finally:
+            with self._lock:
+                self._restarting = False
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def forget(self, camera):
+        """Drop the bookkeeping of a camera whose session ended"""
+        with self._lock:
+            self._latest.pop(camera, None)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
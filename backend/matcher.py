@@ -0,0 +1,141 @@
+import numpy as np
+from collections import namedtuple
+
+# Result of matching one face against the gallery
+Match = namedtuple("Match", ["index", "student_id", "distance", "margin", "is_match"])
+
+
+class GalleryMatcher:
+    """
+    Holds the known face encodings as one contiguous float32 matrix and matches
+    every face of a frame against it in a single batched distance computation.
+    A student may have several rows (one per enrolled photo).
+
+    This is the exact backend of the gallery index; see gallery_index.py for the
+    approximate one. add() and remove() rebuild the arrays in place and must not
+    run concurrently with match(); build a new matcher and swap it in instead.
+    """
+
+    def __init__(self, encodings, student_ids, tolerance=0.6):
+        """
+        :param encodings: Sequence of 128-d face encodings (or an (N, 128) array).
+        :param student_ids: Student ID for each row of encodings.
+        :param tolerance: Maximum distance for a face to count as a match (default: 0.6).
+        """
+        self.tolerance = tolerance
+        self._label_of = {}
+        self._set_rows(self._as_matrix(encodings), list(student_ids))
+
+    @staticmethod
+    def _as_matrix(encodings, dim=128):
+        matrix = np.asarray(encodings, dtype=np.float32)
+        if matrix.size == 0:
+            return np.empty((0, dim), dtype=np.float32)
+        return np.ascontiguousarray(matrix.reshape(len(matrix), matrix.shape[-1]))
+
+    def _set_rows(self, encodings, student_ids):
+        if len(student_ids) != len(encodings):
+            raise ValueError(
+                f"Gallery has {len(encodings)} encodings but {len(student_ids)} IDs"
+            )
+        self.encodings = encodings
+        self.student_ids = student_ids
+        # Squared norms are precomputed so a batch only needs one matrix product
+        self.norms = np.einsum("ij,ij->i", encodings, encodings)
+        # Integer label per row, so rows of the same student compare cheaply
+        self.labels = np.array(
+            [self._label_of.setdefault(student_id, len(self._label_of)) for student_id in student_ids],
+            dtype=np.int64,
+        )
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def distances(self, face_encodings, rows=None):
+        """
+        Euclidean distance of every face (rows) to every gallery entry (columns),
+        or only to the given gallery rows
+        """
+        encodings, norms = self.encodings, self.norms
+        if rows is not None:
+            encodings, norms = encodings[rows], norms[rows]
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, self.encodings.shape[1])
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        squared = query_norms[:, None] + norms[None, :] - 2.0 * (queries @ encodings.T)
+        np.maximum(squared, 0.0, out=squared)
+        return np.sqrt(squared)
+
+    def _no_match(self):
+        return Match(None, None, float("inf"), float("inf"), False)
+
+    def _best_matches(self, distances, rows=None):
+        """Match per row of a distance matrix whose columns are gallery rows (all, or the given ones)"""
+        if rows is None:
+            rows = np.arange(distances.shape[1])
+        faces = np.arange(len(distances))
+        best = np.argmin(distances, axis=1)
+        best_distance = distances[faces, best]
+        best_rows = rows[best]
+
+        # Other photos of the best student do not count against the margin
+        labels = self.labels[rows]
+        distances[labels[None, :] == self.labels[best_rows][:, None]] = np.inf
+        margin = distances.min(axis=1) - best_distance
+
+        return [
+            Match(
+                int(index),
+                self.student_ids[index],
+                float(distance),
+                float(gap),
+                bool(distance <= self.tolerance),
+            )
+            for index, distance, gap in zip(best_rows, best_distance, margin)
+        ]
+
+    def match(self, face_encodings):
+        """
+        Match all faces of a frame against the gallery at once.
+
+        :param face_encodings: Encodings of the faces found in a frame.
+        :return: One Match per face with the best index, its distance and the
+                 margin to the closest row of a different student (inf when
+                 there is none).
+        """
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [self._no_match() for _ in face_encodings]
+        return self._best_matches(self.distances(face_encodings))
+
+    def subset(self, student_ids):
+        """Matcher restricted to the given students, e.g. those enrolled in one course"""
+        wanted = set(student_ids)
+        rows = [index for index, student_id in enumerate(self.student_ids) if student_id in wanted]
+        return GalleryMatcher(
+            self.encodings[rows],
+            [self.student_ids[index] for index in rows],
+            self.tolerance,
+        )
+
+    def add(self, encodings, student_ids):
+        """Insert encodings of newly enrolled students (or new photos of existing ones)"""
+        new_rows = self._as_matrix(encodings, self.encodings.shape[1])
+        self._set_rows(
+            np.concatenate([self.encodings, new_rows]),
+            self.student_ids + list(student_ids),
+        )
+
+    def remove(self, student_ids):
+        """
+        Delete every row of the given students.
+
+        :return: Boolean mask of the rows that were kept.
+        """
+        unwanted = set(student_ids)
+        keep = np.array([student_id not in unwanted for student_id in self.student_ids], dtype=bool)
+        self._set_rows(
+            np.ascontiguousarray(self.encodings[keep]),
+            [student_id for student_id, kept in zip(self.student_ids, keep) if kept],
+        )
+        return keep
@@ -0,0 +1,188 @@
+"""
+Counters, gauges and histograms of the backend, exposed in the Prometheus
+text format by the /metrics route.
+
+Stages are timed with timed(); besides feeding a histogram, a timed stage is
+added to the timings being collected on the current thread (see collect()),
+which is how the inference workers send their stage times back with a frame
+and how a profiled request reports its breakdown.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(key, value) for key, value in sorted(self._values.items())]
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; with function, it is read at every scrape"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        if self.function is not None:
+            return [((), self.function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per bucket counts, then the +Inf count and the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, counts in self._samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram(
+    "attendance_stage_seconds", "Time spent in each stage of frame processing", ["stage"]
+)
+FIREBASE_SECONDS = Histogram(
+    "attendance_firebase_seconds", "Latency of Realtime Database calls", ["operation"]
+)
+REQUEST_SECONDS = Histogram(
+    "attendance_request_seconds", "Latency of HTTP requests", ["endpoint"]
+)
+FACES_PER_FRAME = Histogram(
+    "attendance_faces_per_frame", "Faces detected per frame", buckets=COUNT_BUCKETS
+)
+FRAMES = Counter("attendance_frames_total", "Frames received, by outcome", ["outcome"])
+CACHE_REQUESTS = Counter("attendance_cache_requests_total", "Cache lookups, by cache and result", ["cache", "result"])
+STUDENTS_MARKED = Counter("attendance_students_marked_total", "Students newly detected in a session")
+
+_collecting = threading.local()
+
+
+def _add_timing(stage, elapsed):
+    for timings in getattr(_collecting, "stack", ()):
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def start_collecting():
+    """Start collecting the stages timed on this thread; returns the dictionary of stage -> seconds"""
+    timings = {}
+    _collecting.__dict__.setdefault("stack", []).append(timings)
+    return timings
+
+
+def stop_collecting(timings):
+    stack = getattr(_collecting, "stack", [])
+    if any(collected is timings for collected in stack):
+        stack.remove(timings)
+
+
+@contextmanager
+def collect():
+    """Collect the stages timed on this thread within the block"""
+    timings = start_collecting()
+    try:
+        yield timings
+    finally:
+        stop_collecting(timings)
+
+
+@contextmanager
+def timed(stage, histogram=STAGE_SECONDS):
+    """Time a block into the histogram (labelled with stage) and the collected timings"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, **{histogram.labelnames[0]: stage})
+        _add_timing(stage, elapsed)
+
+
+def record_timings(timings, histogram=STAGE_SECONDS):
+    """Observe stage times measured elsewhere, e.g. in an inference worker"""
+    for stage, elapsed in timings.items():
+        histogram.observe(elapsed, **{histogram.labelnames[0]: stage})
+        _add_timing(stage, elapsed)
+
+
+def exposition():
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
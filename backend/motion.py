@@ -0,0 +1,113 @@
+import cv2
+import numpy as np
+
+
+def thumbnail(frame, width=80):
+    """Small blurred grayscale copy of a BGR frame, for comparing frames cheaply"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height = max(1, int(round(gray.shape[0] * width / gray.shape[1])))
+    small = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(small, (3, 3), 0)
+
+
+def thumbnail_from_bytes(frame_data, width=80):
+    """
+    Thumbnail of an encoded frame and the frame's (height, width). JPEGs are
+    decoded at 1/8 scale, which skips most of the decoding work.
+    """
+    buffer = np.frombuffer(frame_data, np.uint8)
+    reduced = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if reduced is None:
+        return None, None
+    # The reduced image is the frame divided by 8, rounded up
+    height = max(1, int(round(reduced.shape[0] * width / reduced.shape[1])))
+    small = cv2.resize(reduced, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(small, (3, 3), 0), (reduced.shape[0] * 8, reduced.shape[1] * 8)
+
+
+class SceneGate:
+    """
+    Decides per frame whether a session's camera view changed enough to run
+    detection again.
+
+    A frame is compared with the last frame that was analyzed, on thumbnails:
+    pixels whose brightness moved by more than pixel_threshold count as
+    changed. Below min_changed (a fraction of the thumbnail) the frame is
+    skipped and the previous result reused; up to max_partial only the changed
+    regions need detection; above it, or when the last full pass is older than
+    force_interval seconds, the whole frame is analyzed.
+    """
+
+    def __init__(self, force_interval=5.0, pixel_threshold=12, min_changed=0.002,
+                 max_partial=0.25, min_region=160, min_region_fraction=None):
+        """
+        :param force_interval: Seconds after which a full pass runs regardless of change.
+        :param pixel_threshold: Brightness difference (0-255) for a thumbnail pixel to count as changed.
+        :param min_changed: Changed fraction under which a frame is skipped.
+        :param max_partial: Changed fraction over which the whole frame is analyzed.
+        :param min_region: Smallest side, in frame pixels, of a changed region, so a
+                           region around a small movement still holds a whole face.
+        :param min_region_fraction: The same relative to the frame height; replaces
+                                    min_region when set.
+        """
+        self.force_interval = force_interval
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.max_partial = max_partial
+        self.min_region = min_region
+        self.min_region_fraction = min_region_fraction
+        self._reference = None
+        self._last_full_pass = None
+        self.skipped = 0
+
+    def _changed_regions(self, mask, frame_shape):
+        """Boxes (top, right, bottom, left) in frame coordinates around the changed areas"""
+        scale_y = frame_shape[0] / mask.shape[0]
+        scale_x = frame_shape[1] / mask.shape[1]
+        min_region = self.min_region
+        if self.min_region_fraction is not None:
+            min_region = self.min_region_fraction * frame_shape[0]
+        mask = cv2.dilate(mask.astype(np.uint8), np.ones((3, 3), np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        regions = []
+        for x, y, w, h, _ in stats[1:count]:
+            top, bottom = y * scale_y, (y + h) * scale_y
+            left, right = x * scale_x, (x + w) * scale_x
+            # Grow small regions around their centre up to min_region
+            grow_y = max(0.0, min_region - (bottom - top)) / 2
+            grow_x = max(0.0, min_region - (right - left)) / 2
+            regions.append((
+                max(0, int(top - grow_y)),
+                min(frame_shape[1], int(right + grow_x)),
+                min(frame_shape[0], int(bottom + grow_y)),
+                max(0, int(left - grow_x)),
+            ))
+        return regions
+
+    def check(self, thumb, frame_shape, now):
+        """
+        Compare a frame's thumbnail with the last analyzed one. The thumbnail
+        becomes the new reference unless the frame is skipped.
+
+        :param frame_shape: (height, width) of the full frame.
+        :param now: Monotonic time of the frame.
+        :return: (changed, regions): changed is False when the previous result
+                 still holds; regions is None for a full pass, or the changed
+                 boxes in frame coordinates.
+        """
+        reference = self._reference
+        if (reference is None or reference.shape != thumb.shape or
+                now - self._last_full_pass >= self.force_interval):
+            self._reference, self._last_full_pass = thumb, now
+            return True, None
+
+        mask = cv2.absdiff(thumb, reference) > self.pixel_threshold
+        changed = mask.mean()
+        if changed < self.min_changed:
+            self.skipped += 1
+            return False, None
+        self._reference = thumb
+        if changed > self.max_partial:
+            self._last_full_pass = now
+            return True, None
+        return True, self._changed_regions(mask, frame_shape)
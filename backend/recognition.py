@@ -0,0 +1,79 @@
+from detection import FaceDetector
+from metrics import timed
+from tracker import box_iou
+
+default_detector = FaceDetector()
+
+
+def detect_faces(frame, detector=None, regions=None):
+    """
+    Find the faces of a BGR frame at the scale the detector picks for it.
+
+    :param regions: Optional boxes (frame coordinates) to restrict detection to.
+    :return: The RGB image detection ran on, its scale relative to the frame and
+             the face locations in its coordinates.
+    """
+    if detector is None:
+        detector = default_detector
+    with timed("detect"):
+        return detector.detect(frame, regions)
+
+
+def to_frame_box(location, scale):
+    """Face location of a detection image in the coordinates of the full frame"""
+    return tuple(int(round(coord / scale)) for coord in location)
+
+
+def encode_faces(imgS, face_locations):
+    """Face encodings for the given locations of a detected image"""
+    if not face_locations:
+        return []
+    import face_recognition  # Loads dlib's models on first use
+    with timed("encode"):
+        return face_recognition.face_encodings(imgS, face_locations)
+
+
+def match_faces(face_encodings, matcher, course_gallery=None):
+    """
+    Match faces against a course gallery, falling back to the global gallery
+    only to tell "Not Enrolled" apart from "Unknown"
+    """
+    with timed("match"):
+        # Match every face against the enrolled students in one batch
+        if course_gallery is None:
+            course_gallery = matcher
+        matches = course_gallery.match(face_encodings)
+
+        # Only faces no enrolled student matched go to the global gallery
+        unmatched = [i for i, match in enumerate(matches) if not match.is_match]
+        if unmatched and course_gallery is not matcher:
+            global_matches = matcher.match([face_encodings[i] for i in unmatched])
+            for i, match in zip(unmatched, global_matches):
+                matches[i] = match
+        return matches
+
+
+def analyze_frame(frame, matcher, course_gallery=None, skip_boxes=(), iou_threshold=0.3,
+                  detector=None, regions=None):
+    """
+    Detect, encode and match the faces of a frame in one call, for running
+    outside the request thread.
+
+    Faces overlapping one of skip_boxes (faces the caller already identified)
+    are detected but not encoded or matched.
+
+    :return: Face locations in frame coordinates and, for every location, its
+             Match or None when skipped.
+    """
+    imgS, scale, face_locations = detect_faces(frame, detector, regions)
+    frame_boxes = [to_frame_box(location, scale) for location in face_locations]
+    pending = [
+        i for i, box in enumerate(frame_boxes)
+        if not any(box_iou(box, skip_box) >= iou_threshold for skip_box in skip_boxes)
+    ]
+    matches = [None] * len(face_locations)
+    if pending:
+        face_encodings = encode_faces(imgS, [face_locations[i] for i in pending])
+        for i, match in zip(pending, match_faces(face_encodings, matcher, course_gallery)):
+            matches[i] = match
+    return frame_boxes, matches
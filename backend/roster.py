@@ -0,0 +1,186 @@
+import time
+from threading import Lock
+
+from metrics import CACHE_REQUESTS, FIREBASE_SECONDS, timed
+
+
+class SectionRoster:
+    """
+    Cached copy of one section's Students tree.
+
+    The tree is fetched once and then served from memory until it is older than
+    the TTL, explicitly invalidated, or (when listening) patched in place by
+    Realtime Database events.
+    """
+
+    def __init__(self, reference, path, ttl=300):
+        """
+        :param reference: Callable returning a database reference for a path (db.reference).
+        :param path: Path of the section's Students node.
+        :param ttl: Seconds before a cached tree is fetched again (None: never expires).
+        """
+        self._reference = reference
+        self.path = path
+        self.ttl = ttl
+        self._students = None
+        self._loaded_at = 0.0
+        self._enrolled = {}  # course -> enrolled students, derived from _students
+        self._listener = None
+        self._lock = Lock()
+
+    def _is_fresh(self):
+        if self._students is None:
+            return False
+        if self._listener is not None or self.ttl is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    def _store(self, students):
+        self._students = students if isinstance(students, dict) else {}
+        self._loaded_at = time.monotonic()
+        self._enrolled = {}
+
+    def refresh(self):
+        """Fetch the Students tree from the database, replacing the cached copy"""
+        with timed("roster_get", FIREBASE_SECONDS):
+            students = self._reference(self.path).get()
+        with self._lock:
+            self._store(students)
+            return self._students
+
+    def get(self):
+        """Students of the section, keyed by student ID"""
+        with self._lock:
+            if self._is_fresh():
+                CACHE_REQUESTS.inc(cache="roster", result="hit")
+                return self._students
+        CACHE_REQUESTS.inc(cache="roster", result="miss")
+        return self.refresh()
+
+    def enrolled(self, course):
+        """Students of the section that are enrolled in the given course"""
+        students = self.get()
+        with self._lock:
+            if course not in self._enrolled:
+                self._enrolled[course] = {
+                    student_id: student_data
+                    for student_id, student_data in students.items()
+                    if isinstance(student_data, dict) and
+                    'Courses' in student_data and
+                    course in student_data['Courses']
+                }
+            return self._enrolled[course]
+
+    def invalidate(self):
+        """Drop the cached tree so the next read goes to the database"""
+        with self._lock:
+            self._students = None
+            self._enrolled = {}
+
+    def listen(self):
+        """Keep the cached tree fresh from Realtime Database events instead of the TTL"""
+        with self._lock:
+            if self._listener is None:
+                self._listener = self._reference(self.path).listen(self._on_event)
+
+    def close(self):
+        """Stop listening for database events"""
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+
+    def _on_event(self, event):
+        keys = [key for key in event.path.split('/') if key]
+        with self._lock:
+            if not keys:
+                if event.event_type == 'put':
+                    self._store(event.data)
+                elif self._students is not None and isinstance(event.data, dict):
+                    self._students.update(event.data)
+                    self._enrolled = {}
+                return
+
+            if self._students is None:
+                # Nothing cached yet, the next read fetches the whole tree
+                return
+
+            node = self._students
+            for key in keys[:-1]:
+                child = node.get(key)
+                if not isinstance(child, dict):
+                    child = node[key] = {}
+                node = child
+
+            last = keys[-1]
+            if event.event_type == 'patch' and isinstance(event.data, dict):
+                target = node.get(last)
+                if not isinstance(target, dict):
+                    target = node[last] = {}
+                for key, value in event.data.items():
+                    if value is None:
+                        target.pop(key, None)
+                    else:
+                        target[key] = value
+            elif event.data is None:
+                node.pop(last, None)
+            else:
+                node[last] = event.data
+            self._enrolled = {}
+
+
+class RosterCache:
+    """Section rosters shared by every route, keyed by (major, section)"""
+
+    def __init__(self, reference, ttl=300, listen=False):
+        """
+        :param reference: Callable returning a database reference for a path. The
+                          Firebase db.reference in production, a local fake in tests.
+        :param ttl: Seconds before a cached section is fetched again.
+        :param listen: Keep loaded sections fresh with Realtime Database listeners.
+        """
+        self._reference = reference
+        self.ttl = ttl
+        self.listen = listen
+        self._sections = {}
+        self._lock = Lock()
+
+    def section(self, major, section):
+        """Roster handle for one section, created on first use"""
+        key = (major, section)
+        with self._lock:
+            roster = self._sections.get(key)
+            if roster is None:
+                roster = SectionRoster(
+                    self._reference,
+                    f"Majors/{major}/Sections/{section}/Students",
+                    self.ttl,
+                )
+                self._sections[key] = roster
+        return roster
+
+    def load(self, major, section):
+        """Fetch a section now (e.g. when an attendance session starts) and return its handle"""
+        roster = self.section(major, section)
+        roster.refresh()
+        if self.listen:
+            roster.listen()
+        return roster
+
+    def invalidate(self, major=None, section=None):
+        """Invalidate one section, or every cached section when called without arguments"""
+        with self._lock:
+            rosters = [
+                roster for (cached_major, cached_section), roster in self._sections.items()
+                if (major is None or cached_major == major) and
+                (section is None or cached_section == section)
+            ]
+        for roster in rosters:
+            roster.invalidate()
+
+    def close(self):
+        """Stop all database listeners"""
+        with self._lock:
+            rosters = list(self._sections.values())
+        for roster in rosters:
+            roster.close()
@@ -0,0 +1,191 @@
+"""
+Import section rosters from a registrar CSV export into the Realtime Database.
+
+The CSV is read one row at a time; a student may appear on several rows (one
+per course) or list several courses on one row. Majors, sections and courses
+come from the data. The import is a diff against the database: only students
+that were added, changed or removed are written, in batched multi-path
+updates, and the count and last_marked of existing enrollments are never
+touched. New enrollments start at a count of 0.
+
+    python backend/roster_import.py <csv file> [--apply] [--prune] [--course <course> ...]
+
+Students whose row names no course are enrolled in the --course courses;
+--course is required when the CSV has no course column. A new student with
+no course at all is not added but reported.
+
+Without --apply the changes are only reported. With --prune, students and
+enrollments of the imported sections that are missing from the CSV are
+removed; their lectures stay in the attendance log.
+"""
+import csv
+import re
+import sys
+from collections import namedtuple
+
+from metrics import FIREBASE_SECONDS, timed
+
+# Column names of the registration form the rosters were first collected with
+DEFAULT_COLUMNS = {
+    "name": "Full Name as mentioned in the University Documents",
+    "student_id": "Seat Number?",
+    "major": "Discipline?",
+    "section": "Section?",
+    "courses": "Courses?",
+}
+MAJOR_NAMES = {"Computer Science": "CS", "Software Engineering": "SE"}
+
+RosterChanges = namedtuple("RosterChanges", ["added", "changed", "removed", "skipped", "updates"])
+
+
+def extract_numbers(seat_number):
+    return re.sub(r'\D', '', seat_number)  # Remove all non-numeric characters
+
+
+def read_rosters(rows, columns=None, default_courses=()):
+    """
+    Rosters described by CSV rows.
+
+    :param rows: Iterable of dictionaries, e.g. a csv.DictReader.
+    :param columns: Overrides of DEFAULT_COLUMNS.
+    :param default_courses: Courses of students whose row names none (or when
+                            the CSV has no course column).
+    :return: Dictionary of (major, section) -> {student ID: (name, set of courses)}.
+    """
+    columns = {**DEFAULT_COLUMNS, **(columns or {})}
+    rosters = {}
+    for line, row in enumerate(rows, start=2):
+        student_id = extract_numbers(row.get(columns["student_id"]) or "")
+        if not student_id:
+            print(f"Skipping line {line}: no student ID")
+            continue
+        major = (row.get(columns["major"]) or "").strip()
+        major = MAJOR_NAMES.get(major, major)
+        section = (row.get(columns["section"]) or "").strip()
+        if not major or not section:
+            print(f"Skipping line {line}: student {student_id} has no major or section")
+            continue
+        courses = {
+            course.strip() for course in re.split(r"[;,]", row.get(columns["courses"]) or "") if course.strip()
+        } or set(default_courses)
+
+        name, enrolled = rosters.setdefault((major, section), {}).get(student_id, (None, set()))
+        name = (row.get(columns["name"]) or "").strip() or name
+        rosters[(major, section)][student_id] = (name, enrolled | courses)
+    return rosters
+
+
+def roster_changes(major, section, roster, current, prune=False):
+    """
+    Multi-path update, relative to the database root, bringing one section in
+    line with an imported roster.
+
+    Students without any course are skipped: a new one would be enrolled in
+    nothing (the database drops an empty Courses node), and the enrollments of
+    an existing one are left as they are.
+
+    :param roster: Imported students: student ID -> (name, set of courses).
+    :param current: Students node of the section in the database.
+    :param prune: Remove students and enrollments missing from the roster.
+    """
+    students = f"Majors/{major}/Sections/{section}/Students"
+    current = current or {}
+    added, changed, removed, skipped = [], [], [], []
+    updates = {}
+
+    for student_id, (name, courses) in roster.items():
+        existing = current.get(student_id)
+        if not courses:
+            skipped.append(student_id)
+            continue
+        if not isinstance(existing, dict):
+            added.append(student_id)
+            updates[f"{students}/{student_id}"] = {
+                "Name": name or student_id,
+                "Courses": {course: {"count": 0} for course in sorted(courses)},
+            }
+            continue
+
+        student_updates = {}
+        if name and existing.get("Name") != name:
+            student_updates[f"{students}/{student_id}/Name"] = name
+        enrolled = existing.get("Courses") or {}
+        for course in courses - set(enrolled):
+            student_updates[f"{students}/{student_id}/Courses/{course}/count"] = 0
+        if prune:
+            for course in set(enrolled) - courses:
+                student_updates[f"{students}/{student_id}/Courses/{course}"] = None
+        if student_updates:
+            changed.append(student_id)
+            updates.update(student_updates)
+
+    if prune:
+        for student_id in set(current) - set(roster):
+            removed.append(student_id)
+            updates[f"{students}/{student_id}"] = None
+
+    return RosterChanges(sorted(added), sorted(changed), sorted(removed), sorted(skipped), updates)
+
+
+def import_rosters(reference, rosters, apply=False, prune=False, batch_size=500):
+    """
+    Diff imported rosters against the database and write the differences.
+
+    Every section is read once; the updates of all sections are written in
+    multi-path updates of at most batch_size paths.
+
+    :param reference: Callable returning a database reference for a path (db.reference).
+    :param rosters: Dictionary of (major, section) -> roster, as from read_rosters.
+    :param apply: Write the changes; otherwise only compute them.
+    :return: Dictionary of (major, section) -> RosterChanges.
+    """
+    changes = {}
+    updates = {}
+    for (major, section), roster in sorted(rosters.items()):
+        with timed("roster_get", FIREBASE_SECONDS):
+            current = reference(f"Majors/{major}/Sections/{section}/Students").get()
+        changes[(major, section)] = roster_changes(major, section, roster, current, prune)
+        updates.update(changes[(major, section)].updates)
+
+    if apply and updates:
+        ref = reference("/")
+        paths = sorted(updates)
+        for start in range(0, len(paths), batch_size):
+            with timed("roster_update", FIREBASE_SECONDS):
+                ref.update({path: updates[path] for path in paths[start:start + batch_size]})
+    return changes
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python backend/roster_import.py <csv file> [--apply] [--prune] [--course <course> ...]")
+        sys.exit(1)
+
+    import firebase_admin
+    from firebase_admin import credentials, db
+
+    cred = credentials.Certificate("backend/serviceAccountKey.json")
+    firebase_admin.initialize_app(cred, {
+        'databaseURL': "https://attendance-system-realtime-default-rtdb.firebaseio.com/"
+    })
+
+    apply = "--apply" in sys.argv
+    default_courses = [sys.argv[i + 1] for i, arg in enumerate(sys.argv[:-1]) if arg == "--course"]
+    with open(sys.argv[1], mode='r', newline='', encoding='utf-8-sig') as file:
+        reader = csv.DictReader(file)
+        if DEFAULT_COLUMNS["courses"] not in (reader.fieldnames or []) and not default_courses:
+            print(f"The CSV has no {DEFAULT_COLUMNS['courses']!r} column; "
+                  "pass the courses of its students with --course <course>")
+            sys.exit(1)
+        rosters = read_rosters(reader, default_courses=default_courses)
+    changes = import_rosters(db.reference, rosters, apply=apply, prune="--prune" in sys.argv)
+
+    writes = 0
+    for (major, section), section_changes in changes.items():
+        writes += len(section_changes.updates)
+        print(f"{major}/{section}: {len(section_changes.added)} added, "
+              f"{len(section_changes.changed)} changed, {len(section_changes.removed)} removed")
+        if section_changes.skipped:
+            print(f"  No course for {len(section_changes.skipped)} students, not imported: "
+                  + ", ".join(section_changes.skipped))
+    print(f"{writes} paths " + ("written" if apply else "to write, run with --apply to write them"))
@@ -0,0 +1,189 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class SessionStore:
+    """
+    Attendance sessions of this process, keyed by session ID.
+
+    Sessions without activity for idle_timeout seconds are removed by sweep()
+    (periodically, once start_sweeper() was called) and handed to on_expire,
+    which is expected to end them the way a stop would. The store only guards
+    its own dictionary; work on one session is serialized with session.lock.
+    """
+
+    def __init__(self, idle_timeout=1800.0, on_expire=None, sweep_interval=60.0):
+        """
+        :param idle_timeout: Seconds without a frame after which a session is abandoned.
+        :param on_expire: Called with (session_id, session) for every expired session.
+        :param sweep_interval: Seconds between sweeps of the background sweeper.
+        """
+        self.idle_timeout = idle_timeout
+        self.on_expire = on_expire
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def add(self, session_id, session):
+        session.last_active = time.time()
+        with self._lock:
+            self._sessions[session_id] = session
+
+    def get(self, session_id):
+        """The session, or None; counts as activity on it"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_active = time.time()
+        return session
+
+    def sessions(self):
+        """The sessions held in this process"""
+        with self._lock:
+            return list(self._sessions.values())
+
+    def pop(self, session_id):
+        """Remove and return a session, or None when there is none"""
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def _idle(self, last_active_before):
+        with self._lock:
+            return [
+                session_id for session_id, session in self._sessions.items()
+                if session.last_active < last_active_before
+            ]
+
+    def sweep(self, now=None):
+        """Remove the sessions idle for longer than idle_timeout and pass them to on_expire"""
+        if now is None:
+            now = time.time()
+        expired = []
+        for session_id in self._idle(now - self.idle_timeout):
+            session = self.pop(session_id)
+            if session is not None:
+                expired.append(session_id)
+                if self.on_expire is not None:
+                    try:
+                        self.on_expire(session_id, session)
+                    except Exception as e:
+                        print(f"Error expiring session {session_id}: {e}")
+        return expired
+
+    def start_sweeper(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.sweep_interval):
+            try:
+                for session_id in self.sweep():
+                    print(f"Session {session_id} expired after {self.idle_timeout:.0f}s without frames")
+            except Exception as e:
+                print(f"Error sweeping sessions: {e}")
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class SharedSessionStore(SessionStore):
+    """
+    Session store for several worker processes sharing one attendance log.
+
+    The log is the source of truth for which sessions are active: a worker
+    that gets a frame for a session another worker started opens its own copy
+    (tracker, course gallery, roster) from the log, and drops its copy once
+    any worker stopped the session. Detections reach the other workers through
+    the log, and pop() returns the session with all of them. Activity is
+    written to the log at most every touch_interval seconds per session, and
+    idle sessions are found there, so a session busy on one worker does not
+    expire on another.
+    """
+
+    def __init__(self, log, open_session, idle_timeout=1800.0, on_expire=None,
+                 sweep_interval=60.0, touch_interval=30.0, stop_timeout=300.0):
+        """
+        :param log: The AttendanceLog shared by the workers.
+        :param open_session: Callable (major, section, course, started_at) -> AttendanceSession.
+        :param touch_interval: Seconds between activity writes to the log per session.
+        :param stop_timeout: Seconds after which a stop that never committed its
+                             counts (its worker died) is undone by the sweep.
+        """
+        super().__init__(idle_timeout, on_expire, sweep_interval)
+        self.log = log
+        self.open_session = open_session
+        self.touch_interval = touch_interval
+        self.stop_timeout = stop_timeout
+
+    def _open(self, logged):
+        """Local copy of a logged session, with the detections of all workers"""
+        session = self.open_session(
+            logged["major"], logged["section"], logged["course"], logged["started_at"]
+        )
+        self._merge(session, self.log.detections(logged["session_id"]))
+        return session
+
+    @staticmethod
+    def _merge(session, detections):
+        with session.lock:
+            for student_id, detection in detections.items():
+                session.detected_students.add(student_id)
+                if detection["decision"]:
+                    session.evidence.decisions.setdefault(student_id, detection["decision"])
+
+    def add(self, session_id, session):
+        super().add(session_id, session)
+        self.log.touch(session_id, session.last_active)
+
+    def get(self, session_id):
+        logged = self.log.session(session_id)
+        if logged is None:
+            # Never started, or stopped by some worker
+            super().pop(session_id)
+            return None
+
+        session = super().get(session_id)
+        if session is None:
+            session = self._open(logged)
+            with self._lock:
+                session = self._sessions.setdefault(session_id, session)
+            session.last_active = time.time()
+        if session.last_active - logged["last_active"] > self.touch_interval:
+            self.log.touch(session_id, session.last_active)
+        return session
+
+    def pop(self, session_id):
+        session = super().pop(session_id)
+        logged = self.log.session(session_id)
+        if logged is None:
+            return None
+        if session is None:
+            return self._open(logged)
+        self._merge(session, self.log.detections(session_id))
+        return session
+
+    def _idle(self, last_active_before):
+        return self.log.idle_sessions(last_active_before)
+
+    def sweep(self, now=None):
+        if now is None:
+            now = time.time()
+        for session_id in self.log.reopen_unfinished(datetime.now() - timedelta(seconds=self.stop_timeout)):
+            print(f"Reopened session {session_id}, its stop never completed")
+        # Local copies of sessions that other workers stopped
+        with self._lock:
+            local = list(self._sessions)
+        for session_id in local:
+            if self.log.session(session_id) is None:
+                super().pop(session_id)
+        return super().sweep(now)
@@ -0,0 +1,77 @@
+import threading
+import time
+
+
+class Startup:
+    """
+    Work the app does before it is ready to take frames (loading the gallery,
+    recovering sessions, warming up the models), run in order in a background
+    thread once start() is called, or in the caller with run().
+
+    The app is ready once every task finished. A required task that fails is
+    retried with exponential backoff (up to max_backoff seconds apart) and the
+    tasks after it wait for it; an optional one that fails is only reported.
+    """
+
+    def __init__(self, backoff=1.0, max_backoff=60.0):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._tasks = []
+        self._states = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, name, function, required=True):
+        self._tasks.append((name, function, required))
+        self._states[name] = {"state": "pending"}
+
+    def _set_state(self, name, **state):
+        with self._lock:
+            self._states[name] = state
+
+    def _run_task(self, name, function, required):
+        started = time.perf_counter()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                function()
+                break
+            except Exception as e:
+                if not required:
+                    elapsed = time.perf_counter() - started
+                    self._set_state(name, state="failed", error=str(e), seconds=round(elapsed, 3))
+                    print(f"Startup task {name} failed after {elapsed:.1f}s: {e}")
+                    return
+                delay = min(self.max_backoff, self.backoff * (2 ** (attempts - 1)))
+                self._set_state(name, state="retrying", error=str(e), attempts=attempts)
+                print(f"Startup task {name} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+                time.sleep(delay)
+        elapsed = time.perf_counter() - started
+        self._set_state(name, state="done", seconds=round(elapsed, 3), attempts=attempts)
+        print(f"Startup task {name} done in {elapsed:.1f}s")
+
+    def run(self):
+        for name, function, required in self._tasks:
+            self._set_state(name, state="running")
+            self._run_task(name, function, required)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="startup", daemon=True)
+            self._thread.start()
+
+    @property
+    def ready(self):
+        # Every task finished, and every required one succeeded
+        with self._lock:
+            return all(
+                self._states[name]["state"] in (("done",) if required else ("done", "failed"))
+                for name, _, required in self._tasks
+            )
+
+    def status(self):
+        """Readiness and the state of every task, for /readyz"""
+        with self._lock:
+            tasks = {name: dict(state) for name, state in self._states.items()}
+        return {"ready": self.ready, "tasks": tasks}
@@ -0,0 +1,193 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from attendance_log import STOP_GRACE, AttendanceFlusher, AttendanceLog
+from fake_database import FakeDatabase
+
+STARTED_AT = datetime(2026, 3, 2, 9, 0, 0)
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "attendance_log.db")
+
+
+@pytest.fixture
+def log(log_path):
+    log = AttendanceLog(log_path)
+    yield log
+    log.close()
+
+
+def open_session(log, session_id="s1", students=("1", "2")):
+    log.open_session(session_id, "CS", "A", "C1", STARTED_AT)
+    for minute, student_id in enumerate(students):
+        log.record(session_id, student_id, STARTED_AT + timedelta(minutes=minute), {"sightings": 3})
+
+
+def test_active_sessions_survive_a_restart(log_path):
+    log = AttendanceLog(log_path)
+    open_session(log)
+    log.record("s1", "1", STARTED_AT + timedelta(hours=1))  # Logged once per session
+    log.close()
+
+    log = AttendanceLog(log_path)
+    [session] = log.active_sessions()
+    log.close()
+    assert session["session_id"] == "s1"
+    assert (session["major"], session["section"], session["course"]) == ("CS", "A", "C1")
+    assert session["started_at"] == STARTED_AT
+    assert session["detections"] == {
+        "1": {"detected_at": STARTED_AT, "decision": {"sightings": 3}},
+        "2": {"detected_at": STARTED_AT + timedelta(minutes=1), "decision": {"sightings": 3}},
+    }
+
+
+def test_session_is_stopped_once(log):
+    open_session(log)
+    assert log.stop_session("s1", STARTED_AT + timedelta(hours=1))
+    assert not log.stop_session("s1", STARTED_AT + timedelta(hours=2))
+    assert not log.stop_session("unknown", STARTED_AT)
+    assert log.session("s1") is None
+    assert log.active_sessions() == []
+
+
+def test_flush_mirrors_active_sessions(log):
+    database = FakeDatabase()
+    flusher = AttendanceFlusher(log, database.reference)
+    open_session(log)
+    assert flusher.flush() == 2
+    assert flusher.flush() == 0
+    assert database.reference("LiveSessions/s1/detected").get() == {
+        "1": STARTED_AT.isoformat(), "2": (STARTED_AT + timedelta(minutes=1)).isoformat(),
+    }
+
+    log.stop_session("s1", STARTED_AT + timedelta(hours=1))
+    log.mark_committed("s1")
+    flusher.flush()
+    assert database.reference("LiveSessions/s1").get() is None
+    assert log.pending() == ([], [])
+
+
+def test_failed_flush_is_pushed_again(log):
+    database = FakeDatabase()
+    flusher = AttendanceFlusher(log, database.reference)
+    open_session(log)
+    database.update_error = lambda updates: ConnectionError("offline")
+    with pytest.raises(ConnectionError):
+        flusher.flush()
+    assert len(log.pending()[0]) == 2
+
+    database.update_error = None
+    assert flusher.flush() == 2
+    assert set(database.reference("LiveSessions/s1/detected").get()) == {"1", "2"}
+
+
+def test_reopen_unfinished_only_reopens_uncommitted_stops(log):
+    stopped_at = STARTED_AT + timedelta(hours=1)
+    for session_id in ("crashed", "committed", "failed"):
+        open_session(log, session_id)
+        log.stop_session(session_id, stopped_at)
+    log.mark_committed("committed")
+    log.mark_commit_failed("failed", time.time() + 30)
+
+    assert log.reopen_unfinished(stopped_at) == []
+    assert log.reopen_unfinished(stopped_at + timedelta(seconds=1)) == ["crashed"]
+    assert [session["session_id"] for session in log.active_sessions()] == ["crashed"]
+    assert set(log.active_sessions()[0]["detections"]) == {"1", "2"}
+
+
+def test_failed_commits_are_claimed_when_due(log):
+    open_session(log)
+    log.stop_session("s1", STARTED_AT + timedelta(hours=1))
+    log.mark_commit_failed("s1", 100.0)
+
+    assert log.claim_failed_commits(99.0, claim_timeout=60.0) == []
+    [session] = log.claim_failed_commits(100.0, claim_timeout=60.0)
+    assert session["stopped_at"] == STARTED_AT + timedelta(hours=1)
+    assert set(session["detections"]) == {"1", "2"}
+    # Claimed: not handed out again until the claim times out
+    assert log.claim_failed_commits(150.0, claim_timeout=60.0) == []
+    assert len(log.claim_failed_commits(160.0, claim_timeout=60.0)) == 1
+
+
+def test_failed_commit_is_retried_until_it_succeeds(log):
+    database = FakeDatabase()
+    flusher = AttendanceFlusher(log, database.reference, commit_retry_interval=30.0)
+    open_session(log)
+    stopped_at = STARTED_AT + timedelta(hours=1)
+    log.stop_session("s1", stopped_at)
+    log.mark_commit_failed("s1", 100.0)
+
+    database.read_error = ConnectionError("offline")
+    assert flusher.retry_commits(now=100.0) == []
+    # Still in the log, due again after commit_retry_interval
+    assert log.pending() == ([], [])
+    assert flusher.retry_commits(now=100.0) == []
+
+    database.read_error = None
+    assert flusher.retry_commits(now=time.time() + 30.0) == ["s1"]
+    assert database.reference("Attendance/CS/A/C1/20260302T090000").get() == {
+        "1": stopped_at.isoformat(), "2": stopped_at.isoformat(),
+    }
+    assert database.reference("Majors/CS/Sections/A/Students/1/Courses/C1/count").get() == 1
+    assert flusher.retry_commits(now=time.time() + 3600.0) == []
+
+    flusher.flush()
+    assert log.pending() == ([], [])
+    assert log.claim_failed_commits(time.time() + 3600.0, 60.0) == []
+
+
+def test_new_session_keeps_a_failed_commit(log):
+    database = FakeDatabase()
+    flusher = AttendanceFlusher(log, database.reference)
+    open_session(log)
+    log.stop_session("s1", STARTED_AT + timedelta(hours=1))
+    log.mark_commit_failed("s1", 100.0)
+
+    # The next lecture starts while the commit still fails
+    next_lecture = STARTED_AT + timedelta(days=7)
+    log.open_session("s1", "CS", "A", "C1", next_lecture)
+    log.record("s1", "3", next_lecture)
+    assert set(log.detections("s1")) == {"3"}
+    assert log.session("s1")["started_at"] == next_lecture
+
+    [moved] = log.claim_failed_commits(100.0, claim_timeout=60.0)
+    assert moved["session_id"] == "s1@20260302T090000"
+    assert set(moved["detections"]) == {"1", "2"}
+
+    # A late mark of the stopped session does not touch the new one
+    log.mark_committed("s1")
+    log.mark_commit_failed("s1", 0.0)
+    assert log.claim_failed_commits(160.0, claim_timeout=60.0)[0]["session_id"] == "s1@20260302T090000"
+
+    assert flusher.retry_commits(now=time.time() + 3600.0) == ["s1@20260302T090000"]
+    assert set(database.reference("Attendance/CS/A/C1/20260302T090000").get()) == {"1", "2"}
+    assert log.session("s1", with_detections=True)["detections"].keys() == {"3"}
+
+
+def test_new_session_moves_a_stop_still_committing(log):
+    open_session(log)
+    log.stop_session("s1", STARTED_AT + timedelta(hours=1))
+    # The stop's commit has not finished when the next session starts
+    before = time.time()
+    log.open_session("s1", "CS", "A", "C1", STARTED_AT + timedelta(days=7))
+    log.mark_committed("s1")
+
+    # Not reopened as a crashed stop; committed by the flusher after the grace period
+    assert log.reopen_unfinished(datetime.now() + timedelta(days=30)) == []
+    assert log.claim_failed_commits(before, claim_timeout=60.0) == []
+    [moved] = log.claim_failed_commits(time.time() + STOP_GRACE, claim_timeout=60.0)
+    assert set(moved["detections"]) == {"1", "2"}
+    assert log.session("s1")["started_at"] == STARTED_AT + timedelta(days=7)
+
+
+def test_new_session_replaces_a_committed_one(log):
+    open_session(log)
+    log.stop_session("s1", STARTED_AT + timedelta(hours=1))
+    log.mark_committed("s1")
+    log.open_session("s1", "CS", "A", "C1", STARTED_AT + timedelta(days=7))
+    assert log.detections("s1") == {}
+    assert log.claim_failed_commits(time.time() + 3600.0, claim_timeout=60.0) == []
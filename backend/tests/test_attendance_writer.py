@@ -0,0 +1,107 @@
+from datetime import datetime
+
+import pytest
+
+from attendance_writer import commit_attendance, marked_on, recount_attendance
+from fake_database import FakeDatabase
+
+STARTED_AT = datetime(2026, 3, 2, 9, 0, 0)
+MARKED_AT = datetime(2026, 3, 2, 10, 30, 0)
+LECTURE = "Attendance/CS/A/C1/20260302T090000"
+
+
+@pytest.fixture
+def database():
+    students = {
+        student_id: {"Name": f"Student {student_id}", "Courses": {"C1": {"count": 2}}}
+        for student_id in ("1", "2", "3")
+    }
+    return FakeDatabase({"Majors": {"CS": {"Sections": {"A": {"Students": students}}}}})
+
+
+def commit(database, student_ids, **options):
+    options.setdefault("backoff", 0)
+    return commit_attendance(
+        database.reference, "CS", "A", "C1", student_ids, MARKED_AT, started_at=STARTED_AT, **options
+    )
+
+
+def count(database, student_id):
+    return database.reference(f"Majors/CS/Sections/A/Students/{student_id}/Courses/C1/count").get()
+
+
+def test_commit_marks_every_student(database):
+    assert commit(database, ["1", "2"]) == {"1": None, "2": None}
+    assert database.reference(LECTURE).get() == {"1": MARKED_AT.isoformat(), "2": MARKED_AT.isoformat()}
+    assert set(database.reference("AttendanceByDay/2026-03-02/CS/A/C1").get()) == {"1", "2"}
+    assert [count(database, student_id) for student_id in ("1", "2", "3")] == [3, 3, 2]
+    assert database.reference("Majors/CS/Sections/A/Students/1/Courses/C1/last_marked").get() == MARKED_AT.isoformat()
+
+
+def test_commit_in_batches(database):
+    assert commit(database, ["1", "2", "3"], batch_size=2) == {"1": None, "2": None, "3": None}
+    assert database.writes == 2
+
+
+def test_committing_again_counts_once(database):
+    commit(database, ["1", "2"])
+    writes = database.writes
+    assert commit(database, ["1", "2", "3"]) == {"1": None, "2": None, "3": None}
+    assert [count(database, student_id) for student_id in ("1", "2", "3")] == [3, 3, 3]
+    # Only the new student is written
+    assert database.writes == writes + 1
+
+
+def test_retry_after_an_applied_failure_counts_once(database):
+    failures = [RuntimeError("connection reset")]
+    database.update_error = lambda updates: failures.pop() if failures else None
+    database.apply_failed_updates = True
+    assert commit(database, ["1", "2"]) == {"1": None, "2": None}
+    assert [count(database, student_id) for student_id in ("1", "2")] == [3, 3]
+    assert database.writes == 1
+
+
+def test_transient_failure_is_retried(database):
+    failures = [RuntimeError("timeout"), RuntimeError("timeout")]
+    database.update_error = lambda updates: failures.pop() if failures else None
+    assert commit(database, ["1", "2"]) == {"1": None, "2": None}
+    assert [count(database, student_id) for student_id in ("1", "2")] == [3, 3]
+
+
+def test_failure_is_attributed_to_its_student(database):
+    database.update_error = lambda updates: (
+        PermissionError("denied") if any("/Students/2/" in path for path in updates) else None
+    )
+    results = commit(database, ["1", "2", "3"], retries=1)
+    assert results["1"] is None and results["3"] is None
+    assert "denied" in results["2"]
+    assert [count(database, student_id) for student_id in ("1", "2", "3")] == [3, 2, 3]
+    assert set(database.reference(LECTURE).get()) == {"1", "3"}
+
+
+def test_unreadable_lecture_log_writes_nothing(database):
+    database.read_error = ConnectionError("offline")
+    results = commit(database, ["1", "2"])
+    assert set(results) == {"1", "2"}
+    assert all("offline" in error for error in results.values())
+    assert database.writes == 0
+
+
+def test_recount_restores_counts_from_the_log(database):
+    commit(database, ["1", "2"])
+    differences = recount_attendance(database.reference, "CS", "A", "C1")
+    assert differences == {"1": (3, 1), "2": (3, 1), "3": (2, 0)}
+    recount_attendance(database.reference, "CS", "A", "C1", apply=True)
+    assert [count(database, student_id) for student_id in ("1", "2", "3")] == [1, 1, 0]
+    assert recount_attendance(database.reference, "CS", "A", "C1") == {}
+
+
+def test_lectures_of_one_day_are_logged_apart(database):
+    commit(database, ["1", "2"])
+    later = datetime(2026, 3, 2, 14, 0, 0)
+    commit_attendance(database.reference, "CS", "A", "C1", ["1"], later, started_at=later, backoff=0)
+    assert set(database.reference("Attendance/CS/A/C1").get()) == {"20260302T090000", "20260302T140000"}
+    assert count(database, "1") == 4
+    assert marked_on(database.reference, "CS", "A", "C1", later) == {
+        "1": later.isoformat(), "2": MARKED_AT.isoformat(),
+    }
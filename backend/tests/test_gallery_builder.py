@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import gallery_builder
+from gallery import load_gallery
+from gallery_builder import build_gallery, student_id_for
+
+
+def fake_encode_image(path):
+    """Stand-in for _encode_image: a file holds "none", "many" or the value of its encoding"""
+    with open(path) as file:
+        content = file.read()
+    if content == "none":
+        return None, "no_face"
+    if content == "many":
+        return None, "multiple_faces"
+    return np.full(128, float(content), dtype=np.float32), None
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    """Files passed to the encoder"""
+    calls = []
+
+    def encode(path):
+        calls.append(os.path.basename(path))
+        return fake_encode_image(path)
+
+    monkeypatch.setattr(gallery_builder, "_encode_image", encode)
+    # Threads see the stub; worker processes might not
+    monkeypatch.setattr(gallery_builder, "ProcessPoolExecutor", ThreadPoolExecutor)
+    return calls
+
+
+def write_images(folder, images):
+    for filename, content in images.items():
+        with open(os.path.join(folder, filename), "w") as file:
+            file.write(content)
+
+
+def assert_aligned(gallery_path, folder):
+    """Every row's ID is the student of the image it was encoded from"""
+    gallery = load_gallery(gallery_path)
+    sources = [source["file"] for source in gallery.metadata["sources"]]
+    assert len(sources) == len(gallery.student_ids) == len(gallery.encodings)
+    for filename, student_id, encoding in zip(sources, gallery.student_ids, gallery.encodings):
+        assert student_id == student_id_for(filename)
+        with open(os.path.join(folder, filename)) as file:
+            assert np.all(np.asarray(encoding) == float(file.read()))
+    return gallery
+
+
+def test_rows_line_up_with_students(tmp_path, encoded):
+    folder, gallery_path = tmp_path / "images", str(tmp_path / "Encode.gallery")
+    folder.mkdir()
+    write_images(folder, {
+        "100.jpg": "1", "100_2.jpg": "2", "101.jpg": "none", "102.jpg": "many",
+        "103.jpg": "3", "104_side.png": "4", "notes.txt": "5",
+    })
+
+    summary = build_gallery(str(folder), gallery_path)
+    gallery = assert_aligned(gallery_path, str(folder))
+    assert gallery.student_ids == ["100", "100", "103", "104"]
+    assert summary["rejected"] == ["101.jpg", "102.jpg"]
+    assert gallery.metadata["rejected"]["101.jpg"]["reason"] == "no_face"
+    assert gallery.metadata["rejected"]["102.jpg"]["reason"] == "multiple_faces"
+    assert (summary["count"], summary["students"]) == (4, 3)
+    assert sorted(summary["encoded"]) == ["100.jpg", "100_2.jpg", "103.jpg", "104_side.png"]
+
+
+def test_rebuild_keeps_rows_aligned(tmp_path, encoded):
+    folder, gallery_path = tmp_path / "images", str(tmp_path / "Encode.gallery")
+    folder.mkdir()
+    write_images(folder, {"100.jpg": "1", "101.jpg": "none", "102.jpg": "2", "103.jpg": "3"})
+    build_gallery(str(folder), gallery_path)
+
+    # A rejected photo before, a removed one and a new one, which used to shift the IDs
+    os.remove(folder / "102.jpg")
+    write_images(folder, {"099.jpg": "9", "103.jpg": "many", "104.jpg": "4"})
+    del encoded[:]
+    summary = build_gallery(str(folder), gallery_path)
+
+    gallery = assert_aligned(gallery_path, str(folder))
+    assert gallery.student_ids == ["099", "100", "104"]
+    assert sorted(encoded) == ["099.jpg", "103.jpg", "104.jpg"]
+    assert summary["reused"] == ["100.jpg"]
+    assert summary["rejected"] == ["101.jpg", "103.jpg"]
+
+
+def test_rejected_images_are_quarantined(tmp_path, encoded):
+    folder, gallery_path = tmp_path / "images", str(tmp_path / "Encode.gallery")
+    quarantine = tmp_path / "quarantine"
+    folder.mkdir()
+    write_images(folder, {"100.jpg": "1", "101.jpg": "none", "102.jpg": "many", "103.jpg": "3"})
+
+    summary = build_gallery(str(folder), gallery_path, quarantine_folder=str(quarantine))
+    gallery = assert_aligned(gallery_path, str(folder))
+    assert gallery.student_ids == ["100", "103"]
+    assert summary["quarantined"] == ["101.jpg", "102.jpg"]
+    assert summary["rejected"] == []
+    assert sorted(os.listdir(quarantine)) == ["101.jpg", "102.jpg"]
+    assert sorted(os.listdir(folder)) == ["100.jpg", "103.jpg"]
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from gallery_index import IVFMatcher, create_matcher, synthetic_gallery
+from matcher import GalleryMatcher
+from tests.test_matcher import assert_matches, naive_match
+
+
+@pytest.fixture
+def gallery():
+    centres, encodings, student_ids = synthetic_gallery(50, photos_per_student=3, seed=3)
+    rng = np.random.default_rng(4)
+    queries = np.concatenate([
+        centres[:20] + rng.normal(0.0, 0.02, size=(20, centres.shape[1])),
+        rng.normal(0.0, 0.3, size=(5, centres.shape[1])),  # Nobody in the gallery
+    ]).astype(np.float32)
+    return encodings, student_ids, queries
+
+
+def test_add_and_remove_match_naive(gallery):
+    encodings, student_ids, queries = gallery
+    matcher = GalleryMatcher(encodings[:60], student_ids[:60])
+    matcher.add(encodings[60:], student_ids[60:])
+    assert_matches(matcher.match(queries), naive_match(queries, encodings, student_ids))
+
+    removed = {"0", "1", "2"}
+    matcher.remove(removed)
+    keep = [index for index, student_id in enumerate(student_ids) if student_id not in removed]
+    assert_matches(matcher.match(queries), naive_match(queries, encodings[keep], [student_ids[i] for i in keep]))
+
+
+def test_ivf_add_and_remove_match_naive(gallery):
+    encodings, student_ids, queries = gallery
+    index = IVFMatcher(encodings[:60], student_ids[:60], nlist=8, nprobe=8, exact_below=0)
+    index.add(encodings[60:], student_ids[60:])
+    index.remove({"0", "1", "2"})
+    keep = [row for row, student_id in enumerate(student_ids) if student_id not in {"0", "1", "2"}]
+    assert_matches(index.match(queries), naive_match(queries, encodings[keep], [student_ids[i] for i in keep]))
+
+
+def test_ivf_searching_every_cluster_matches_naive(gallery):
+    encodings, student_ids, queries = gallery
+    index = create_matcher(encodings, student_ids, "ivf", nlist=8, nprobe=8, exact_below=0)
+    assert_matches(index.match(queries), naive_match(queries, encodings, student_ids))
+
+
+def test_ivf_finds_the_nearest_student(gallery):
+    encodings, student_ids, queries = gallery
+    index = create_matcher(encodings, student_ids, "ivf", nlist=16, nprobe=4, exact_below=0)
+    expected = naive_match(queries[:20], encodings, student_ids)
+    found = index.match(queries[:20])
+    assert [match.student_id for match in found] == [student_id for student_id, *_ in expected]
+    for match, (_, distance, _, _) in zip(found, expected):
+        assert match.distance == pytest.approx(distance, abs=1e-4)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_matcher([], [], "annoy")
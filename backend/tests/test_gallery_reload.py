@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from gallery import save_gallery
+from gallery_reload import GalleryNotLoaded, GalleryReloader
+from matcher import GalleryMatcher
+
+
+def build_index(gallery):
+    return GalleryMatcher(gallery.encodings, gallery.student_ids)
+
+
+def save(path, students):
+    save_gallery(path, np.ones((len(students), 128), dtype=np.float32), students)
+
+
+def test_reload_swaps_in_a_changed_file(tmp_path):
+    path = str(tmp_path / "Encode.gallery")
+    save(path, ["1"])
+    swaps = []
+    reloader = GalleryReloader(path, build_index, interval=0, on_swap=lambda *versions: swaps.append(versions))
+    assert not reloader.reload()
+
+    save(path, ["1", "2"])
+    previous = reloader.current
+    assert reloader.reload()
+    assert reloader.current.gallery.student_ids == ["1", "2"]
+    assert swaps == [(previous, reloader.current)]
+
+
+def test_failed_prepare_is_retried_at_the_next_check(tmp_path):
+    path = str(tmp_path / "Encode.gallery")
+    save(path, ["1"])
+    failures = [RuntimeError("workers did not start")]
+
+    def prepare(previous, new):
+        if failures:
+            raise failures.pop()
+
+    reloader = GalleryReloader(path, build_index, interval=0, prepare=prepare)
+    first = reloader.current
+    save(path, ["1", "2"])
+    with pytest.raises(RuntimeError):
+        reloader.reload()
+    assert reloader.current is first
+    assert reloader.last_error == "workers did not start"
+
+    # The file did not change since, but it is not the version in use
+    assert reloader.reload()
+    assert reloader.current.gallery.student_ids == ["1", "2"]
+    assert reloader.last_error is None
+
+
+def test_not_loaded_until_the_first_reload(tmp_path):
+    path = str(tmp_path / "Encode.gallery")
+    reloader = GalleryReloader(path, build_index, interval=0, load=False)
+    with pytest.raises(GalleryNotLoaded):
+        reloader.current
+    with pytest.raises(FileNotFoundError):
+        reloader.reload()
+    save(path, ["1"])
+    assert reloader.reload()
+    assert reloader.loaded
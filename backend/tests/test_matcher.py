@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from matcher import GalleryMatcher
+
+
+def naive_distances(queries, encodings):
+    return np.linalg.norm(queries[:, None, :] - encodings[None, :, :], axis=2)
+
+
+def naive_match(queries, encodings, student_ids, tolerance=0.6):
+    """(student ID, distance, margin, is_match) per query, by brute force"""
+    results = []
+    for row in naive_distances(queries, encodings):
+        best = int(np.argmin(row))
+        others = [d for d, student_id in zip(row, student_ids) if student_id != student_ids[best]]
+        margin = min(others) - row[best] if others else float("inf")
+        results.append((student_ids[best], row[best], margin, row[best] <= tolerance))
+    return results
+
+
+@pytest.fixture
+def gallery():
+    """50 students with 3 photos each, 20 faces of them and 5 of nobody in the gallery"""
+    rng = np.random.default_rng(3)
+    centres = rng.normal(0.0, 0.09, size=(50, 128))
+    encodings = (np.repeat(centres, 3, axis=0) + rng.normal(0.0, 0.02, size=(150, 128))).astype(np.float32)
+    student_ids = [str(i) for i in range(50) for _ in range(3)]
+    queries = np.concatenate([
+        centres[:20] + rng.normal(0.0, 0.02, size=(20, 128)),
+        rng.normal(0.0, 0.3, size=(5, 128)),
+    ]).astype(np.float32)
+    return encodings, student_ids, queries
+
+
+def assert_matches(matches, expected):
+    assert len(matches) == len(expected)
+    for match, (student_id, distance, margin, is_match) in zip(matches, expected):
+        assert match.student_id == student_id
+        assert match.distance == pytest.approx(distance, abs=1e-4)
+        assert match.margin == pytest.approx(margin, abs=1e-4)
+        assert match.is_match == is_match
+
+
+def test_distances_match_naive(gallery):
+    encodings, student_ids, queries = gallery
+    matcher = GalleryMatcher(encodings, student_ids)
+    np.testing.assert_allclose(matcher.distances(queries), naive_distances(queries, encodings), atol=1e-4)
+
+
+def test_match_matches_naive(gallery):
+    encodings, student_ids, queries = gallery
+    matches = GalleryMatcher(encodings, student_ids).match(queries)
+    assert_matches(matches, naive_match(queries, encodings, student_ids))
+    assert all(match.is_match for match in matches[:20])
+    assert not any(match.is_match for match in matches[20:])
+
+
+def test_empty_gallery_matches_nobody(gallery):
+    _, _, queries = gallery
+    matches = GalleryMatcher([], []).match(queries[:2])
+    assert [match.student_id for match in matches] == [None, None]
+    assert not any(match.is_match for match in matches)
+    assert GalleryMatcher([], []).match([]) == []
+
+
+def test_subset_only_matches_its_students(gallery):
+    encodings, student_ids, queries = gallery
+    enrolled = [str(i) for i in range(10, 30)]
+    rows = [index for index, student_id in enumerate(student_ids) if student_id in enrolled]
+    matches = GalleryMatcher(encodings, student_ids).subset(enrolled).match(queries)
+    assert_matches(matches, naive_match(queries, encodings[rows], [student_ids[i] for i in rows]))
+
+
+def test_subset_of_nobody_enrolled(gallery):
+    encodings, student_ids, queries = gallery
+    matches = GalleryMatcher(encodings, student_ids).subset(["unknown"]).match(queries[:1])
+    assert matches[0].student_id is None
@@ -0,0 +1,137 @@
+import pytest
+
+import roster
+from fake_database import FakeDatabase, FakeEvent
+from roster import RosterCache
+
+STUDENTS = "Majors/CS/Sections/A/Students"
+
+
+@pytest.fixture
+def database():
+    return FakeDatabase({"Majors": {"CS": {"Sections": {
+        "A": {"Students": {
+            "1": {"Name": "One", "Courses": {"C1": {"count": 0}}},
+            "2": {"Name": "Two", "Courses": {"C1": {"count": 0}, "C2": {"count": 0}}},
+            "3": {"Name": "Three", "Courses": {"C2": {"count": 0}}},
+        }},
+        "B": {"Students": {"4": {"Name": "Four", "Courses": {"C1": {"count": 0}}}}},
+    }}}})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(roster.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_section_is_read_once_within_the_ttl(database, clock):
+    cache = RosterCache(database.reference, ttl=300)
+    section = cache.load("CS", "A")
+    assert database.reads == 1
+    for _ in range(5):
+        assert set(section.get()) == {"1", "2", "3"}
+        assert set(section.enrolled("C1")) == {"1", "2"}
+    assert database.reads == 1
+    assert cache.section("CS", "A") is section
+
+
+def test_section_is_read_again_after_the_ttl(database, clock):
+    section = RosterCache(database.reference, ttl=300).load("CS", "A")
+    database.reference(f"{STUDENTS}/4").set({"Name": "Four", "Courses": {"C1": {"count": 0}}})
+    clock[0] += 299
+    assert "4" not in section.enrolled("C1")
+    clock[0] += 1
+    assert set(section.enrolled("C1")) == {"1", "2", "4"}
+    assert database.reads == 2
+
+
+def test_roster_without_ttl_never_expires(database, clock):
+    section = RosterCache(database.reference, ttl=None).load("CS", "A")
+    clock[0] += 10 ** 6
+    section.get()
+    assert database.reads == 1
+
+
+def test_invalidate(database, clock):
+    cache = RosterCache(database.reference)
+    section_a, section_b = cache.load("CS", "A"), cache.load("CS", "B")
+    database.reference(f"{STUDENTS}/1/Courses/C2").set({"count": 0})
+
+    cache.invalidate("CS", "B")
+    section_b.get()
+    assert database.reads == 3
+    assert "1" not in section_a.enrolled("C2")
+
+    cache.invalidate("CS", "A")
+    assert set(section_a.enrolled("C2")) == {"1", "2", "3"}
+    assert database.reads == 4
+
+    cache.invalidate()
+    section_a.get()
+    section_b.get()
+    assert database.reads == 6
+
+
+def test_missing_section_is_empty(database):
+    section = RosterCache(database.reference).load("SE", "Z")
+    assert section.get() == {}
+    assert section.enrolled("C1") == {}
+
+
+def test_listening_section_follows_writes_without_reads(database, clock):
+    cache = RosterCache(database.reference, ttl=300, listen=True)
+    section = cache.load("CS", "A")
+    assert set(section.enrolled("C2")) == {"2", "3"}
+
+    database.reference("/").update({
+        f"{STUDENTS}/1/Courses/C2": {"count": 0},
+        f"{STUDENTS}/3": None,
+        "Majors/CS/Sections/B/Students/4/Name": "Vier",
+    })
+    assert set(section.enrolled("C2")) == {"1", "2"}
+    database.reference(f"{STUDENTS}/5").set({"Name": "Five", "Courses": {"C2": {"count": 0}}})
+    assert set(section.enrolled("C2")) == {"1", "2", "5"}
+    # Listening sections do not expire
+    clock[0] += 10 ** 6
+    section.get()
+    assert database.reads == 1
+
+    # Once closed, the TTL applies again
+    cache.close()
+    assert database.listeners == []
+    database.reference(f"{STUDENTS}/5").delete()
+    assert "5" not in section.get()
+    assert database.reads == 2
+
+
+def test_put_events(database):
+    section = RosterCache(database.reference).load("CS", "A")
+    section.enrolled("C1")
+    section._on_event(FakeEvent("put", "/2/Courses/C1", None))
+    assert set(section.enrolled("C1")) == {"1"}
+    section._on_event(FakeEvent("put", "/6", {"Name": "Six", "Courses": {"C1": {"count": 0}}}))
+    assert set(section.enrolled("C1")) == {"1", "6"}
+    section._on_event(FakeEvent("put", "/", {"7": {"Name": "Seven", "Courses": {"C1": {}}}}))
+    assert set(section.get()) == {"7"}
+    section._on_event(FakeEvent("put", "/", None))
+    assert section.get() == {}
+
+
+def test_patch_events(database):
+    section = RosterCache(database.reference).load("CS", "A")
+    section.enrolled("C2")
+    section._on_event(FakeEvent("patch", "/1/Courses", {"C2": {"count": 0}, "C1": None}))
+    assert set(section.get()["1"]["Courses"]) == {"C2"}
+    assert set(section.enrolled("C2")) == {"1", "2", "3"}
+    section._on_event(FakeEvent("patch", "/", {"8": {"Name": "Eight", "Courses": {"C2": {}}}}))
+    assert set(section.enrolled("C2")) == {"1", "2", "3", "8"}
+    assert section.get()["2"]["Name"] == "Two"
+
+
+def test_events_before_the_first_read_are_ignored(database):
+    section = RosterCache(database.reference).section("CS", "A")
+    section._on_event(FakeEvent("patch", "/1/Courses", {"C9": {"count": 0}}))
+    assert database.reads == 0
+    assert set(section.get()["1"]["Courses"]) == {"C1"}
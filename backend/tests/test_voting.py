@@ -0,0 +1,65 @@
+from voting import EvidenceAccumulator
+
+
+def test_commits_after_min_sightings():
+    votes = EvidenceAccumulator(tolerance=0.6, min_sightings=3, min_score=1.2)
+    # Weak matches: 0.25 confidence each, so only the number of sightings can commit
+    assert votes.observe("1", 0.45, track_id=1, now=1.0) is None
+    assert votes.observe("1", 0.45, track_id=1, now=2.0) is None
+    decision = votes.observe("1", 0.45, track_id=1, now=3.0)
+    assert decision["sightings"] == 3
+    assert decision["committed_at"] == 3.0
+    assert decision["score"] == 0.75
+    assert votes.is_committed("1")
+
+
+def test_commits_early_on_min_score():
+    votes = EvidenceAccumulator(tolerance=0.6, min_sightings=3, min_score=1.2)
+    # 0.1 is 5/6 confidence: one sighting is below min_score, two are above
+    assert votes.observe("1", 0.1, track_id=1, now=1.0) is None
+    decision = votes.observe("1", 0.1, track_id=1, now=2.0)
+    assert decision["sightings"] == 2
+    assert decision["score"] > 1.2
+    assert decision["best_distance"] == 0.1
+
+
+def test_score_below_min_score_does_not_commit():
+    votes = EvidenceAccumulator(tolerance=0.6, min_sightings=5, min_score=1.2)
+    # 0.25 is 0.58 confidence: two sightings stay just below min_score
+    assert votes.observe("1", 0.25, track_id=1) is None
+    assert votes.observe("1", 0.25, track_id=1) is None
+    assert not votes.is_committed("1")
+    decision = votes.observe("1", 0.55, track_id=2)
+    assert decision["sightings"] == 3
+    assert decision["score"] >= 1.2
+
+
+def test_sightings_at_the_tolerance_add_no_score():
+    votes = EvidenceAccumulator(tolerance=0.6, min_sightings=3, min_score=0.5)
+    assert votes.observe("1", 0.6, track_id=1) is None
+    assert votes.observe("1", 0.6, track_id=1) is None
+    assert votes.observe("1", 0.6, track_id=1)["score"] == 0.0
+
+
+def test_flickering_track_does_not_vote():
+    votes = EvidenceAccumulator(tolerance=0.6, min_sightings=3, min_score=10.0)
+    # Track 1 is mostly student 2, so its sightings of student 1 are not consistent
+    for now in range(4):
+        votes.observe("2", 0.5, track_id=1, now=now)
+    for now in range(3):
+        assert votes.observe("1", 0.5, track_id=1, now=10 + now) is None
+    assert not votes.is_committed("1")
+    assert votes.is_committed("2")
+
+    # Sightings on a track of its own count
+    for now in range(2):
+        assert votes.observe("1", 0.5, track_id=2, now=20 + now) is None
+    decision = votes.observe("1", 0.5, track_id=2, now=22)
+    assert decision["tracks"] == [2]
+
+
+def test_committed_student_is_not_committed_again():
+    votes = EvidenceAccumulator(min_sightings=1)
+    assert votes.observe("1", 0.3, track_id=1) is not None
+    assert votes.observe("1", 0.2, track_id=1) is None
+    assert list(votes.decisions) == ["1"]
@@ -0,0 +1,149 @@
+import time
+from itertools import count
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    intersection = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def _centroid_distance(a, b):
+    """Distance between box centres, relative to the size of box a"""
+    dy = (a[0] + a[2]) / 2.0 - (b[0] + b[2]) / 2.0
+    dx = (a[1] + a[3]) / 2.0 - (b[1] + b[3]) / 2.0
+    size = max(a[2] - a[0], a[1] - a[3], 1)
+    return (dx * dx + dy * dy) ** 0.5 / size
+
+
+class Track:
+    """One face followed across frames, with the identity recognized for it"""
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.student_id = None
+        self.distance = None
+        self.recognized_at = None  # When the identity was last confirmed
+
+    @property
+    def identified(self):
+        return self.recognized_at is not None
+
+    def needs_recognition(self, now, reverify_interval):
+        """New and uncertain tracks are recognized every frame, identified ones only periodically"""
+        if not self.identified:
+            return True
+        return reverify_interval is not None and now - self.recognized_at >= reverify_interval
+
+    def identify(self, match, now, confirmed=True):
+        """
+        Record the gallery match for this track's face. An unconfirmed identity
+        is kept as a label but the track is still recognized on the next frame.
+        """
+        if match.is_match:
+            if match.student_id != self.student_id:
+                self.recognized_at = None
+            self.student_id = match.student_id
+            self.distance = match.distance
+            if confirmed:
+                self.recognized_at = now
+        else:
+            self.student_id = None
+            self.distance = None
+            self.recognized_at = None
+
+
+class FaceTracker:
+    """
+    Associates the faces of consecutive frames by IoU (falling back to centroid
+    distance) so that a face identified once does not have to be encoded and
+    matched again on every frame.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.5, max_age=10.0,
+                 reverify_interval=60.0):
+        """
+        :param iou_threshold: Minimum IoU for a face to continue a track.
+        :param max_centroid_distance: Maximum centre shift (relative to face size) for
+                                      a face to continue a track when IoU is too low.
+        :param max_age: Seconds without a sighting before a track is evicted.
+        :param reverify_interval: Seconds before an identified track is recognized again
+                                  (None: never).
+        """
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_age = max_age
+        self.reverify_interval = reverify_interval
+        self.tracks = []
+        self._ids = count(1)
+
+    def update(self, boxes, now=None):
+        """
+        Associate the face boxes of a new frame with the existing tracks.
+
+        :param boxes: Face locations of the frame as (top, right, bottom, left).
+        :return: The track of every box, in the same order.
+        """
+        if now is None:
+            now = time.monotonic()
+        self.evict(now)
+
+        # Greedy association, best overlapping pairs first
+        candidates = []
+        for box_index, box in enumerate(boxes):
+            for track_index, track in enumerate(self.tracks):
+                iou = box_iou(box, track.box)
+                if iou >= self.iou_threshold:
+                    candidates.append((1.0 + iou, box_index, track_index))
+                else:
+                    shift = _centroid_distance(track.box, box)
+                    if shift <= self.max_centroid_distance:
+                        candidates.append((1.0 - shift, box_index, track_index))
+        candidates.sort(reverse=True)
+
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for _, box_index, track_index in candidates:
+            if assigned[box_index] is not None or track_index in used_tracks:
+                continue
+            track = self.tracks[track_index]
+            track.box = boxes[box_index]
+            track.last_seen = now
+            track.hits += 1
+            assigned[box_index] = track
+            used_tracks.add(track_index)
+
+        for box_index, box in enumerate(boxes):
+            if assigned[box_index] is None:
+                track = Track(next(self._ids), box, now)
+                self.tracks.append(track)
+                assigned[box_index] = track
+
+        return assigned
+
+    def needs_recognition(self, track, now=None):
+        if now is None:
+            now = time.monotonic()
+        return track.needs_recognition(now, self.reverify_interval)
+
+    def evict(self, now=None):
+        """Drop tracks that have not been seen for max_age seconds"""
+        if now is None:
+            now = time.monotonic()
+        self.tracks = [track for track in self.tracks if now - track.last_seen <= self.max_age]
+
+    def settled_boxes(self, now=None):
+        """Boxes of the identified tracks that do not need recognition yet"""
+        if now is None:
+            now = time.monotonic()
+        return [track.box for track in self.tracks if not self.needs_recognition(track, now)]
@@ -0,0 +1,73 @@
+import time
+from collections import Counter, defaultdict
+
+
+class EvidenceAccumulator:
+    """
+    Collects the matches of a session across frames and tracks, and commits a
+    student only once the evidence is strong enough: min_sightings consistent
+    sightings, or a total confidence of min_score.
+
+    A sighting is consistent when it comes from a track whose most frequent
+    identity is that student, so a track flickering between two people does
+    not vote for either. The confidence of a sighting is how far its distance
+    is below the tolerance, relative to the tolerance (0 at the tolerance, 1
+    for an exact match).
+    """
+
+    def __init__(self, tolerance=0.6, min_sightings=3, min_score=1.2, max_history=20):
+        """
+        :param tolerance: Distance at which a sighting stops counting as a match.
+        :param min_sightings: Consistent sightings that commit a student.
+        :param min_score: Total confidence that commits a student earlier.
+        :param max_history: Sightings kept per student as evidence.
+        """
+        self.tolerance = tolerance
+        self.min_sightings = min_sightings
+        self.min_score = min_score
+        self.max_history = max_history
+        self._track_votes = defaultdict(Counter)  # track ID -> votes per student
+        self._sightings = defaultdict(list)  # student ID -> [(time, track ID, distance)]
+        self.decisions = {}  # student ID -> evidence the commit was based on
+
+    def is_committed(self, student_id):
+        return student_id in self.decisions
+
+    def _consistent(self, student_id):
+        return [
+            sighting for sighting in self._sightings[student_id]
+            if self._track_votes[sighting[1]].most_common(1)[0][0] == student_id
+        ]
+
+    def observe(self, student_id, distance, track_id, now=None):
+        """
+        Record one match of a student.
+
+        :return: The decision when this sighting commits the student, otherwise None.
+        """
+        if now is None:
+            now = time.time()
+        if student_id in self.decisions:
+            return None
+
+        self._track_votes[track_id][student_id] += 1
+        sightings = self._sightings[student_id]
+        sightings.append((now, track_id, distance))
+        del sightings[:-self.max_history]
+
+        consistent = self._consistent(student_id)
+        score = sum(max(0.0, (self.tolerance - d) / self.tolerance) for _, _, d in consistent)
+        if len(consistent) < self.min_sightings and score < self.min_score:
+            return None
+
+        decision = {
+            "student_id": student_id,
+            "committed_at": now,
+            "sightings": len(consistent),
+            "score": round(score, 4),
+            "tracks": sorted({track for _, track, _ in consistent}),
+            "best_distance": min(d for _, _, d in consistent),
+            "distances": [round(d, 4) for _, _, d in consistent],
+        }
+        self.decisions[student_id] = decision
+        return decision
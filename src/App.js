@@ -167,10 +167,52 @@ function CourseScreen() {
   );
 }
 
+// Overlay colors per detection status, matching the backend's annotated frames
+const FACE_COLORS = {
+  marked: "#00FF00",
+  already_marked: "#FF8000",
+  verifying: "#FFFF00",
+  not_enrolled: "#FF0000",
+  unknown: "#FF0000",
+};
+
+const FACE_LABELS = {
+  marked: "Attendance Marked",
+  already_marked: "Already Marked",
+  verifying: "Verifying",
+  not_enrolled: "Not Enrolled",
+  unknown: "Unknown",
+};
+
+// Draw the detection results returned by /detect_frame over the video
+function drawFaces(canvas, width, height, faces) {
+  canvas.width = width;
+  canvas.height = height;
+  const context = canvas.getContext("2d");
+  context.clearRect(0, 0, width, height);
+  context.lineWidth = 2;
+  context.font = "16px sans-serif";
+
+  faces.forEach(({ box, name, status }) => {
+    const [top, right, bottom, left] = box;
+    const color = FACE_COLORS[status] || FACE_COLORS.unknown;
+    const label = name ? `${name} - ${FACE_LABELS[status]}` : FACE_LABELS[status];
+
+    context.strokeStyle = color;
+    context.strokeRect(left, top, right - left, bottom - top);
+    if (name) {
+      context.fillStyle = color;
+      context.fillRect(left, bottom - 35, right - left, 35);
+    }
+    context.fillStyle = "#FFFFFF";
+    context.fillText(label, left + 6, bottom - 6);
+  });
+}
+
 // Live Video Screen
 function LiveVideoScreen() {
   const videoRef = useRef(null);
-  const [processedFrame, setProcessedFrame] = useState(null);
+  const overlayRef = useRef(null);
   const [isProcessing, setIsProcessing] = useState(true);
   const processingIntervalRef = useRef(null);
   const [detectedStudents, setDetectedStudents] = useState(new Set());
@@ -236,17 +278,21 @@ function LiveVideoScreen() {
     const context = canvas.getContext("2d");
     context.drawImage(video, 0, 0, canvas.width, canvas.height);
 
-    const frameData = canvas.toDataURL("image/jpeg").split(",")[1];
+    // Send the raw JPEG bytes; only the detection results come back
+    const frameBlob = await new Promise((resolve) => canvas.toBlob(resolve, "image/jpeg"));
+    if (!frameBlob) return;
 
     try {
-      const response = await axios.post("/process_frame", {
-        frame: frameData,
-        major,
-        section,
-        course,
-      });
-
-      setProcessedFrame(response.data.processedFrame);
+      const response = await axios.post(
+        `/detect_frame/${major}/${section}/${course}`,
+        frameBlob,
+        { headers: { "Content-Type": "image/jpeg" } }
+      );
+
+      // Frames dropped by the backend while it catches up carry no results
+      if (!response.data.dropped && overlayRef.current) {
+        drawFaces(overlayRef.current, canvas.width, canvas.height, response.data.faces);
+      }
       
       // Update detected students set
       if (response.data.detectedStudents) {
@@ -257,6 +303,10 @@ function LiveVideoScreen() {
         });
       }
     } catch (error) {
+      // The backend is busy; skip this frame and keep going
+      if (error.response?.status === 503) {
+        return;
+      }
       console.error("Error processing frame:", error);
       setIsProcessing(false);
     }
@@ -301,19 +351,15 @@ function LiveVideoScreen() {
     <div style={styles.container}>
       <h1 style={styles.title}>Live Attendance</h1>
       <div style={styles.videoContainer}>
-        <video 
-          ref={videoRef} 
-          autoPlay 
-          style={styles.video} 
-          className={isProcessing ? styles.processingVideo : ''}
-        />
-        {processedFrame && (
-          <img
-            src={`data:image/jpeg;base64,${processedFrame}`}
-            alt="Processed Frame"
-            style={styles.processedVideo}
+        <div style={styles.videoFrame}>
+          <video 
+            ref={videoRef} 
+            autoPlay 
+            style={styles.video} 
+            className={isProcessing ? styles.processingVideo : ''}
           />
-        )}
+          <canvas ref={overlayRef} style={styles.overlay} />
+        </div>
       </div>
       <div style={styles.controlsContainer}>
         <div style={styles.status}>
@@ -478,19 +524,24 @@ const styles = {
     alignItems: 'center',
     width: '100%',
   },
-  video: {
+  videoFrame: {
+    position: 'relative',
     width: '100%',
     maxWidth: '640px',
-    height: 'auto',
-    backgroundColor: '#000',
-    objectFit: 'cover',
   },
-  processedVideo: {
+  video: {
+    display: 'block',
     width: '100%',
-    maxWidth: '640px',
     height: 'auto',
     backgroundColor: '#000',
-    border: '2px solid #4CAF50',
+  },
+  overlay: {
+    position: 'absolute',
+    top: 0,
+    left: 0,
+    width: '100%',
+    height: '100%',
+    pointerEvents: 'none',
   },
   controlsContainer: {
     display: 'flex',